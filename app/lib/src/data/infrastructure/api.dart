@@ -14,6 +14,10 @@ class TfrApi {
     ),
   );
 
+  /// Root of a static export of the API written by the data module, the
+  /// responses are read from its files instead of the API if set.
+  static const String _bundleRoot = String.fromEnvironment('BUNDLE_ROOT');
+
   static const String forecastDataSourceId = 'forecast';
   static const String tfrDatasetId = 'tfr';
   static const String tfrForecastDatasetId = 'tfr_forecast';
@@ -22,6 +26,7 @@ class TfrApi {
   static final Map<String, DataSource> _dataSourceCache = {};
   static final Map<String, Dataset> _datasetCache = {};
   static final Map<TimeSeriesAddress, TimeSeries> _timeSeriesCache = {};
+  static Future<Map<String, dynamic>>? _bundleManifest;
 
   static Future<bool> isApiAvailable() async {
     try {
@@ -126,21 +131,17 @@ class TfrApi {
   /// Get all regions the selected dataset has time series for.
   static Future<List<Region>> regionsForDataset(String datasetId) async {
     try {
-      // Fetch time series for the dataset.
-      final response = await _getResultsJson(
-        path: 'time_series',
-        queryParameters: {
-          'dataset': 'eq.$datasetId',
-        },
+      // Fetch region IDs from the dataset summary.
+      final summary = await _summary(
+        path: 'dataset_summary',
+        key: 'dataset',
+        id: datasetId,
+        column: 'regions',
       );
-      final timeSeriesList =
-          (response as List).map((e) => TimeSeries.fromMap(e)).toList();
-      _timeSeriesCache.addEntries(timeSeriesList.map((e) => MapEntry(
-          TimeSeriesAddress(datasetId: e.datasetId, regionId: e.regionId), e)));
       // Fetch regions by IDs.
       final List<Region> regions = [];
-      for (final timeSeries in timeSeriesList) {
-        regions.add(await singleRegion(timeSeries.regionId));
+      for (final regionId in (summary ?? const []) as List) {
+        regions.add(await singleRegion(regionId));
       }
       return regions;
     } catch (_) {
@@ -152,22 +153,17 @@ class TfrApi {
   static Future<List<Region>> correlatingRegionsForDataset(
       String datasetId) async {
     try {
-      // Fetch time series for the dataset.
-      final response = await _getResultsJson(
-        path: 'time_series',
-        queryParameters: {
-          'dataset': 'eq.$datasetId',
-          'correlation': 'eq.true',
-        },
+      // Fetch region IDs from the dataset summary.
+      final summary = await _summary(
+        path: 'dataset_summary',
+        key: 'dataset',
+        id: datasetId,
+        column: 'correlating_regions',
       );
-      final timeSeriesList =
-          (response as List).map((e) => TimeSeries.fromMap(e)).toList();
-      _timeSeriesCache.addEntries(timeSeriesList.map((e) => MapEntry(
-          TimeSeriesAddress(datasetId: e.datasetId, regionId: e.regionId), e)));
       // Fetch regions by IDs.
       final List<Region> regions = [];
-      for (final timeSeries in timeSeriesList) {
-        regions.add(await singleRegion(timeSeries.regionId));
+      for (final regionId in (summary ?? const []) as List) {
+        regions.add(await singleRegion(regionId));
       }
       return regions;
     } catch (_) {
@@ -180,22 +176,17 @@ class TfrApi {
   static Future<List<Region>> nonCorrelatingRegionsForDataset(
       String datasetId) async {
     try {
-      // Fetch time series for the dataset.
-      final response = await _getResultsJson(
-        path: 'time_series',
-        queryParameters: {
-          'dataset': 'eq.$datasetId',
-          'correlation': 'eq.false',
-        },
+      // Fetch region IDs from the dataset summary.
+      final summary = await _summary(
+        path: 'dataset_summary',
+        key: 'dataset',
+        id: datasetId,
+        column: 'non_correlating_regions',
       );
-      final timeSeriesList =
-          (response as List).map((e) => TimeSeries.fromMap(e)).toList();
-      _timeSeriesCache.addEntries(timeSeriesList.map((e) => MapEntry(
-          TimeSeriesAddress(datasetId: e.datasetId, regionId: e.regionId), e)));
       // Fetch regions by IDs.
       final List<Region> regions = [];
-      for (final timeSeries in timeSeriesList) {
-        regions.add(await singleRegion(timeSeries.regionId));
+      for (final regionId in (summary ?? const []) as List) {
+        regions.add(await singleRegion(regionId));
       }
       return regions;
     } catch (_) {
@@ -223,25 +214,17 @@ class TfrApi {
   static Future<List<Dataset>> correlatingDatasetsForRegion(
       String regionId) async {
     try {
-      final response = await _getResultsJson(
-        path: 'time_series',
-        queryParameters: {
-          'region': 'eq.$regionId',
-          'correlation': 'eq.true',
-        },
+      // Fetch dataset IDs from the region summary.
+      final summary = await _summary(
+        path: 'region_summary',
+        key: 'region',
+        id: regionId,
+        column: 'correlating_datasets',
       );
-      final timeSeriesList =
-          (response as List).map((e) => TimeSeries.fromMap(e)).toList();
-      _timeSeriesCache.addEntries(timeSeriesList.map((e) => MapEntry(
-          TimeSeriesAddress(
-            datasetId: e.datasetId,
-            regionId: e.regionId,
-          ),
-          e)));
       // Fetch datasets by IDs.
       final List<Dataset> datasets = [];
-      for (final timeSeries in timeSeriesList) {
-        datasets.add(await singleDataset(timeSeries.datasetId));
+      for (final datasetId in (summary ?? const []) as List) {
+        datasets.add(await singleDataset(datasetId));
       }
       return datasets;
     } catch (_) {
@@ -269,7 +252,13 @@ class TfrApi {
 
   static Future<int> timeSeriesCount() async {
     try {
-      return await _getResultsCount(path: 'time_series');
+      final response = await _getResultsJson(
+        path: 'overall_summary',
+        queryParameters: {
+          'select': 'n_series',
+        },
+      );
+      return (response as List).isEmpty ? 0 : response[0]['n_series'] as int;
     } catch (_) {
       throw const ApiResponseException();
     }
@@ -277,12 +266,13 @@ class TfrApi {
 
   static Future<int> timeSeriesInDatasetCount(String datasetId) async {
     try {
-      return await _getResultsCount(
-        path: 'time_series',
-        queryParameters: {
-          'dataset': 'eq.$datasetId',
-        },
+      final summary = await _summary(
+        path: 'dataset_summary',
+        key: 'dataset',
+        id: datasetId,
+        column: 'n_series',
       );
+      return (summary ?? 0) as int;
     } catch (_) {
       throw const ApiResponseException();
     }
@@ -303,12 +293,13 @@ class TfrApi {
 
   static Future<int> correlationsCount() async {
     try {
-      return await _getResultsCount(
-        path: 'time_series',
+      final response = await _getResultsJson(
+        path: 'overall_summary',
         queryParameters: {
-          'correlation': 'eq.true',
+          'select': 'n_correlations',
         },
       );
+      return (response as List).isEmpty ? 0 : response[0]['n_correlations'] as int;
     } catch (_) {
       throw const ApiResponseException();
     }
@@ -316,23 +307,44 @@ class TfrApi {
 
   static Future<int> correlationsInRegionCount(String regionId) async {
     try {
-      return await _getResultsCount(
-        path: 'time_series',
-        queryParameters: {
-          'region': 'eq.$regionId',
-          'correlation': 'eq.true',
-        },
+      final summary = await _summary(
+        path: 'region_summary',
+        key: 'region',
+        id: regionId,
+        column: 'n_correlations',
       );
+      return (summary ?? 0) as int;
     } catch (_) {
       throw const ApiResponseException();
     }
   }
 
+  /// Get a column of a summary computed by the data module for a dataset
+  /// or a region, null if there is no summary.
+  static Future<dynamic> _summary({
+    required String path,
+    required String key,
+    required String id,
+    required String column,
+  }) async {
+    final response = await _getResultsJson(
+      path: path,
+      queryParameters: {
+        key: 'eq.$id',
+        'select': column,
+      },
+    );
+    return (response as List).isEmpty ? null : response[0][column];
+  }
+
   /// Get a parsed response body from the API.
   static Future<dynamic> _getResultsJson({
     required String path,
     Map<String, dynamic>? queryParameters,
   }) async {
+    if (_bundleRoot.isNotEmpty) {
+      return _getBundledJson(path: path, queryParameters: queryParameters);
+    }
     final url = _apiRoot.replace(path: path, queryParameters: queryParameters);
     try {
       final response = await http.get(url);
@@ -347,6 +359,11 @@ class TfrApi {
     required String path,
     Map<String, dynamic>? queryParameters,
   }) async {
+    if (_bundleRoot.isNotEmpty) {
+      final manifest = await _getBundleManifest();
+      return (manifest['counts'][_bundleRequest(path, queryParameters)] ?? 0)
+          as int;
+    }
     final url = _apiRoot.replace(path: path, queryParameters: queryParameters);
     try {
       final response = await http.head(
@@ -359,6 +376,53 @@ class TfrApi {
       throw const ApiUnavailableException();
     }
   }
+
+  /// Get a parsed response body from the static export, an empty list
+  /// if the export has no response to the query.
+  static Future<dynamic> _getBundledJson({
+    required String path,
+    Map<String, dynamic>? queryParameters,
+  }) async {
+    final manifest = await _getBundleManifest();
+    if (path.isEmpty) {
+      return manifest;
+    }
+    final file = manifest['files'][_bundleRequest(path, queryParameters)];
+    if (file == null) {
+      return const [];
+    }
+    try {
+      final response = await http.get(Uri.parse(_bundleRoot).resolve(file));
+      return jsonDecode(response.body);
+    } catch (_) {
+      throw const ApiUnavailableException();
+    }
+  }
+
+  /// Get the manifest of the static export mapping the API requests
+  /// to the response files, loaded once.
+  static Future<Map<String, dynamic>> _getBundleManifest() {
+    return _bundleManifest ??= () async {
+      try {
+        final response =
+            await http.get(Uri.parse(_bundleRoot).resolve('index.json'));
+        return jsonDecode(response.body) as Map<String, dynamic>;
+      } catch (_) {
+        // Try again with the next request.
+        _bundleManifest = null;
+        throw const ApiUnavailableException();
+      }
+    }();
+  }
+
+  /// API request the static export keys the response by,
+  /// e.g. time_series?dataset=eq.tfr&region=eq.cze.
+  static String _bundleRequest(
+    String path,
+    Map<String, dynamic>? queryParameters,
+  ) {
+    return Uri(path: path, queryParameters: queryParameters).toString();
+  }
 }
 
 class ApiUnavailableException implements Exception {
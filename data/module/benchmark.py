@@ -0,0 +1,229 @@
+"""Benchmarks of the data processing
+Times the processors and the storage saving on synthetic data and records
+the results to a JSON history to catch performance regressions.
+
+Usage: python benchmark.py [--regions 30] [--datasets 20] [--years 60] [--check] ...
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from lib import serialization, utils
+from lib.db import Connection
+from lib.storage import Storage
+from lib.synthetic import synthetic_storage
+from processors import intercorr, paircorr, forecasting
+
+class SqliteConnection(Connection):
+    """In-memory SQLite stand-in of the database connection
+    Runs the same inserts as a snapshot save, for benchmarking without PostgreSQL.
+    """
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.cur = self.conn.cursor()
+        self.rows_written = 0
+        self.rows_copied = 0
+
+        self.cur.executescript("""
+            CREATE TABLE region (id text PRIMARY KEY, name text NOT NULL);
+            CREATE TABLE data_source (id text PRIMARY KEY, name text NOT NULL,
+                description text, url text);
+            CREATE TABLE dataset (id text PRIMARY KEY, data_source text NOT NULL REFERENCES data_source,
+                name text NOT NULL, description text NOT NULL, url text NOT NULL, unit text NOT NULL,
+                p_values_per_year text, r_values_per_year text, correlation_values_per_year text);
+            CREATE TABLE time_series (dataset text NOT NULL REFERENCES dataset,
+                region text NOT NULL REFERENCES region, series text NOT NULL, processed_series text,
+                lag real, slope real, intercept real, r_value real, p_value real, std_err real,
+                correlation boolean, PRIMARY KEY (dataset, region));
+            CREATE TABLE observation (dataset text NOT NULL, region text NOT NULL, year integer NOT NULL,
+                value real NOT NULL, processed_value real, PRIMARY KEY (dataset, region, year),
+                FOREIGN KEY (dataset, region) REFERENCES time_series);
+            CREATE TABLE inter_region_correlation (dataset text NOT NULL REFERENCES dataset,
+                year integer NOT NULL, p_value real, r_value real,
+                correlation boolean NOT NULL, PRIMARY KEY (dataset, year));
+        """)
+
+    def save_storage(self, storage: Storage):
+        """Insert all records of the storage into the empty in-memory tables"""
+
+        self._write_storage(storage)
+        self.conn.commit()
+
+    def _insert(self, query: str, rows: list[tuple]):
+        """Execute the statement for all rows with SQLite placeholders"""
+
+        if len(rows) == 0:
+            return
+
+        placeholders = '(' + ', '.join('?' * len(rows[0])) + ')'
+        self.cur.executemany(query.replace('%s', placeholders), rows)
+        self.rows_written += len(rows)
+
+    def _write_summaries(self):
+        """Skipped, the summaries use PostgreSQL aggregates and are measured with --postgres"""
+
+def measure(function, repeat: int) -> dict:
+    """Call the function repeatedly, return the minimal and median time in seconds"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+
+def benchmarks(storage: Storage, args: argparse.Namespace) -> dict:
+    """Run all benchmarks on the storage, return their timings by name"""
+
+    results = {}
+    datasets = [dataset for data_source in storage.data_sources.values()
+        for dataset in data_source.datasets.values()]
+    all_time_series = [time_series for dataset in datasets for time_series in dataset.time_series.values()]
+
+    print('- paircorr.best_lag')
+    region = next(iter(storage.tfr_dataset.time_series))
+    tfr = storage.tfr_dataset.time_series[region].series.diff().iloc[1:]
+    other = next(time_series for time_series in all_time_series
+        if time_series.region is region and time_series.dataset is not storage.tfr_dataset).series.diff().iloc[1:]
+    calls = 100
+    results['paircorr.best_lag'] = measure(
+        lambda: [paircorr.best_lag(tfr, other) for _ in range(calls)], args.repeat)
+    results['paircorr.best_lag']['calls'] = calls
+
+    print('- paircorr.process')
+    results['paircorr.process'] = measure(lambda: paircorr.process(storage), args.repeat)
+
+    print('- intercorr.process')
+    results['intercorr.process'] = measure(lambda: intercorr.process(storage), args.repeat)
+
+    print('- Dataset.all_series')
+    results['Dataset.all_series'] = measure(
+        lambda: [dataset.all_series(storage.regions) for dataset in datasets], args.repeat)
+
+    print('- utils.strip_nans')
+    padded = [pd.concat([pd.Series([np.nan] * 3), time_series.series, pd.Series([np.nan] * 3)],
+        ignore_index=True) for time_series in all_time_series]
+    results['utils.strip_nans'] = measure(
+        lambda: [utils.strip_nans(series) for series in padded], args.repeat)
+
+    print('- utils.trim_interpolate_rows')
+    matrix = utils.year_matrix(padded, 0, max(series.size for series in padded) - 1)
+    results['utils.trim_interpolate_rows'] = measure(
+        lambda: utils.trim_interpolate_rows(matrix, range(matrix.shape[1])), args.repeat)
+
+    print('- serialization.encode_rows')
+    results['serialization.encode_rows'] = measure(
+        lambda: [serialization.encode_rows([str(year) for year in dataset.years], *dataset.matrix())
+            for dataset in datasets], args.repeat)
+
+    print('- SqliteConnection.save_storage')
+    results['Connection.save_storage.sqlite'] = measure(
+        lambda: SqliteConnection().save_storage(storage), args.repeat)
+
+    if args.postgres:
+        print('- Connection.save_snapshot (PostgreSQL)')
+        connection = Connection()
+        results['Connection.save_snapshot.postgres'] = measure(
+            lambda: connection.save_snapshot(storage, keep=2), args.repeat)
+
+    if args.forecasting > 0:
+        print('- forecasting.process')
+        small = synthetic_storage(args.forecasting, 0, args.years, args.missing, args.seed)
+        results['forecasting.process'] = measure(
+            lambda: forecasting.process(small, workers=args.workers, cache=False), 1)
+
+    return results
+
+def compare(results: dict, previous: dict, tolerance: float) -> list[str]:
+    """Print the change against the previous results, return the names of slower benchmarks"""
+
+    regressions = []
+    for name, timing in results.items():
+        line = f'{name}: {timing["min"] * 1000:.2f} ms'
+        if name in previous:
+            ratio = timing['min'] / previous[name]['min']
+            line += f' ({ratio:.2f}x previous)'
+            if ratio > 1 + tolerance:
+                line += ' REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    return regressions
+
+def git_commit() -> str:
+    """Commit of the benchmarked code, None if unknown"""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data processing on synthetic data')
+    parser.add_argument('--regions', type=int, default=30, help='number of regions')
+    parser.add_argument('--datasets', type=int, default=20, help='number of datasets besides TFR')
+    parser.add_argument('--years', type=int, default=60, help='maximum number of years of a time series')
+    parser.add_argument('--missing', type=float, default=0.1,
+        help='probability of a missing time series and of a missing value')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of each benchmark')
+    parser.add_argument('--forecasting', type=int, default=0, metavar='REGIONS',
+        help='also benchmark forecasting of this many regions, slow')
+    parser.add_argument('--workers', type=int, default=None, help='forecasting processes')
+    parser.add_argument('--postgres', action='store_true',
+        help='also benchmark saving into the database given by the POSTGRES_* variables')
+    parser.add_argument('--history', default=os.path.join(utils.cache_path('benchmarks'), 'history.json'),
+        help='JSON file with the results of the previous runs')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='relative slowdown against the previous run reported as a regression')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 on a regression')
+    args = parser.parse_args()
+
+    config = {name: getattr(args, name) for name in ('regions', 'datasets', 'years', 'missing', 'seed')}
+
+    print('Building synthetic storage')
+    storage = synthetic_storage(**config)
+
+    print('Running benchmarks')
+    results = benchmarks(storage, args)
+
+    try:
+        with open(args.history, encoding='utf-8') as file:
+            history = json.load(file)
+    except FileNotFoundError:
+        history = []
+
+    # Only runs on data of the same shape are comparable
+    previous = next((entry['results'] for entry in reversed(history) if entry['config'] == config), {})
+
+    print('Results')
+    regressions = compare(results, previous, args.tolerance)
+
+    history.append({
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'config': config,
+        'results': results,
+    })
+    os.makedirs(os.path.dirname(args.history) or '.', exist_ok=True)
+    with open(args.history + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(history, file, indent=2)
+    os.replace(args.history + '.tmp', args.history)
+
+    if args.check and regressions:
+        sys.exit(1)
@@ -1,22 +1,42 @@
 """Data.gov.cz data source collector"""
 
+import io
+
 import pandas as pd
 
+from lib.fetch import fetcher
 from lib.storage import Storage, DataSource, Dataset, TimeSeries
 
+# Id of the data source in the storage
+DATA_SOURCE_ID = 'datagovcz'
+
+# Source files of the datasets
+PENSIONS = 'https://data.cssz.cz/dump/duchody-dle-veku.csv'
+SCHOOLS = 'https://www.czso.cz/documents/62353418/143522558/230057-21data102921.csv'
+APARTMENTS = 'https://www.czso.cz/documents/62353418/143522520/200068-21data060821.zip'
+UNEMPLOYMENT = 'https://www.czso.cz/documents/62353418/143520414/250180-21data123021.csv'
+WAGES = 'https://www.czso.cz/documents/62353418/143522174/110080-21data052421.csv'
+
+def prefetch():
+    """Start downloading the data source files"""
+
+    fetcher.prefetch([PENSIONS, SCHOOLS, APARTMENTS, UNEMPLOYMENT, WAGES])
+
 def collect(storage: Storage):
     """Collect data from the data source"""
 
     data_source = DataSource(
-        'datagovcz',
+        DATA_SOURCE_ID,
         'Národní katalog otevřených dat ČR',
         'Otevřená data zveřejňovaná institucemi českého státu',
         'https://data.gov.cz/')
     region = storage.regions['cze']
 
+    prefetch()
+
     # Pensions
     print('  - Pensions')
-    data = pd.read_csv('https://data.cssz.cz/dump/duchody-dle-veku.csv')
+    data = pd.read_csv(io.BytesIO(fetcher.get(PENSIONS)))
 
     # Extract data
     data = data[(data['pohlavi_kod'] == 'T') & (data['vek_kod'] == '0+')]
@@ -52,7 +72,7 @@ def collect(storage: Storage):
 
     # Schools
     print('  - Schools')
-    data = pd.read_csv('https://www.czso.cz/documents/62353418/143522558/230057-21data102921.csv')
+    data = pd.read_csv(io.BytesIO(fetcher.get(SCHOOLS)))
 
     # Extract data
     data = data[(data['vuzemi_cis'] == 97)
@@ -78,7 +98,7 @@ def collect(storage: Storage):
 
     # Apartments
     print('  - Apartments')
-    data = pd.read_csv('https://www.czso.cz/documents/62353418/143522520/200068-21data060821.zip', compression='zip')
+    data = pd.read_csv(io.BytesIO(fetcher.get(APARTMENTS)), compression='zip')
 
     # Extract data
     data = data.groupby(['rok'])['hodnota'].sum()
@@ -97,7 +117,7 @@ def collect(storage: Storage):
     data_source.add_dataset(dataset)
 
     # Unemployment by sex
-    data = pd.read_csv('https://www.czso.cz/documents/62353418/143520414/250180-21data123021.csv')
+    data = pd.read_csv(io.BytesIO(fetcher.get(UNEMPLOYMENT)))
 
     # Extract data
     data_men = data[(data['stapro_txt'] == 'Obecná míra nezaměstnanosti')
@@ -136,7 +156,7 @@ def collect(storage: Storage):
     data_source.add_dataset(dataset)
 
     # Wages
-    data = pd.read_csv('https://www.czso.cz/documents/62353418/143522174/110080-21data052421.csv')
+    data = pd.read_csv(io.BytesIO(fetcher.get(WAGES)))
 
     # Extract data
     data_men = data[(data['POHLAVI_kod'] == 1)
@@ -1,16 +1,26 @@
 """Eurostat data source collector"""
 
+import gzip
+import io
+
 import pandas as pd
 import numpy as np
 
 from lib import utils
+from lib.fetch import fetcher
 from lib.storage import Storage, DataSource, Dataset, TimeSeries
 
+# Id of the data source in the storage
+DATA_SOURCE_ID = 'eurostat'
+
 # Human-usable URL to put into eurostat_id metadata
 LINK = 'https://ec.europa.eu/eurostat/databrowser/view/%s/default/table'
 
 # API to fetch the datasets from
-API = 'https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/data/%s?format=TSV'
+API = 'https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/data/%s?format=TSV&compressed=true'
+
+# Number of rows of a file parsed at once
+CHUNK_SIZE = 10000
 
 # Regions to collect the datasets for
 # Eurostat country codes along with DB codes
@@ -174,39 +184,112 @@ datasets = {
     ]
 }
 
+def prefetch():
+    """Start downloading the data source files"""
+
+    fetcher.prefetch([API % dataset_id for dataset_id in datasets])
+
+class _SplitDimensions(io.RawIOBase):
+    """Stream of a bulk TSV file with the comma-separated dimensions split into tab-separated columns
+    Values and flags never contain commas, so all commas can be replaced.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer)).replace(b',', b'\t')
+        buffer[:len(data)] = data
+        return len(data)
+
+def read_tsv(body: bytes, filters: list[dict[str, str]], geo: list[str]) \
+        -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    """Read the rows of a bulk TSV file matching one of the filters and one of the regions
+    The file is read in chunks, so that only the selected rows are kept in memory.
+    body: contents of the file, optionally gzip-compressed
+    filters: values of the dimensions a row must have, e.g. {'sex': 'F'}
+    geo: Eurostat codes of the regions
+
+    Returns:
+    - dimensions of the selected rows, one column per dimension
+    - values of the selected rows without flags, one column per year, NaN if missing
+    - years of the value columns
+    """
+
+    stream = io.BytesIO(body)
+    if body[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+
+    stream = io.BufferedReader(_SplitDimensions(stream))
+
+    # Columns of the dimensions are followed by the years, the last one is e.g. geo\TIME_PERIOD
+    columns = stream.readline().decode().rstrip('\r\n').split('\t')
+    last = next((position for position, column in enumerate(columns) if '\\' in column), None)
+    if last is None:
+        raise ValueError('Eurostat TSV file without a header of dimensions and years')
+    dimensions = columns[:last + 1]
+    names = dimensions[:-1] + [dimensions[-1].split(sep='\\')[0]]
+
+    # Strip trailing whitespace from the years
+    years = [column.strip() for column in columns[last + 1:]]
+
+    keys = [pd.DataFrame(columns=names, dtype=str)]
+    cells = [np.empty((0, len(years)), dtype=object)]
+    with pd.read_csv(stream, sep='\t', header=None, names=columns, dtype=str,
+            chunksize=CHUNK_SIZE) as reader:
+        for chunk in reader:
+            chunk_keys = chunk[dimensions]
+            chunk_keys.columns = names
+
+            selected = np.zeros(len(chunk), dtype=bool)
+            for conditions in filters:
+                matches = np.ones(len(chunk), dtype=bool)
+                for dimension, value in conditions.items():
+                    matches &= (chunk_keys[dimension] == value).to_numpy()
+                selected |= matches
+            selected &= chunk_keys['geo'].isin(geo).to_numpy()
+
+            keys.append(chunk_keys[selected])
+            cells.append(chunk.drop(columns=dimensions)[selected].to_numpy(dtype=object))
+
+    # Values are followed by optional flags, ':' marks a missing value
+    cells = pd.Series(np.concatenate(cells).ravel(), dtype=object)
+    values = pd.to_numeric(cells, errors='coerce')
+
+    # Only values with flags are left to be split from them
+    flagged = cells[values.isna() & cells.notna()]
+    values.loc[flagged.index] = flagged.str.split(' ', n=1).str[0] \
+        .where(~flagged.str.contains(':', regex=False)).astype(np.float64)
+    keys = pd.concat(keys).reset_index(drop=True)
+    values = values.to_numpy(dtype=np.float64).reshape(len(keys), len(years))
+
+    return keys, values, years
+
 def collect(storage: Storage):
     """Collect data from the data source"""
 
     data_source = DataSource(
-        'eurostat',
+        DATA_SOURCE_ID,
         'Eurostat',
         'Statistický úřad Evropské unie',
         'https://ec.europa.eu/eurostat')
 
+    prefetch()
     for dataset_id, subsets in datasets.items():
-        data = pd.read_csv(API % dataset_id, sep='\t')
-
-        # Prepare data for filtering
-
-        # Split leading column into separate columns
-        leading_col = data.columns[0]
-        leading_cols = data.columns[0].split(sep='\\')[0].split(sep=',')
-        data[leading_cols] = pd.DataFrame(data[leading_col].apply(lambda x: x.split(sep=',')).to_list(), index=data.index)
-        data.drop(leading_col, axis=1, inplace=True)
-
-        # Replace ':' followed by optional flags with NaN
-        data.replace(regex=':.*', value=np.NaN, inplace=True)
-
-        # Strip trailing whitespace from column names
-        data.rename(mapper=lambda x: x.strip(), axis=1, inplace=True)
+        keys, values, years = read_tsv(fetcher.get(API % dataset_id),
+            [props['filter'] for props in subsets], list(regions))
+        geo = keys['geo'].to_numpy()
 
         # Filter out datasets
         for props in subsets:
             print('  - ' + props['name'])
 
-            filtered_data = pd.DataFrame(data)
+            filtered = np.ones(len(keys), dtype=bool)
             for filter_by in props['filter']:
-                filtered_data = filtered_data[data[filter_by] == props['filter'][filter_by]]
+                filtered &= (keys[filter_by] == props['filter'][filter_by]).to_numpy()
 
             dataset = Dataset(
                 props['id'],
@@ -216,30 +299,17 @@ def collect(storage: Storage):
                 LINK % dataset_id,
                 props['unit'])
 
-            # Extract per-country data
-            for region, region_id in regions.items():
-                region_data = filtered_data[data['geo'] == region]
-
-                if region_data.size == 0:
-                    continue
-
-                # Create Series without the values used for filtering
-                region_data = region_data.transpose()
-                region_data.drop(index=leading_cols, inplace=True)
-                region_data = region_data[region_data.columns[0]].squeeze()
+            # Rows of the regions with data, the first matching row of each region is used
+            region_rows = {region_id: np.flatnonzero(filtered & (geo == region))
+                for region, region_id in regions.items()}
+            region_rows = {region_id: rows[0] for region_id, rows in region_rows.items() if rows.size != 0}
 
-                # Strip flags and trailing spaces from the values
-                region_data = region_data \
-                    .apply(lambda x: str(x)
-                    .split(' ', maxsplit=1)[0]) \
-                    .astype(np.float64)
-
-                # Strip leading and trailing NaNs and interpolate intermediary missing values
-                region_data = utils.strip_nans(region_data)
-                region_data = region_data.interpolate()
-
-                region_data.name = props['id']
+            # Strip leading and trailing NaNs and interpolate intermediary missing values of all regions at once
+            all_region_data = utils.trim_interpolate_rows(
+                values[list(region_rows.values())].reshape(-1, len(years)), years, props['id'])
 
+            # Extract per-country data
+            for region_id, region_data in zip(region_rows, all_region_data):
                 # Save data
                 if region_data.size != 0:
                     dataset.add_time_series(TimeSeries(
@@ -1,12 +1,16 @@
 """Google Trends data source collector"""
 
-import time
-
 import pandas as pd
+from pytrends.exceptions import ResponseError
 from pytrends.request import TrendReq
 
+from lib.checkpoint import Checkpoint
+from lib.fetch import RateLimiter
 from lib.storage import Storage, DataSource, Dataset, TimeSeries
 
+# Id of the data source in the storage
+DATA_SOURCE_ID = 'google_trends'
+
 BASE_URL = 'https://trends.google.com/trends/explore?date=all&q=%s'
 UNIT = 'frekvence vyhledávání'
 
@@ -152,45 +156,119 @@ other_regions = {
     'GB': 'gbr'
 }
 
-pytrends = TrendReq(hl='en-US', tz=0)
+# Maximum number of terms Google Trends accepts in a single request
+BATCH_SIZE = 5
+
+# Terms with a lower peak in a batch request are requested alone
+# to avoid losing precision to rounding of the values
+MIN_BATCH_PEAK = 25
+
+# Number of retries of a request refused because of rate limiting
+RETRIES = 8
+
+# Client connecting to Google on creation, created once first needed
+pytrends: TrendReq = None
+
+# Avoid rate limiting
+limiter = RateLimiter(rate=1)
 
 def fetch(term, region, timeframe='all'):
     """Fetch data for a term, return yearly mean values"""
 
-    # Fetch monthly data
-    pytrends.build_payload([term], timeframe=timeframe, geo=region)
-    data = pytrends.interest_over_time()
+    return fetch_batch([term], region, timeframe)[term]
 
-    if data.empty:
-        return data
+def fetch_batch(terms: list[str], region: str, timeframe='all') -> dict[str, pd.Series]:
+    """Fetch data for up to BATCH_SIZE terms in a single request, return yearly mean values
+    of each term scaled as if it was requested alone
+    """
+
+    data = _request(terms, region, timeframe)
+
+    results: dict[str, pd.Series] = {}
+    for term in terms:
+        if data.empty:
+            results[term] = pd.Series(dtype='float64')
+            continue
+
+        # Values of all terms are relative to the peak of the most searched one
+        monthly = data[term]
+        peak = monthly.max()
+        if len(terms) > 1 and 0 < peak < MIN_BATCH_PEAK:
+            results[term] = fetch(term, region, timeframe)
+            continue
+        if len(terms) > 1 and peak > 0:
+            monthly = monthly * 100 / peak
+
+        # Convert to yearly values as mean of months
+        yearly = monthly.groupby(monthly.index.strftime('%Y')).mean()
+        yearly.index.name = 'date'
+        yearly.name = 'value'
+        results[term] = yearly
+
+    return results
 
-    if 'isPartial' in data.columns:
-        data.drop(columns='isPartial', inplace=True)
+def _request(terms: list[str], region: str, timeframe: str) -> pd.DataFrame:
+    """Request monthly interest in the terms, wait and retry while rate limited"""
 
-    # Convert to yearly values as mean of months
-    data.reset_index(level=0, inplace=True)
-    data.date = data.date.astype('string')
-    data = pd.concat([
-        data.date.str[0:4],
-        data[term]
-        ], axis=1)
-    data.rename(columns = {term: 'value'}, inplace=True)
-    data.set_index('date', inplace=True)
-    return data.groupby(['date'])['value'].mean()
+    global pytrends
+    if pytrends is None:
+        pytrends = TrendReq(hl='en-US', tz=0)
 
-def collect(storage: Storage):
-    """Collect data from the data source"""
+    for attempt in range(RETRIES + 1):
+        limiter.acquire()
+        try:
+            pytrends.build_payload(terms, timeframe=timeframe, geo=region)
+            data = pytrends.interest_over_time()
+        except ResponseError as error:
+            if error.response.status_code != 429 or attempt == RETRIES:
+                raise
+            limiter.throttled()
+            continue
+
+        limiter.succeeded()
+
+        if 'isPartial' in data.columns:
+            data = data.drop(columns='isPartial')
+
+        return data
+
+def prefetch():
+    """Nothing is downloaded in advance, Google Trends is queried
+    sequentially to avoid rate limiting
+    """
+
+def collect(storage: Storage, checkpoint: Checkpoint = None):
+    """Collect data from the data source
+    checkpoint: saves the data fetched after each request, data saved by
+    a failed collection are reused
+    """
 
     data_source = DataSource(
-        'google_trends',
+        DATA_SOURCE_ID,
         'Google Trends',
         'Historie vyhledávání na Google. Ukazatele ve formě témat sdružují související termíny a klíčová slova. Témata se týkají mateřství, sňatku, péče o dítě a ekonomických souvislostí s rodičovstvím.',
         'https://trends.google.com/')
 
+    # Fetch data of all terms for all regions, a few terms at once
+    fetched: dict[tuple[str, str], pd.Series] = {}
+    if checkpoint is not None:
+        fetched = checkpoint.load_partial(DATA_SOURCE_ID) or {}
+    terms = list(datasets.keys())
+    for start in range(0, len(terms), BATCH_SIZE):
+        batch = terms[start:start + BATCH_SIZE]
+        print('  - ' + ', '.join(datasets[term]['name'] for term in batch))
 
-    for term, props in datasets.items():
-        print('  - ' + props['name'])
+        for region in list(europe.keys()) + list(other_regions.keys()):
+            missing = [term for term in batch if (term, region) not in fetched]
+            if len(missing) == 0:
+                continue
+
+            for term, data in fetch_batch(missing, region).items():
+                fetched[(term, region)] = data
+            if checkpoint is not None:
+                checkpoint.save_partial(DATA_SOURCE_ID, fetched)
 
+    for term, props in datasets.items():
         dataset = Dataset(
             props['id'],
             data_source,
@@ -202,7 +280,7 @@ def collect(storage: Storage):
         # Process European Union countries
         europe_data = pd.Series(dtype='float64')
         for country, region_id in europe.items():
-            data = fetch(term=term, region=country)
+            data = fetched[(term, country)]
 
             if not data.empty:
                 europe_data = pd.concat([europe_data, data])
@@ -215,9 +293,6 @@ def collect(storage: Storage):
                     data
                 ))
 
-            # Avoid rate limiting
-            time.sleep(1)
-
         # Create a European mean
         europe_data = europe_data.groupby(level=0).mean()
 
@@ -226,12 +301,12 @@ def collect(storage: Storage):
             data_source,
             dataset,
             storage.regions['euu'],
-            data
+            europe_data
         ))
 
         # Collect data for other regions
         for region, region_id in other_regions.items():
-            data = fetch(term=term, region=region)
+            data = fetched[(term, region)]
 
             if not data.empty:
                 # Save data
@@ -242,9 +317,6 @@ def collect(storage: Storage):
                     data
                 ))
 
-            # Avoid rate limiting
-            time.sleep(1)
-
         data_source.add_dataset(dataset)
 
     storage.add_data_source(data_source)
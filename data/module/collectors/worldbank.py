@@ -1,14 +1,28 @@
 """World Bank data source collector"""
 
 import datetime
+import json
 
-import world_bank_data as wb
+import numpy as np
 
 from lib import utils
+from lib.fetch import fetcher
 from lib.storage import Storage, DataSource, Dataset, TimeSeries
 
+# Id of the data source in the storage
+DATA_SOURCE_ID = 'world_bank'
+
 LINK = 'https://databank.worldbank.org/reports.aspx?source=2&series=%s'
 
+# API to fetch the indicators of the countries from, multiple indicators need the source (2 for WDI)
+API = 'https://api.worldbank.org/v2/country/%s/indicator/%s?source=2&format=json&date=%s&per_page=%d&page=%d'
+
+# Maximum number of values of a response
+PER_PAGE = 20000
+
+# First year to collect the data since
+FIRST_YEAR = 1980
+
 # Datasets to collect along with their metadata
 datasets = {
     'SP.DYN.TFRT.IN': {
@@ -132,18 +146,75 @@ regions = [
     'GBR'
 ]
 
+def urls(page: int = 1) -> list[str]:
+    """URLs of the requests for all datasets and regions
+    Datasets are requested in batches small enough for all their values to fit into a page.
+    """
+
+    last_year = datetime.date.today().year
+    batch_size = max(PER_PAGE // (len(regions) * (last_year - FIRST_YEAR + 1)), 1)
+    dataset_ids = list(datasets)
+
+    return [API % (';'.join(regions), ';'.join(dataset_ids[start:start + batch_size]),
+        f'{FIRST_YEAR}:{last_year}', PER_PAGE, page)
+        for start in range(0, len(dataset_ids), batch_size)]
+
+def prefetch():
+    """Start downloading the datasets"""
+
+    fetcher.prefetch(urls())
+
+def read_values(url: str) -> list[dict]:
+    """Values of the indicators from all pages of the response to the request URL"""
+
+    page_info, *values = json.loads(fetcher.get(url))
+    if 'message' in page_info:
+        raise ValueError(f'{page_info["message"][0]["value"]}, url={url}')
+
+    values = values[0] if values and values[0] else []
+    for page in range(2, int(page_info['pages']) + 1):
+        values.extend(json.loads(fetcher.get(url.replace('&page=1', f'&page={page}')))[1])
+
+    return values
+
+def read_matrix(values: list[dict]) -> tuple[np.ndarray, list[str]]:
+    """Place the values of the indicators into matrices
+    Returns a dataset × region × year array in the order of the datasets and regions
+    and the years of its last axis.
+    """
+
+    last_year = datetime.date.today().year
+    years = [str(year) for year in range(FIRST_YEAR, last_year + 1)]
+    dataset_positions = {dataset_id: position for position, dataset_id in enumerate(datasets)}
+    region_positions = {region: position for position, region in enumerate(regions)}
+
+    matrix = np.full((len(datasets), len(regions), len(years)), np.nan)
+    values = [value for value in values if value['value'] is not None
+        and value['countryiso3code'] in region_positions
+        and value['indicator']['id'] in dataset_positions
+        and FIRST_YEAR <= int(value['date']) <= last_year]
+    if values:
+        matrix[
+            [dataset_positions[value['indicator']['id']] for value in values],
+            [region_positions[value['countryiso3code']] for value in values],
+            [int(value['date']) - FIRST_YEAR for value in values],
+        ] = [value['value'] for value in values]
+
+    return matrix, years
+
 def collect(storage: Storage):
     """Collect data from the data source"""
 
     data_source = DataSource(
-        'world_bank',
+        DATA_SOURCE_ID,
         'World Bank',
         'Otevřená data World Bank',
         'https://data.worldbank.org/')
 
-    # Collect data since 1980 until now
-    year = datetime.date.today().strftime("%Y")
-    for dataset_id, props in datasets.items():
+    prefetch()
+    matrix, years = read_matrix([value for url in urls() for value in read_values(url)])
+
+    for position, (dataset_id, props) in enumerate(datasets.items()):
         print('  - ' + dataset_id)
 
         dataset = Dataset(
@@ -154,21 +225,12 @@ def collect(storage: Storage):
             LINK % dataset_id,
             props['unit'])
 
-        series = wb.get_series(
-            dataset_id,
-            date=f'1980:{year}',
-            id_or_value='id',
-            simplify_index=True)
+        # Strip leading and trailing NaNs and compute intermediary missing values
+        # using interpolation of all regions at once
+        all_data = utils.trim_interpolate_rows(matrix[position], years, dataset_id)
 
         # Process dataset_id for each selected region
-        for region in regions:
-            data = series[region]
-
-            data = utils.strip_nans(data)
-
-            # Compute intermediary missing values using interpolation
-            data = data.interpolate()
-
+        for region, data in zip(regions, all_data):
             # Save data
             if data.size != 0:
                 time_series = TimeSeries(
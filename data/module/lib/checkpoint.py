@@ -0,0 +1,123 @@
+"""Checkpoint module
+Saves the data sources of a run as their stages complete, so that a failed run
+can be resumed without collecting and processing them again. Collectors may also
+save the data fetched so far, to resume a failed collection where it stopped.
+"""
+
+import os
+import pickle
+
+from lib.storage import Storage, Region
+
+# Stages of a data source, in the order they complete
+COLLECTED = 'collected'
+PROCESSED = 'processed'
+
+class _Pickler(pickle.Pickler):
+    """Pickler referring to the regions by id, they are shared by all data sources"""
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Region):
+            return obj.region_id
+        return None
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickler resolving the regions in the storage"""
+
+    def __init__(self, file, storage: Storage):
+        super().__init__(file)
+        self.storage = storage
+
+    def persistent_load(self, pid):
+        return self.storage.regions[pid]
+
+class Checkpoint:
+    """Data sources of a run saved in a directory, one file per data source"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def save(self, storage: Storage, data_source_id: str, stage: str):
+        """Save the data source from the storage along with the completed stage
+        The data source must not be modified meanwhile.
+        """
+
+        data_source = storage.data_sources[data_source_id]
+        tfr_dataset = storage.tfr_dataset.dataset_id \
+            if storage.tfr_dataset is not None and storage.tfr_dataset.data_source is data_source else None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(data_source_id)
+        with open(path + '.tmp', 'wb') as file:
+            _Pickler(file, protocol=pickle.HIGHEST_PROTOCOL).dump({
+                'stage': stage,
+                'data_source': data_source,
+                'tfr_dataset': tfr_dataset,
+            })
+        os.replace(path + '.tmp', path)
+
+        # The data fetched so far are part of the collected data source now
+        try:
+            os.remove(self._path(data_source_id, 'partial'))
+        except FileNotFoundError:
+            pass
+
+    def load(self, storage: Storage, data_source_id: str) -> str:
+        """Add the saved data source into the storage, return its completed stage or None if not saved"""
+
+        try:
+            with open(self._path(data_source_id), 'rb') as file:
+                checkpoint = _Unpickler(file, storage).load()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError) as error:
+            print(f'Ignoring unreadable checkpoint of {data_source_id}: {error}')
+            return None
+
+        data_source = checkpoint['data_source']
+        storage.add_data_source(data_source)
+        if checkpoint['tfr_dataset'] is not None:
+            storage.tfr_dataset = data_source.datasets[checkpoint['tfr_dataset']]
+
+        return checkpoint['stage']
+
+    def save_partial(self, data_source_id: str, data):
+        """Save the data fetched so far by the collector of the data source,
+        replacing the previously saved ones at once
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(data_source_id, 'partial')
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load_partial(self, data_source_id: str):
+        """Data fetched by the failed collection of the data source, None if not saved"""
+
+        try:
+            with open(self._path(data_source_id, 'partial'), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            print(f'Ignoring unreadable partial checkpoint of {data_source_id}: {error}')
+            return None
+
+    def clear(self):
+        """Remove all saved data sources"""
+
+        if not os.path.isdir(self.directory):
+            return
+
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl') or name.endswith('.pkl.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _path(self, data_source_id: str, kind: str = None) -> str:
+        """Path of the file of the data source, or of its other kind of data"""
+
+        if kind is not None:
+            return os.path.join(self.directory, f'{data_source_id}.{kind}.pkl')
+
+        return os.path.join(self.directory, data_source_id + '.pkl')
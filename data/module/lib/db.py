@@ -4,8 +4,13 @@ Provides Storage persistence.
 
 import os
 import sys
+import numpy as np
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 
+from lib import serialization
+from lib.incremental import Changes, fingerprints
 from lib.storage import Storage, Region, DataSource, Dataset, TimeSeries
 
 class Connection:
@@ -24,6 +29,8 @@ class Connection:
                 user=os.environ['POSTGRES_USER'],
                 password=os.environ['POSTGRES_PASSWORD'])
             self.cur = self.conn.cursor()
+            self.rows_written = 0
+            self.rows_copied = 0
         except (ConnectionAbortedError, ConnectionError,
             ConnectionRefusedError, ConnectionResetError):
             print('Failed to connect to the database')
@@ -35,129 +42,379 @@ class Connection:
         if self.conn:
             self.conn.close()
 
-    def save_storage(self, storage: Storage):
-        """Save the provided storage instance contents to the database"""
+    def save_snapshot(self, storage: Storage, keep: int = None, changes: Changes = None,
+            carried_over: list[str] = None) -> int:
+        """Save the provided storage instance contents into a new snapshot and publish it
+        Readers are served the previously published snapshot until the new one is complete.
+        keep: number of latest snapshots to retain including the published one, all if None
+        changes: records to copy from a previous snapshot instead of saving them, see Changes
+        carried_over: ids of data sources to copy as a whole from the published snapshot
+        instead of saving them, e.g. those left out of the run
+        Returns the id of the new snapshot.
+        """
 
-        for region in storage.regions.values():
-            self._save_region(region)
+        carried_over = set(carried_over or ())
+        reused = set(changes.reused) if changes is not None else set()
+        previous_run_id = changes.run_id if changes is not None else None
 
-        for data_source in storage.data_sources.values():
-            self._save_data_source(data_source)
+        try:
+            if carried_over and previous_run_id is None:
+                previous_run_id = self._published_run_id()
+            if carried_over and previous_run_id is not None:
+                reused |= self._data_source_keys(previous_run_id, carried_over)
 
-    def _save_region(self, region: Region):
-        """Create a region entry or update it; the id must not change"""
+            self.cur.execute('SELECT snapshot.create_run()')
+            run_id = self.cur.fetchone()[0]
 
-        if not self._record_id_exists('region', region.region_id):
-            self.cur.execute(f"""INSERT INTO region (id, name)
-                VALUES ('{region.region_id}', '{region.name}')""")
-        else:
-            self.cur.execute(f"""UPDATE region
-                SET name = '{region.name}'
-                WHERE id = '{region.region_id}'""")
+            # Unqualified table names refer to the snapshot tables until commit
+            self.cur.execute(sql.SQL('SET LOCAL search_path TO {}').format(
+                sql.Identifier(f'run_{run_id}')))
+            if carried_over and previous_run_id is not None:
+                self._copy_data_sources(previous_run_id, carried_over)
+            self._write_storage(storage, reused, previous_run_id, carried_over)
+            self._write_fingerprints(storage, reused, previous_run_id, carried_over)
+            self._write_summaries()
 
-        self.conn.commit()
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
 
-    def _save_data_source(self, data_source: DataSource):
-        """Create a data source entry or update it, including its child values"""
+        self.publish_snapshot(run_id, keep)
 
-        if not self._record_id_exists('data_source', data_source.data_source_id):
-            self.cur.execute(f"""INSERT INTO data_source (id, name, description, url)
-                VALUES ('{data_source.data_source_id}', '{data_source.name}',
-                '{data_source.description}', '{data_source.url}')""")
-        else:
-            self.cur.execute(f"""UPDATE data_source
-                SET name = '{data_source.name}', description = '{data_source.description}', url = '{data_source.url}'
-                WHERE id = '{data_source.data_source_id}'""")
+        return run_id
+
+    def published_fingerprints(self) -> tuple[int, dict[tuple[str, str], str]]:
+        """Load the fingerprints of the records of the published snapshot, see incremental.fingerprints
+        Returns the id of the snapshot, None if nothing was published yet, and the fingerprints.
+        """
+
+        try:
+            run_id = self._published_run_id()
+            if run_id is None:
+                self.conn.commit()
+                return None, {}
+
+            self.cur.execute(sql.SQL('SELECT dataset, region, value FROM {}.fingerprint').format(
+                sql.Identifier(f'run_{run_id}')))
+            previous = {(dataset, region): value for dataset, region, value in self.cur.fetchall()}
+
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+
+        return run_id, previous
+
+    def published_responses(self, responses: list[tuple[str, tuple[str, ...], tuple[str, ...]]],
+            counts: list[tuple[str, tuple[str, ...]]] = ()) \
+            -> tuple[list[tuple[str, tuple[tuple[str, str], ...], tuple[str, ...], str]],
+                list[tuple[str, tuple[tuple[str, str], ...], int]]]:
+        """Render the API responses of the published snapshot the way PostgREST does
+        All views are read from the same snapshot of the database.
+        responses: public views along with the columns filtered by equality and the selected
+        columns, all if None; one response is rendered for each combination of the filter values
+        counts: public views along with the columns filtered by equality, the rows are counted
+        for each combination of their values
+        Returns the view, the filter as (column, value) pairs, the selected columns and the JSON array
+        of the rows of each response, and the view, the filter and the number of rows of each count.
+        """
+
+        rendered = []
+        counted = []
+        try:
+            self.cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            for view, columns, selected in responses:
+                # Rows of the view are aliased as source, the rendered rows as response
+                if selected:
+                    source = sql.SQL('{} AS source, LATERAL (SELECT {}) AS response').format(
+                        sql.Identifier('public', view),
+                        sql.SQL(', ').join(sql.Identifier('source', column) for column in selected))
+                    table = 'source'
+                else:
+                    source = sql.SQL('{} AS response').format(sql.Identifier('public', view))
+                    table = 'response'
+
+                body = sql.SQL("coalesce(json_agg(response), '[]')::text")
+                if columns:
+                    keys = sql.SQL(', ').join(sql.Identifier(table, column) for column in columns)
+                    query = sql.SQL('SELECT {}, {} FROM {} GROUP BY {}').format(keys, body, source, keys)
+                else:
+                    query = sql.SQL('SELECT {} FROM {}').format(body, source)
+
+                self.cur.execute(query)
+                for row in self.cur.fetchall():
+                    rendered.append((view, tuple(zip(columns, row[:-1])), selected, row[-1]))
+
+            for view, columns in counts:
+                if columns:
+                    keys = sql.SQL(', ').join(map(sql.Identifier, columns))
+                    query = sql.SQL('SELECT {}, count(*) FROM {} GROUP BY {}').format(
+                        keys, sql.Identifier('public', view), keys)
+                else:
+                    query = sql.SQL('SELECT count(*) FROM {}').format(sql.Identifier('public', view))
+
+                self.cur.execute(query)
+                for row in self.cur.fetchall():
+                    counted.append((view, tuple(zip(columns, row[:-1])), row[-1]))
 
-        self.conn.commit()
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
 
-        for dataset in data_source.datasets.values():
-            self._save_dataset(dataset)
+        return rendered, counted
 
-    def _save_dataset(self, dataset: Dataset):
-        """Create a dataset record or update it
-        The dataset_id and data_source.data_source_id must not change between updates.
-        The data source this dataset belongs to must already exist in the database.
+    def publish_snapshot(self, run_id: int, keep: int = None):
+        """Serve a snapshot through the public views, switching atomically from the previous one
+        Publishing an older snapshot rolls back the runs after it.
+        keep: number of latest snapshots to retain including the published one, all if None
         """
 
-        if not self._record_id_exists('dataset', dataset.dataset_id):
-            if dataset.p_values_per_year is not None:
-                self.cur.execute(f"""INSERT INTO dataset (id, data_source, name, description, url, unit,
-                    p_values_per_year, r_values_per_year, correlation_values_per_year)
-                    VALUES ('{dataset.dataset_id}', '{dataset.data_source.data_source_id}', '{dataset.name}',
-                    '{dataset.description}', '{dataset.url}', '{dataset.unit}',
-                    '{dataset.p_values_per_year.to_json()}', '{dataset.r_values_per_year.to_json()}',
-                    '{dataset.correlation_values_per_year.to_json()}')""")
-            else:
-                self.cur.execute(f"""INSERT INTO dataset (id, data_source, name, description, url, unit)
-                    VALUES ('{dataset.dataset_id}', '{dataset.data_source.data_source_id}', '{dataset.name}',
-                    '{dataset.description}', '{dataset.url}', '{dataset.unit}')""")
+        try:
+            self.cur.execute('SELECT snapshot.publish(%s, %s)', (run_id, keep))
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+
+    def _published_run_id(self) -> int:
+        """Id of the published snapshot, None if nothing was published yet"""
+
+        self.cur.execute("""SELECT id FROM snapshot.run WHERE published IS NOT NULL
+            ORDER BY published DESC LIMIT 1""")
+        row = self.cur.fetchone()
+
+        return row[0] if row is not None else None
+
+    def _data_source_keys(self, run_id: int, data_source_ids: set[str]) -> set[tuple[str, str]]:
+        """Keys of the datasets and time series of the data sources in a snapshot, see Changes.reused"""
+
+        self.cur.execute(sql.SQL("""SELECT id, '' FROM {dataset} WHERE data_source = ANY(%s)
+            UNION ALL SELECT time_series.dataset, time_series.region FROM {time_series} AS time_series
+            JOIN {dataset} AS dataset ON dataset.id = time_series.dataset
+            WHERE dataset.data_source = ANY(%s)""").format(
+            dataset=sql.Identifier(f'run_{run_id}', 'dataset'),
+            time_series=sql.Identifier(f'run_{run_id}', 'time_series')),
+            (sorted(data_source_ids), sorted(data_source_ids)))
+
+        return set(self.cur.fetchall())
+
+    def _copy_data_sources(self, run_id: int, data_source_ids: set[str]):
+        """Copy the data source records from a previous snapshot, their datasets are copied as reused"""
+
+        self.cur.execute(sql.SQL('INSERT INTO data_source SELECT * FROM {} WHERE id = ANY(%s)').format(
+            sql.Identifier(f'run_{run_id}', 'data_source')), (sorted(data_source_ids), ))
+        self.rows_copied += self.cur.rowcount
+
+    def _write_storage(self, storage: Storage, reused: set[tuple[str, str]] = frozenset(),
+            previous_run_id: int = None, carried_over: set[str] = frozenset()):
+        """Insert all records of the storage into the empty tables of a new snapshot without committing
+        Parents are written before their children to satisfy foreign keys.
+        Records of the carried over data sources are copied by _copy_data_sources
+        and, as reused records, by _copy_reused instead.
+        reused: keys of the records to copy from the previous snapshot instead of saving them
+        previous_run_id: id of the snapshot to copy the reused records from
+        carried_over: ids of the data sources not to save from the storage
+        """
+
+        data_sources = [data_source for data_source in storage.data_sources.values()
+            if data_source.data_source_id not in carried_over]
+        datasets = [dataset for data_source in data_sources
+            for dataset in data_source.datasets.values()
+            if (dataset.dataset_id, '') not in reused]
+        time_series = [series for data_source in data_sources
+            for dataset in data_source.datasets.values()
+            for series in dataset.time_series.values()
+            if (dataset.dataset_id, series.region.region_id) not in reused]
+
+        self._insert('INSERT INTO region (id, name) VALUES %s',
+            [self._region_row(region) for region in storage.regions.values()])
+
+        self._insert('INSERT INTO data_source (id, name, description, url) VALUES %s',
+            [self._data_source_row(data_source) for data_source in data_sources])
+
+        self._insert("""INSERT INTO dataset (id, data_source, name, description, url, unit,
+            p_values_per_year, r_values_per_year, correlation_values_per_year) VALUES %s""",
+            [self._dataset_row(dataset) for dataset in datasets])
+
+        self._insert('INSERT INTO inter_region_correlation (dataset, year, p_value, r_value, correlation) VALUES %s',
+            [row for dataset in datasets for row in self._inter_region_correlation_rows(dataset)])
+
+        self._copy_reused('dataset', reused, previous_run_id)
+        self._copy_reused('inter_region_correlation', reused, previous_run_id)
+
+        self._insert("""INSERT INTO time_series (dataset, region, series, processed_series,
+            lag, slope, intercept, r_value, p_value, std_err, correlation) VALUES %s""",
+            [self._time_series_row(series) for series in time_series])
+
+        self._insert('INSERT INTO observation (dataset, region, year, value, processed_value) VALUES %s',
+            [row for series in time_series for row in self._observation_rows(series)])
+
+        self._copy_reused('time_series', reused, previous_run_id)
+        self._copy_reused('observation', reused, previous_run_id)
+
+    def _write_fingerprints(self, storage: Storage, reused: set[tuple[str, str]] = frozenset(),
+            previous_run_id: int = None, carried_over: set[str] = frozenset()):
+        """Store the fingerprints of the saved records for the next incremental run, see _write_storage"""
+
+        skipped = {dataset.dataset_id for data_source_id in carried_over
+            if data_source_id in storage.data_sources
+            for dataset in storage.data_sources[data_source_id].datasets.values()}
+        current = {key: value for key, value in fingerprints(storage).items()
+            if key not in reused and key[0] not in skipped}
+
+        self._insert('INSERT INTO fingerprint (dataset, region, value) VALUES %s',
+            [key + (value, ) for key, value in current.items()])
+
+        self._copy_reused('fingerprint', reused, previous_run_id)
+
+    def _write_summaries(self):
+        """Recompute the dataset, region and overall summaries from the saved time series
+        Readers of the public views get each dashboard aggregate with a single lookup
+        instead of aggregating the time series on every request.
+        """
+
+        self.cur.execute('DELETE FROM dataset_summary')
+        self.cur.execute("""INSERT INTO dataset_summary SELECT dataset.id,
+            count(time_series.region),
+            count(*) FILTER (WHERE time_series.correlation),
+            coalesce(array_agg(time_series.region ORDER BY time_series.region)
+                FILTER (WHERE time_series.region IS NOT NULL), '{}'),
+            coalesce(array_agg(time_series.region ORDER BY time_series.region)
+                FILTER (WHERE time_series.correlation), '{}'),
+            coalesce(array_agg(time_series.region ORDER BY time_series.region)
+                FILTER (WHERE NOT time_series.correlation), '{}'),
+            count(*) FILTER (WHERE abs(time_series.p_value) < 0.05),
+            count(*) FILTER (WHERE abs(time_series.p_value) < 0.05 AND time_series.r_value > 0),
+            avg(time_series.p_value) FILTER (WHERE abs(time_series.p_value) < 0.05),
+            max(time_series.r_value) FILTER (WHERE abs(time_series.p_value) < 0.05),
+            min(time_series.r_value) FILTER (WHERE abs(time_series.p_value) < 0.05),
+            sum(time_series.r_value) FILTER (WHERE abs(time_series.p_value) < 0.05)
+            FROM dataset LEFT JOIN time_series ON time_series.dataset = dataset.id
+            GROUP BY dataset.id""")
+        self.rows_written += self.cur.rowcount
+
+        self.cur.execute('DELETE FROM region_summary')
+        self.cur.execute("""INSERT INTO region_summary SELECT region.id,
+            count(time_series.dataset),
+            count(*) FILTER (WHERE time_series.correlation),
+            coalesce(array_agg(time_series.dataset ORDER BY time_series.dataset)
+                FILTER (WHERE time_series.correlation), '{}')
+            FROM region LEFT JOIN time_series ON time_series.region = region.id
+            GROUP BY region.id""")
+        self.rows_written += self.cur.rowcount
+
+        self.cur.execute('DELETE FROM overall_summary')
+        self.cur.execute("""INSERT INTO overall_summary SELECT count(*),
+            count(*) FILTER (WHERE correlation) FROM time_series""")
+        self.rows_written += self.cur.rowcount
+
+    def _copy_reused(self, table: str, reused: set[tuple[str, str]], previous_run_id: int):
+        """Copy the records reused from the previous snapshot within the database"""
+
+        if len(reused) == 0:
+            return
+
+        previous = sql.Identifier(f'run_{previous_run_id}', table)
+        reused = sorted(reused)
+
+        if table in ('dataset', 'inter_region_correlation'):
+            # Datasets are keyed by an empty region
+            query = sql.SQL("""INSERT INTO {} SELECT previous.* FROM {} AS previous
+                WHERE previous.{} = ANY(%s)""").format(sql.Identifier(table), previous,
+                sql.Identifier('id' if table == 'dataset' else 'dataset'))
+            params = ([dataset for dataset, region in reused if region == ''], )
+        else:
+            query = sql.SQL("""INSERT INTO {} SELECT previous.* FROM {} AS previous
+                JOIN unnest(%s::text[], %s::text[]) AS reused (dataset, region)
+                ON previous.dataset = reused.dataset AND previous.region = reused.region""").format(
+                sql.Identifier(table), previous)
+            params = ([dataset for dataset, region in reused], [region for dataset, region in reused])
+
+        self.cur.execute(query, params)
+        self.rows_copied += self.cur.rowcount
+
+    def _insert(self, query: str, rows: list[tuple]):
+        """Execute a multi-row statement with all rows in a single round trip"""
+
+        execute_values(self.cur, query, rows, page_size=max(len(rows), 1))
+        self.rows_written += len(rows)
+
+    @staticmethod
+    def _region_row(region: Region) -> tuple:
+        """Column values of a region record"""
+
+        return (region.region_id, region.name)
+
+    @staticmethod
+    def _data_source_row(data_source: DataSource) -> tuple:
+        """Column values of a data source record"""
+
+        return (data_source.data_source_id, data_source.name,
+            data_source.description, data_source.url)
+
+    @staticmethod
+    def _dataset_row(dataset: Dataset) -> tuple:
+        """Column values of a dataset record, per-year values are None if not computed"""
+
+        if dataset.p_values_per_year is not None:
+            per_year = (serialization.encode_series(dataset.p_values_per_year),
+                serialization.encode_series(dataset.r_values_per_year),
+                serialization.encode_series(dataset.correlation_values_per_year))
+        else:
+            per_year = (None, None, None)
+
+        return (dataset.dataset_id, dataset.data_source.data_source_id, dataset.name,
+            dataset.description, dataset.url, dataset.unit) + per_year
+
+    @staticmethod
+    def _time_series_row(time_series: TimeSeries) -> tuple:
+        """Column values of a time series record, regression values are None if not computed"""
+
+        if time_series.lag is not None:
+            # Cast NumPy scalars, which the database adapter does not know
+            regression = (time_series.differenced_json, int(time_series.lag),
+                float(time_series.slope), float(time_series.intercept),
+                float(time_series.r_value), float(time_series.p_value),
+                float(time_series.std_err), bool(time_series.correlation))
         else:
-            if dataset.p_values_per_year is not None:
-                self.cur.execute(f"""UPDATE dataset
-                    SET name = '{dataset.name}', description = '{dataset.description}', url = '{dataset.url}',
-                    unit = '{dataset.unit}', p_values_per_year = '{dataset.p_values_per_year.to_json()}',
-                    r_values_per_year = '{dataset.r_values_per_year.to_json()}',
-                    correlation_values_per_year = '{dataset.correlation_values_per_year.to_json()}'
-                    WHERE id = '{dataset.dataset_id}'""")
-            else:
-                self.cur.execute(f"""UPDATE dataset
-                    SET name = '{dataset.name}', description = '{dataset.description}', url = '{dataset.url}',
-                    unit = '{dataset.unit}'
-                    WHERE id = '{dataset.dataset_id}'""")
-
-        self.conn.commit()
-
-        for time_series in dataset.time_series.values():
-            self._save_time_series(time_series)
-
-    def _save_time_series(self, time_series: TimeSeries):
-        """Create a time series record or update it
-        The dataset.dataset_id and region.region_id must not change between updates.
-        The dataset this time series belongs to must already exist in the database.
+            regression = (None, ) * 8
+
+        return (time_series.dataset.dataset_id, time_series.region.region_id,
+            time_series.series_json) + regression
+
+    @staticmethod
+    def _observation_rows(time_series: TimeSeries) -> list[tuple]:
+        """Column values of the observation records of a time series, one per year with a value
+        Processed values are None if not computed or missing for the year.
         """
 
-        if not self._time_series_exists(time_series):
-            if time_series.lag is not None:
-                self.cur.execute(f"""INSERT INTO time_series (dataset, region, series, processed_series,
-                    lag, slope, intercept, r_value, p_value, std_err, correlation)
-                    VALUES ('{time_series.dataset.dataset_id}', '{time_series.region.region_id}', '{time_series.series.to_json()}',
-                    '{time_series.differenced.to_json()}', '{time_series.lag}', '{time_series.slope}', '{time_series.intercept}',
-                    '{time_series.r_value}', '{time_series.p_value}',
-                    '{time_series.std_err}', '{time_series.correlation}')""")
-            else:
-                self.cur.execute(f"""INSERT INTO time_series (dataset, region, series)
-                    VALUES ('{time_series.dataset.dataset_id}', '{time_series.region.region_id}',
-                    '{time_series.series.to_json()}')""")
+        series = time_series.series
+        years = np.asarray(series.index, dtype=object).astype(np.int64)
+        values = series.to_numpy(dtype=np.float64)
+
+        if time_series.lag is not None:
+            processed = time_series.differenced.reindex(series.index).to_numpy(dtype=np.float64)
         else:
-            if time_series.lag is not None:
-                self.cur.execute(f"""UPDATE time_series
-                    SET series = '{time_series.series.to_json()}', processed_series = '{time_series.differenced.to_json()}',
-                    lag = '{time_series.lag}', slope = '{time_series.slope}',
-                    intercept = '{time_series.intercept}', r_value = '{time_series.r_value}',
-                    p_value = '{time_series.p_value}', std_err = '{time_series.std_err}'
-                    WHERE dataset = '{time_series.dataset.dataset_id}'
-                    AND region = '{time_series.region.region_id}'""")
-            else:
-                self.cur.execute(f"""UPDATE time_series
-                    SET series = '{time_series.series.to_json()}'
-                    WHERE dataset = '{time_series.dataset.dataset_id}'
-                    AND region = '{time_series.region.region_id}'""")
-
-        self.conn.commit()
-
-    def _record_id_exists(self, table: str, record_id: str):
-        """Try to find a record by id, return True on success"""
-
-        self.cur.execute(f"SELECT 1 FROM {table} WHERE id = '{record_id}'")
-        records = self.cur.fetchall()
-        return len(records) > 0
-
-    def _time_series_exists(self, time_series: TimeSeries):
-        """Try to find a time series by key, return True on success"""
-
-        self.cur.execute(f"""SELECT 1 FROM time_series
-            WHERE dataset = '{time_series.dataset.dataset_id}'
-            AND region = '{time_series.region.region_id}'""")
-        records = self.cur.fetchall()
-        return len(records) > 0
+            processed = np.full(values.size, np.nan)
+
+        present = ~np.isnan(values)
+        # Cast NumPy scalars, which the database adapter does not know
+        return [(time_series.dataset.dataset_id, time_series.region.region_id, year, value,
+            None if np.isnan(processed_value) else processed_value)
+            for year, value, processed_value in zip(years[present].tolist(), values[present].tolist(),
+                processed[present].tolist())]
+
+    @staticmethod
+    def _inter_region_correlation_rows(dataset: Dataset) -> list[tuple]:
+        """Column values of the inter-region correlation records of a dataset, one per year"""
+
+        if dataset.p_values_per_year is None:
+            return []
+
+        # Values are missing (NaN) for years with too few regions, as in the JSON columns
+        return [(dataset.dataset_id, int(year), None if np.isnan(p_value) else float(p_value),
+            None if np.isnan(r_value) else float(r_value), bool(correlation))
+            for year, p_value, r_value, correlation in zip(dataset.p_values_per_year.index,
+                dataset.p_values_per_year, dataset.r_values_per_year, dataset.correlation_values_per_year)]
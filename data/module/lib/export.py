@@ -0,0 +1,154 @@
+"""Static export module
+Writes the API responses of the published snapshot into precompressed files,
+so that the dashboard data can be served by any static file server or a CDN
+without querying the database.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from urllib.parse import quote, urlencode
+
+import brotli
+
+from lib.db import Connection
+
+# Exported responses: public views along with the columns the app filters them by and
+# the columns it selects, all if None; one file is written for each combination of the filter values
+RESPONSES = [
+    ('region', (), None),
+    ('region', ('id', ), None),
+    ('data_source', (), None),
+    ('dataset', ('id', ), None),
+    ('dataset', ('data_source', ), None),
+    ('time_series', ('dataset', 'region'), None),
+    ('dataset_summary', ('dataset', ), ('regions', )),
+    ('dataset_summary', ('dataset', ), ('correlating_regions', )),
+    ('dataset_summary', ('dataset', ), ('non_correlating_regions', )),
+    ('dataset_summary', ('dataset', ), ('n_series', )),
+    ('region_summary', ('region', ), ('correlating_datasets', )),
+    ('region_summary', ('region', ), ('n_correlations', )),
+    ('overall_summary', (), ('n_series', )),
+    ('overall_summary', (), ('n_correlations', )),
+]
+
+# Requests the app only counts the rows of, along with the columns it filters them by,
+# the manifest records the count for each combination of their values
+COUNTS = [
+    ('region', ()),
+    ('dataset', ()),
+    ('dataset', ('data_source', )),
+]
+
+# File mapping the API requests to the response files, the only file without a content hash
+MANIFEST = 'index.json'
+
+# Extensions of the precompressed copies of each file
+COMPRESSED = ('.gz', '.br')
+
+def request(view: str, filters: tuple[tuple[str, str], ...], selected: tuple[str, ...] = None) -> str:
+    """API request of a response as the app makes it, e.g. time_series?dataset=eq.tfr&region=eq.cze
+    Parameters are encoded like the query parameters of a Dart Uri.
+    """
+
+    parameters = [(column, f'eq.{value}') for column, value in filters]
+    if selected:
+        parameters.append(('select', ','.join(selected)))
+    if not parameters:
+        return view
+
+    return view + '?' + urlencode(parameters)
+
+def file_name(view: str, filters: tuple[tuple[str, str], ...], selected: tuple[str, ...], body: bytes) -> str:
+    """Path of the response file relative to the export directory, named after its content hash"""
+
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    parts = [quote(f'{column}={value}', safe='=') for column, value in filters]
+    if selected:
+        parts.append(quote('select=' + ','.join(selected), safe='=,'))
+    if not parts:
+        return f'{view}.{digest}.json'
+
+    return f'{view}/{"/".join(parts)}.{digest}.json'
+
+def write_file(directory: str, name: str, body: bytes):
+    """Write the file along with its gzip and brotli compressed copies
+    Each file is written under a temporary name first, so readers never see a partial file.
+    """
+
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # The modification time is left out of gzip headers to keep the output reproducible
+    for extension, content in (
+            ('', body),
+            ('.gz', gzip.compress(body, compresslevel=9, mtime=0)),
+            ('.br', brotli.compress(body, quality=11))):
+        with open(path + extension + '.tmp', 'wb') as file:
+            file.write(content)
+        os.replace(path + extension + '.tmp', path + extension)
+
+def read_manifest(directory: str) -> dict:
+    """Manifest of the previous export, empty if there is none"""
+
+    try:
+        with open(os.path.join(directory, MANIFEST), 'rb') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def export_snapshot(connection: Connection, run_id: int, directory: str) -> dict[str, int]:
+    """Export the API responses of the published snapshot into the directory
+    Response files are named after their content, so unchanged responses keep their
+    names and are not written again. Files of the previous export are listed as retained
+    by the manifest and removed by the next export. Other files in the directory are never removed.
+    run_id: id of the published snapshot, recorded in the manifest
+    Returns the number of responses, written files and removed files.
+    """
+
+    previous = read_manifest(directory)
+    stats = {'responses': 0, 'written': 0, 'removed': 0}
+
+    responses, counted = connection.published_responses(RESPONSES, COUNTS)
+
+    files = {}
+    for view, filters, selected, body in responses:
+        body = body.encode()
+        name = file_name(view, filters, selected, body)
+        if not os.path.exists(os.path.join(directory, name)):
+            write_file(directory, name, body)
+            stats['written'] += 1
+        files[request(view, filters, selected)] = name
+        stats['responses'] += 1
+
+    # Static servers cannot answer the counting requests, their results are in the manifest
+    counts = {request(view, filters): count for view, filters, count in counted}
+
+    # Files of the previous export are kept for clients that loaded its manifest,
+    # the files retained by the previous export are removed unless referenced again
+    retained = set(previous.get('files', {}).values()) - set(files.values())
+    removed = set(previous.get('retained', [])) - set(files.values()) - retained
+
+    # The manifest switches the clients to the new files at once
+    write_file(directory, MANIFEST, json.dumps({'run': run_id, 'files': files, 'counts': counts,
+        'retained': sorted(retained)},
+        ensure_ascii=False, sort_keys=True).encode())
+
+    # Only files written by an export are removed, anything else in the directory is kept
+    for name in sorted(removed):
+        for extension in ('', ) + COMPRESSED:
+            path = os.path.join(directory, name + extension)
+            try:
+                os.remove(path)
+                stats['removed'] += 1
+            except FileNotFoundError:
+                pass
+
+        # Remove the directories left empty, up to the export directory
+        parent = os.path.dirname(os.path.join(directory, name))
+        while os.path.normpath(parent) != os.path.normpath(directory) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+    return stats
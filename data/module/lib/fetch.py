@@ -0,0 +1,299 @@
+"""Concurrent download module
+Downloads source files of all collectors in parallel, collectors then only parse them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+
+from lib import utils
+
+class HttpCache:
+    """Local cache of downloaded files
+    Stores the contents of each URL along with its ETag and Last-Modified
+    headers to revalidate them with a conditional request. The least recently
+    used files are evicted when the cache grows over its size limit.
+    """
+
+    def __init__(self, directory: str, max_age: float = 0, max_size: int = 2**30, offline: bool = False):
+        """
+        directory: directory to store the files in, created when first needed
+        max_age: seconds for which a stored file is used without revalidation
+        max_size: maximum total size of the stored files in bytes
+        offline: never connect to the server, use the stored files only
+        """
+
+        self.directory = directory
+        self.max_age = max_age
+        self.max_size = max_size
+        self.offline = offline
+
+        self.stats = Counter()
+        """Numbers of files served from the cache without a request, revalidated and downloaded"""
+
+        self._lock = threading.Lock()
+
+    def read(self, url: str, timeout: float) -> bytes:
+        """Return the contents of the URL, from the cache if still valid"""
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        meta = self._load_meta(key)
+
+        if meta is not None and (self.offline or time.time() - meta['fetched'] < self.max_age):
+            self._count('hits')
+            return self._load_body(key)
+        if self.offline:
+            raise LookupError(f'{url} is not cached, cannot download it in offline mode')
+
+        headers = {}
+        if meta is not None and meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta is not None and meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                    timeout=timeout) as response:
+                body = response.read()
+                meta = {
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }
+            self._count('downloads')
+        except HTTPError as error:
+            if error.code != 304 or meta is None:
+                raise
+            body = self._load_body(key) # Not modified since stored
+            self._count('revalidated')
+
+        meta['fetched'] = time.time()
+        self._store(key, meta, body)
+
+        return body
+
+    def _count(self, name: str):
+        """Increment a counter of stats"""
+
+        with self._lock:
+            self.stats[name] += 1
+
+    def _load_meta(self, key: str) -> dict:
+        """Load the headers of a stored file, None if not stored"""
+
+        try:
+            with open(os.path.join(self.directory, key + '.json'), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _load_body(self, key: str) -> bytes:
+        """Load the contents of a stored file, marking it as recently used"""
+
+        os.utime(os.path.join(self.directory, key + '.json'))
+        with open(os.path.join(self.directory, key + '.body'), 'rb') as file:
+            return file.read()
+
+    def _store(self, key: str, meta: dict, body: bytes):
+        """Store a file with its headers and evict the least recently used files over the limit"""
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+
+        # The headers are written last, a file is stored only once they exist
+        with open(path + '.body.tmp', 'wb') as file:
+            file.write(body)
+        os.replace(path + '.body.tmp', path + '.body')
+        with open(path + '.json.tmp', 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(path + '.json.tmp', path + '.json')
+
+        with self._lock:
+            self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        """Remove the least recently used files until the cache fits into max_size"""
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name[:-len('.json')])
+                try:
+                    entries.append((os.path.getmtime(path + '.json'), os.path.getsize(path + '.body'), path))
+                except OSError:
+                    continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if os.path.basename(path) == keep:
+                continue
+            for suffix in ('.json', '.body'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+            total_size -= size
+
+class RateLimiter:
+    """Token bucket limiting the rate of requests to a server
+    The rate is halved each time the server refuses a request for being
+    too frequent and recovers gradually with each successful request.
+    """
+
+    def __init__(self, rate: float = 1, min_rate: float = 1 / 60, recovery: float = 0.05):
+        """
+        rate: maximum number of requests per second
+        min_rate: the rate is never reduced below this number of requests per second
+        recovery: fraction of the maximum rate regained after each successful request
+        """
+
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.rate = rate
+
+        self._lock = threading.Lock()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """Wait until a request may be sent"""
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(1.0, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens < 1:
+                time.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1.0
+                self._updated = time.monotonic()
+
+            self._tokens -= 1
+
+    def succeeded(self):
+        """Report a successful request"""
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery * self.max_rate)
+
+    def throttled(self):
+        """Report a request refused for being too frequent, the next one waits longer"""
+
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+class Fetcher:
+    """Thread pool downloading source files concurrently
+    Limits the number of simultaneous connections per host and retries
+    failed requests with an increasing delay.
+    """
+
+    def __init__(self, max_workers: int = 16, max_per_host: int = 4,
+            timeout: float = 120, retries: int = 3, backoff: float = 2, cache: HttpCache = None):
+        """
+        max_workers: maximum number of concurrent requests overall
+        max_per_host: maximum number of concurrent requests to a single host
+        timeout: seconds to wait for a connection or data before retrying
+        retries: number of retries after a failed request
+        backoff: seconds to wait before the first retry, doubled with each next one
+        cache: cache of the downloaded files, downloaded every time if None
+        """
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.stats = Counter()
+        """Numbers of requests and retries and bytes downloaded"""
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._downloads: dict[str, Future] = {}
+        self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(max_per_host))
+
+    def prefetch(self, urls: list[str]):
+        """Start downloading the URLs in the background"""
+
+        for url in urls:
+            self._download(url)
+
+    def get(self, url: str) -> bytes:
+        """Return the contents of the URL, waiting for a prefetched download if there is one"""
+
+        future = self._download(url)
+        try:
+            return future.result()
+        finally:
+            # The contents are handed over only once to free the memory
+            with self._lock:
+                if self._downloads.get(url) is future:
+                    del self._downloads[url]
+
+    def submit(self, host: str, function, *args, **kwargs) -> Future:
+        """Run a function performing requests to the host in the thread pool,
+        with the same connection limit and retries as downloads
+        """
+
+        return self._executor.submit(self._call, host, function, *args, **kwargs)
+
+    def _download(self, url: str) -> Future:
+        """Return the future of the URL contents, start the download if not started yet"""
+
+        with self._lock:
+            if url not in self._downloads:
+                self._downloads[url] = self.submit(urlparse(url).netloc, self._read, url)
+            return self._downloads[url]
+
+    def _read(self, url: str) -> bytes:
+        """Download the URL contents"""
+
+        if self.cache is not None:
+            body = self.cache.read(url, self.timeout)
+        else:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                body = response.read()
+
+        with self._lock:
+            self.stats['bytes'] += len(body)
+
+        return body
+
+    def _call(self, host: str, function, *args, **kwargs):
+        """Call the function within the host connection limit, retry on network errors"""
+
+        with self._lock:
+            host_limit = self._host_limits[host]
+
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.stats['requests' if attempt == 0 else 'retries'] += 1
+            try:
+                with host_limit:
+                    return function(*args, **kwargs)
+            except OSError as error:
+                # Client errors other than rate limiting will not go away
+                if isinstance(error, HTTPError) and error.code < 500 and error.code != 429:
+                    raise
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+fetcher = Fetcher(cache=HttpCache(
+    utils.cache_path('http'),
+    max_age=float(os.environ.get('HTTP_CACHE_MAX_AGE', 0)),
+    max_size=int(os.environ.get('HTTP_CACHE_MAX_SIZE', 1024)) * 2**20,
+    offline='HTTP_CACHE_OFFLINE' in os.environ))
+"""Fetcher shared by all collectors"""
@@ -0,0 +1,113 @@
+"""Incremental processing module
+Fingerprints the inputs of each dataset and time series to process
+and save only those which changed since the previously published snapshot.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from lib.storage import Storage, Dataset, TimeSeries
+
+def series_fingerprint(series: pd.Series) -> str:
+    """Hash of the years and values of a series"""
+
+    digest = hashlib.sha256()
+    digest.update('\0'.join(str(year) for year in series.index).encode())
+    digest.update(series.to_numpy(dtype=np.float64).tobytes())
+
+    return digest.hexdigest()
+
+def _combine(*parts) -> str:
+    """Hash of several fingerprints or other values"""
+
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+def derived_fingerprint(tfr: pd.Series, parameters: str) -> str:
+    """Fingerprint of a time series computed from the TFR values of its region, see Dataset.parameters"""
+
+    return _combine(series_fingerprint(tfr), parameters)
+
+def fingerprints(storage: Storage) -> dict[tuple[str, str], str]:
+    """Fingerprints of the inputs of all records of the storage
+    Time series are keyed by dataset and region ids, datasets by their id and an empty region id.
+    A time series depends on its values and on the TFR values of its region,
+    a dataset on its metadata, on all its time series and on all TFR time series.
+    Time series of datasets computed from TFR depend on the TFR values of their region
+    and on the parameters of the computation instead of their values, see derived_fingerprint.
+    """
+
+    series = {}
+    for data_source in storage.data_sources.values():
+        for dataset in data_source.datasets.values():
+            for time_series in dataset.time_series.values():
+                series[(dataset.dataset_id, time_series.region.region_id)] = \
+                    series_fingerprint(time_series.series)
+
+    tfr = {}
+    if storage.tfr_dataset is not None:
+        tfr = {region.region_id: series[(storage.tfr_dataset.dataset_id, region.region_id)]
+            for region in storage.tfr_dataset.time_series.keys()}
+    all_tfr = _combine(sorted(tfr.items()))
+
+    results = {}
+    for data_source in storage.data_sources.values():
+        for dataset in data_source.datasets.values():
+            dataset_series = []
+            for time_series in dataset.time_series.values():
+                key = (dataset.dataset_id, time_series.region.region_id)
+                if dataset.parameters is not None:
+                    results[key] = _combine(tfr.get(key[1]), dataset.parameters)
+                else:
+                    results[key] = _combine(series[key], tfr.get(key[1]))
+                dataset_series.append((key[1], series[key]))
+
+            results[(dataset.dataset_id, '')] = _combine(data_source.data_source_id,
+                dataset.name, dataset.description, dataset.url, dataset.unit,
+                sorted(dataset_series), all_tfr, dataset.parameters)
+
+    return results
+
+class Changes:
+    """Records of the storage changed since a previous run
+    Records which did not change are reused from the previous run instead of
+    being processed and saved again.
+    """
+
+    def __init__(self, storage: Storage, previous: dict[tuple[str, str], str], run_id: int):
+        """
+        previous: fingerprints stored by the previous run, see fingerprints
+        run_id: id of the snapshot to reuse the unchanged records from
+        """
+
+        self.run_id = run_id
+        self.previous = previous
+
+        current = fingerprints(storage)
+        self.reused: set[tuple[str, str]] = {key for key, value in current.items()
+            if previous.get(key) == value}
+        """Keys of the records to copy from the previous run"""
+
+        self.changed = len(current) - len(self.reused)
+        """Number of the records to process and save"""
+
+    def is_changed(self, dataset: Dataset, time_series: TimeSeries = None) -> bool:
+        """Whether a dataset or one of its time series has to be processed"""
+
+        region_id = time_series.region.region_id if time_series is not None else ''
+        return (dataset.dataset_id, region_id) not in self.reused
+
+    def reuse(self, dataset_id: str, region_id: str = '', fingerprint: str = None) -> bool:
+        """Copy a record from the previous run instead of saving it from the storage
+        fingerprint: fingerprint the record must have had in the previous run, any if None
+        Returns False if the previous run does not have the record or has it with another fingerprint.
+        """
+
+        if (dataset_id, region_id) not in self.previous:
+            return False
+        if fingerprint is not None and self.previous[(dataset_id, region_id)] != fingerprint:
+            return False
+
+        self.reused.add((dataset_id, region_id))
+        return True
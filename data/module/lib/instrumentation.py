@@ -0,0 +1,222 @@
+"""Pipeline instrumentation module
+Measures time, memory and counts of the stages of a run and reports them
+as JSON and optionally as a Prometheus textfile.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+class Stage:
+    """Measurements of a single stage of a run"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts: dict[str, int] = {}
+        self.failed = False
+
+        self.wall_time: float = None
+        self.cpu_time: float = None
+        self.children_cpu_time: float = None
+        self.rss_peak: int = None
+        self.rss_peak_increase: int = None
+        self.traced_increase: int = None
+        self.traced_peak: int = None
+
+    def count(self, name: str, value: int = 1):
+        """Add to a counter of the stage, e.g. rows saved or requests sent"""
+
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        """Measurements of the stage for the report"""
+
+        record = {
+            'stage': self.name,
+            'failed': self.failed,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'children_cpu_time': self.children_cpu_time,
+            'rss_peak_bytes': self.rss_peak,
+            'rss_peak_increase_bytes': self.rss_peak_increase,
+        }
+        if self.traced_peak is not None:
+            record['traced_increase_bytes'] = self.traced_increase
+            record['traced_peak_bytes'] = self.traced_peak
+        record['counts'] = self.counts
+
+        return record
+
+class Instrumentation:
+    """Collects measurements of the stages of a run
+    Stages may be nested, their names are then joined with a slash.
+    Stages may run in several threads at once, their CPU time and memory peaks
+    are those of the whole process and so include the concurrent stages.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        """
+        trace_memory: also measure the memory allocated by Python with tracemalloc,
+        which slows the run down
+        """
+
+        self.trace_memory = trace_memory
+        self.stages: list[Stage] = []
+        self.started = datetime.now(timezone.utc)
+
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # Stacks of the open stages and their traced memory of each thread
+        self._local = threading.local()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the stage run in the context, yields the Stage to add counts to"""
+
+        if not hasattr(self._local, 'open'):
+            self._local.open = []
+            self._local.traced_peaks = []
+        if self._local.open:
+            name = self._local.open[-1].name + '/' + name
+        stage = Stage(name)
+        with self._lock:
+            self.stages.append(stage)
+        self._local.open.append(stage)
+
+        rss_peak = _rss_peak()
+        children_cpu_time = _children_cpu_time()
+        if self.trace_memory:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self._local.traced_peaks.append(traced)
+        cpu_time = time.process_time()
+        wall_time = time.perf_counter()
+
+        try:
+            yield stage
+        except BaseException:
+            stage.failed = True
+            raise
+        finally:
+            stage.wall_time = time.perf_counter() - wall_time
+            stage.cpu_time = time.process_time() - cpu_time
+            stage.children_cpu_time = _children_cpu_time() - children_cpu_time
+            stage.rss_peak = _rss_peak()
+            stage.rss_peak_increase = stage.rss_peak - rss_peak
+
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                # Peaks of nested stages were reset, the highest one is kept for the parent
+                peak = max(peak, self._local.traced_peaks.pop())
+                stage.traced_increase = current - traced
+                stage.traced_peak = peak - traced
+                if self._local.traced_peaks:
+                    self._local.traced_peaks[-1] = max(self._local.traced_peaks[-1], peak)
+                tracemalloc.reset_peak()
+
+            self._local.open.pop()
+
+    def report(self) -> dict:
+        """Measurements of all stages so far"""
+
+        return {
+            'started': self.started.isoformat(),
+            'wall_time': time.perf_counter() - self._start,
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def write_json(self, path: str):
+        """Write the report into a JSON file"""
+
+        _write_atomic(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path: str, prefix: str = 'tfr_data'):
+        """Write the report into a textfile for the Prometheus node exporter"""
+
+        report = self.report()
+        metrics = {
+            'stage_wall_seconds': ('Wall time of a pipeline stage', 'wall_time'),
+            'stage_cpu_seconds': ('CPU time of a pipeline stage', 'cpu_time'),
+            'stage_children_cpu_seconds': ('CPU time of the child processes of a pipeline stage',
+                'children_cpu_time'),
+            'stage_rss_peak_bytes': ('Peak resident memory at the end of a pipeline stage',
+                'rss_peak_bytes'),
+            'stage_traced_peak_bytes': ('Peak Python memory allocated during a pipeline stage',
+                'traced_peak_bytes'),
+            'stage_failed': ('Whether a pipeline stage failed', 'failed'),
+        }
+
+        lines = []
+        for metric, (description, key) in metrics.items():
+            values = [(stage['stage'], stage[key]) for stage in report['stages'] if stage.get(key) is not None]
+            if len(values) == 0:
+                continue
+            lines.append(f'# HELP {prefix}_{metric} {description}')
+            lines.append(f'# TYPE {prefix}_{metric} gauge')
+            lines.extend(f'{prefix}_{metric}{{stage="{stage}"}} {float(value)}' for stage, value in values)
+
+        lines.append(f'# HELP {prefix}_stage_count Counters of a pipeline stage')
+        lines.append(f'# TYPE {prefix}_stage_count gauge')
+        for stage in report['stages']:
+            lines.extend(f'{prefix}_stage_count{{stage="{stage["stage"]}",name="{name}"}} {value}'
+                for name, value in stage['counts'].items())
+
+        lines.append(f'# HELP {prefix}_run_wall_seconds Wall time of the whole run')
+        lines.append(f'# TYPE {prefix}_run_wall_seconds gauge')
+        lines.append(f'{prefix}_run_wall_seconds {report["wall_time"]}')
+        lines.append(f'# HELP {prefix}_run_timestamp_seconds Start of the run')
+        lines.append(f'# TYPE {prefix}_run_timestamp_seconds gauge')
+        lines.append(f'{prefix}_run_timestamp_seconds {self.started.timestamp()}')
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+    def print_summary(self):
+        """Print the time and memory of the top-level stages"""
+
+        for stage in self.stages:
+            if '/' in stage.name:
+                continue
+            print(f'- {stage.name}: {stage.wall_time:.2f} s wall, {stage.cpu_time:.2f} s CPU, '
+                f'{stage.rss_peak / 2**20:.0f} MB peak RSS')
+
+def optional_stage(instrumentation: Instrumentation, name: str):
+    """Measure the stage with the instrumentation, see Instrumentation.stage
+    Without instrumentation the stage is not measured, counts added to it are ignored.
+    """
+
+    if instrumentation is None:
+        return nullcontext(Stage(name))
+
+    return instrumentation.stage(name)
+
+def _rss_peak() -> int:
+    """Peak resident memory of the process in bytes"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _children_cpu_time() -> float:
+    """CPU time of the finished child processes"""
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def _write_atomic(path: str, contents: str):
+    """Write a file so that readers never see it incomplete"""
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(contents)
+    os.replace(path + '.tmp', path)
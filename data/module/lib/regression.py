@@ -0,0 +1,60 @@
+"""Vectorized linear regression module
+Computes the statistics of scipy.stats.linregress for many samples at once.
+"""
+
+import numpy as np
+from scipy.stats import t as t_distribution
+
+# Guards the t statistic against division by zero for perfect correlations,
+# the same constant is used by scipy.stats.linregress
+TINY = 1.0e-20
+
+def linregress_batch(x: np.ndarray, y: np.ndarray, mask: np.ndarray = None) -> tuple:
+    """Compute the least-squares regression of y on x along the last axis
+    All other axes are broadcast, so each row is an independent sample.
+    Only the points where mask is True and neither value is NaN are used.
+
+    Returns arrays of:
+    - slope of the linear regression line
+    - intercept of the linear regression line
+    - r_value (correlation coefficient of the samples)
+    - p_value of a test with the null hypothesis that the slope is 0
+    - std_err of the slope
+    - number of points used
+    The results are NaN for rows with less than 3 points or constant x.
+    """
+
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if mask is not None:
+        valid &= mask
+
+    n = valid.sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(valid, x, 0.0).sum(axis=-1) / n
+        y_mean = np.where(valid, y, 0.0).sum(axis=-1) / n
+
+        # Population (co)variances, like np.cov(x, y, bias=1)
+        x_dev = np.where(valid, x - x_mean[..., np.newaxis], 0.0)
+        y_dev = np.where(valid, y - y_mean[..., np.newaxis], 0.0)
+        ssxm = (x_dev * x_dev).sum(axis=-1) / n
+        ssym = (y_dev * y_dev).sum(axis=-1) / n
+        ssxym = (x_dev * y_dev).sum(axis=-1) / n
+
+        r_den = np.sqrt(ssxm * ssym)
+        r_value = np.clip(np.where(r_den == 0, 0.0, ssxym / r_den), -1.0, 1.0)
+
+        slope = ssxym / ssxm
+        intercept = y_mean - slope * x_mean
+
+        df = n - 2
+        t = r_value * np.sqrt(df / ((1.0 - r_value + TINY) * (1.0 + r_value + TINY)))
+        p_value = 2 * t_distribution.sf(np.abs(t), df)
+        std_err = np.sqrt((1 - r_value**2) * ssym / ssxm / df)
+
+    invalid = (n < 3) | (ssxm == 0)
+    results = tuple(np.where(invalid, np.nan, values)
+        for values in (slope, intercept, r_value, p_value, std_err))
+
+    return results + (n, )
@@ -0,0 +1,93 @@
+"""Task scheduling module
+Runs the stages of a run concurrently, each as soon as the stages it depends on are done.
+"""
+
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class DependencyFailed(Exception):
+    """A task was skipped because a task it requires failed"""
+
+class Scheduler:
+    """Runs tasks in threads once their dependencies are done
+    A failing task does not stop the others, only the tasks requiring it are skipped.
+    """
+
+    def __init__(self, max_workers: int = None):
+        """
+        max_workers: maximum number of tasks running at once, all tasks if None
+        """
+
+        self.max_workers = max_workers
+        self._tasks: dict[str, tuple] = {}
+
+    def add(self, name: str, function, requires: list[str] = (), after: list[str] = ()):
+        """Add a task calling the function without arguments
+        requires: tasks which must succeed before the task runs, otherwise it is skipped
+        after: tasks which must be done before the task runs, whether they succeeded or not
+        """
+
+        if name in self._tasks:
+            raise ValueError(f'Task {name} already exists')
+
+        self._tasks[name] = (function, tuple(requires), tuple(after))
+
+    def run(self) -> dict[str, BaseException]:
+        """Run all tasks and wait for them
+        Returns the exceptions of the failed and skipped tasks by task name.
+        """
+
+        futures: dict[str, Future] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers or max(len(self._tasks), 1)) as executor:
+            # Dependencies are submitted first, so a waiting task never blocks a task it waits for
+            for name in self._order():
+                futures[name] = executor.submit(self._run_task, name, futures)
+
+        return {name: future.result() for name, future in futures.items()
+            if future.result() is not None}
+
+    def _run_task(self, name: str, futures: dict[str, Future]) -> BaseException:
+        """Wait for the dependencies and run the task, return its exception if it failed"""
+
+        function, requires, after = self._tasks[name]
+
+        failed = [dependency for dependency in requires if futures[dependency].result() is not None]
+        for dependency in after:
+            futures[dependency].result()
+        if failed:
+            return DependencyFailed(f'{name} skipped, required ' + ', '.join(failed) + ' failed')
+
+        try:
+            function()
+        except Exception as error: # pylint: disable=broad-except
+            print(f'Task {name} failed')
+            traceback.print_exc()
+            return error
+
+        return None
+
+    def _order(self) -> list[str]:
+        """Names of the tasks ordered so that each follows its dependencies"""
+
+        order: list[str] = []
+        visiting: set[str] = set()
+
+        def visit(name: str):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f'Task {name} depends on itself')
+            if name not in self._tasks:
+                raise ValueError(f'Unknown task {name}')
+
+            visiting.add(name)
+            _, requires, after = self._tasks[name]
+            for dependency in requires + after:
+                visit(dependency)
+            visiting.remove(name)
+            order.append(name)
+
+        for name in self._tasks:
+            visit(name)
+
+        return order
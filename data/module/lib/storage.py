@@ -3,6 +3,7 @@
 import pandas as pd
 import numpy as np
 
+from lib import serialization
 from lib.correlation import is_correlation
 
 class Region:
@@ -16,15 +17,23 @@ class TimeSeries:
     """Time series with a pandas Series object
     This is a "realization of a dataset for a given region"
     The Series should have a name equal to data_source and index named Year
+    Once added to its dataset, the values are kept in the dataset matrix
+    and the series is a view of the row of this time series.
+    The JSON of the series and of the differenced values is memoized until they are replaced.
     """
 
     def __init__(self, data_source, dataset, region: Region, series: pd.Series):
         self.data_source = data_source
         self.dataset = dataset
         self.region = region
-        self.series = series
 
-        self.differenced: pd.Series = None
+        self._series = series # Until added to the dataset
+        self._row: int = None
+        self._meta: tuple = None # Name, index name and dtype of the series
+        self._series_json: str = None
+
+        self._differenced: pd.Series = None
+        self._differenced_json: str = None
         self.normalized: pd.Series = None
 
         self.lag: int = None
@@ -35,6 +44,60 @@ class TimeSeries:
         self.std_err: float = None
         self.correlation: bool = None
 
+    @property
+    def series(self) -> pd.Series:
+        """Values per year"""
+
+        if self._row is None:
+            return self._series
+
+        return self.dataset.row_series(self._row, *self._meta)
+
+    @series.setter
+    def series(self, series: pd.Series):
+        if self._row is None:
+            self._series = series
+        else:
+            self._meta = self.dataset.store_row(self._row, series)
+        self._series_json = None
+
+    @property
+    def series_json(self) -> str:
+        """JSON object of the values per year, see serialization.encode_series"""
+
+        if self._series_json is None:
+            if self._row is not None and self._meta[2] == np.float64:
+                # Encode all time series of the dataset at once
+                self.dataset.encode_series()
+            else:
+                self._series_json = serialization.encode_series(self.series)
+
+        return self._series_json
+
+    @property
+    def differenced(self) -> pd.Series:
+        """Differenced values per year, None until processed"""
+
+        return self._differenced
+
+    @differenced.setter
+    def differenced(self, differenced: pd.Series):
+        self._differenced = differenced
+        self._differenced_json = None
+
+    @property
+    def differenced_json(self) -> str:
+        """JSON object of the differenced values per year, None until processed"""
+
+        if self._differenced_json is None and self._differenced is not None:
+            if self._row is not None and self._differenced.dtype == np.float64:
+                # Encode all time series of the dataset at once
+                self.dataset.encode_series()
+            else:
+                self._differenced_json = serialization.encode_series(self._differenced)
+
+        return self._differenced_json
+
     def set_correlation_regression(self, props: tuple):
         """Set the correlation and regression results
         Expects a tuple with the used lag as the first value,
@@ -63,8 +126,19 @@ class Dataset:
         self.time_series: dict[Region, TimeSeries] = {}
         """Time series from this dataset per region"""
 
-        self.values_per_year: dict[str, pd.Series] = {}
-        """Values from all time series per year with corresponding TFR values"""
+        self.first_year = 0
+        """Year of the first column of the matrix"""
+
+        self._values = np.empty((0, 0))
+        """Values of all time series, one row per time series and one column per year"""
+
+        self._present = np.empty((0, 0), dtype=bool)
+        """Whether a time series has a value for the year, which may also be NaN"""
+
+        self._year_index = pd.Index([], dtype=object)
+        """Years of the columns as strings for the series index"""
+
+        self._rows = 0
 
         self.p_values_per_year: pd.Series = None
         """p-values for inter-region correlation per year"""
@@ -75,45 +149,168 @@ class Dataset:
         self.correlation_values_per_year: pd.Series = None
         """Truth values for inter-region correlation per year"""
 
+        self.spearman_r_values_per_year: pd.Series = None
+        """Spearman rank correlation coefficients for inter-region correlation per year, if requested"""
+
+        self.spearman_p_values_per_year: pd.Series = None
+        """p-values of the Spearman rank correlations per year, if requested"""
+
+        self.parameters: str = None
+        """Parameters the time series were computed with from the TFR values of their regions,
+        None if the dataset is not computed from TFR
+        """
+
     def add_time_series(self, time_series: TimeSeries):
-        """Add time series to the dataset"""
+        """Add time series to the dataset, moving its values into the dataset matrix"""
+
+        replaced = self.time_series.get(time_series.region)
+        if replaced is not None and replaced is not time_series:
+            # The replaced time series keeps its values, the row is reused
+            row = replaced._row
+            replaced._series = replaced.series.copy()
+            replaced._row = None
+        elif replaced is None:
+            row = self._rows
+            self._rows += 1
+        else:
+            return
+
+        time_series._meta = self.store_row(row, time_series.series)
+        time_series._row = row
+        time_series._series = None
+        time_series.dataset = self
 
         self.time_series[time_series.region] = time_series
 
+    @property
+    def years(self) -> np.ndarray:
+        """Integer years of the matrix columns"""
+
+        return np.arange(self.first_year, self.first_year + self._values.shape[1])
+
+    def matrix(self) -> tuple[np.ndarray, np.ndarray]:
+        """Views of the values of all time series and of their presence mask,
+        in the order of the time series and with a column per year, see years
+        """
+
+        return self._values[:self._rows], self._present[:self._rows]
+
+    def row(self, region: Region) -> int:
+        """Matrix row of the time series of the region"""
+
+        return self.time_series[region]._row
+
+    def store_row(self, row: int, series: pd.Series) -> tuple:
+        """Replace the values of a matrix row with the series, growing the matrix as needed
+        Returns the name, index name and dtype to restore the series with.
+        """
+
+        years = np.asarray(series.index, dtype=object).astype(np.int64)
+        values = series.to_numpy(dtype=np.float64)
+
+        first = int(years.min()) if years.size else self.first_year
+        last = int(years.max()) if years.size else first - 1
+        if self._values.shape[1] > 0:
+            first = min(first, self.first_year)
+            last = max(last, self.first_year + self._values.shape[1] - 1)
+        self._reserve(max(row + 1, self._rows), first, last)
+
+        self._values[row] = np.nan
+        self._present[row] = False
+        self._values[row, years - self.first_year] = values
+        self._present[row, years - self.first_year] = True
+
+        dtype = series.dtype if np.issubdtype(series.dtype, np.integer) else np.dtype(np.float64)
+        return series.name, series.index.name, dtype
+
+    def row_series(self, row: int, name=None, index_name=None, dtype=np.float64) -> pd.Series:
+        """Series of the values present in a matrix row, indexed by years as strings"""
+
+        columns = np.flatnonzero(self._present[row])
+        if columns.size > 0 and columns[-1] - columns[0] + 1 == columns.size:
+            # Contiguous years are sliced without copying
+            columns = slice(columns[0], columns[-1] + 1)
+
+        values = self._values[row, columns]
+        if dtype != np.float64:
+            values = values.astype(dtype)
+
+        index = self._year_index[columns]
+        if index_name is not None:
+            index = index.rename(index_name)
+
+        return pd.Series(values, index=index, name=name, copy=False)
+
+    def _reserve(self, rows: int, first: int, last: int):
+        """Grow the matrix to hold the rows and the years from first to last"""
+
+        capacity, columns = self._values.shape
+        if rows <= capacity and (last < first
+                or (first >= self.first_year and last < self.first_year + columns)):
+            return
+
+        new_capacity = max(capacity, 1)
+        while new_capacity < rows:
+            new_capacity *= 2
+
+        values = np.full((new_capacity, last - first + 1), np.nan)
+        present = np.zeros((new_capacity, last - first + 1), dtype=bool)
+        offset = self.first_year - first
+        values[:capacity, offset:offset + columns] = self._values
+        present[:capacity, offset:offset + columns] = self._present
+
+        self._values = values
+        self._present = present
+        self.first_year = first
+        self._year_index = pd.Index([str(year) for year in range(first, last + 1)], dtype=object)
+
+    def encode_series(self):
+        """Memoize the JSON of the float time series and differenced values without it,
+        see TimeSeries.series_json and TimeSeries.differenced_json
+        """
+
+        pending = [time_series for time_series in self.time_series.values()
+            if time_series._series_json is None and time_series._meta[2] == np.float64]
+        if pending:
+            rows = [time_series._row for time_series in pending]
+            encoded = serialization.encode_rows(self._year_index.tolist(), self._values[rows], self._present[rows])
+            for time_series, series_json in zip(pending, encoded):
+                time_series._series_json = series_json
+
+        pending = [time_series for time_series in self.time_series.values()
+            if time_series._differenced_json is None and time_series._differenced is not None
+            and time_series._differenced.dtype == np.float64]
+        encoded = serialization.encode_many([time_series._differenced for time_series in pending])
+        for time_series, differenced_json in zip(pending, encoded):
+            time_series._differenced_json = differenced_json
+
     def all_series(self, regions: list[Region]) -> pd.DataFrame:
         """Construct a dataframe containing all time series of this dataset"""
 
-        # Create a list of series ordered by regions
-        all_series_list = []
-        for region in regions.values():
-            if region in self.time_series.keys():
-                all_series_list.append(self.time_series[region].series)
-            else:
-                all_series_list.append(pd.Series(dtype=np.float64)) # Will produce NaNs for this region in the dataframe below
-
-        all_series = pd.DataFrame(all_series_list)
-        all_series.reset_index(inplace=True)
-        all_series.drop(columns=['index'], inplace=True)
+        values, present = self.region_matrix(regions)
+        columns = present.any(axis=0)
 
-        return all_series
+        return pd.DataFrame(values[:, columns], columns=self._year_index[columns])
 
-    def recompute_values_per_year(self, all_tfr: pd.DataFrame, regions: list[Region], min_values: int):
-        """Refresh values_per_year
-        min_values: minimum number of values from time series available
-        to include a year in values_per_year
+    def region_matrix(self, regions: list[Region]) -> tuple[np.ndarray, np.ndarray]:
+        """Values of the time series and their presence mask with one row per region
+        in the given order and one column per year, see years
+        Regions without a time series in this dataset have no values.
         """
 
-        all_series = self.all_series(regions)
-        for year in all_series.columns:
-            if year in all_tfr.columns:
-                # Add explanatory values for each region
-                series = pd.Series(all_series[year])
-                # Set index to the corresponding TFR values
-                series.index = all_tfr[year]
-                # Remove countries for which the value is missing
-                series.dropna(inplace=True)
-                if series.size >= min_values:
-                    self.values_per_year[year] = series
+        positions = []
+        rows = []
+        for position, region in enumerate(regions.values()):
+            if region in self.time_series:
+                positions.append(position)
+                rows.append(self.time_series[region]._row)
+
+        values = np.full((len(regions), self._values.shape[1]), np.nan)
+        present = np.zeros((len(regions), self._values.shape[1]), dtype=bool)
+        values[positions] = self._values[rows]
+        present[positions] = self._present[rows]
+
+        return values, present
 
     def set_inter_region_correlation_p_values(self, p_values: dict[str, float]):
         """Set the series of inter-region correlation p-values"""
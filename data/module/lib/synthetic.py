@@ -0,0 +1,64 @@
+"""Synthetic data module
+Builds storages of random time series shaped like the collected data, without network access.
+"""
+
+import numpy as np
+import pandas as pd
+
+from lib.storage import Storage, Region, DataSource, Dataset, TimeSeries
+
+def synthetic_storage(regions: int = 30, datasets: int = 20, years: int = 60,
+        missing: float = 0.1, seed: int = 0) -> Storage:
+    """Build a storage with a TFR dataset and other datasets of random walks
+    regions: number of regions, each has a TFR time series
+    datasets: number of datasets besides TFR
+    years: number of years the time series span at most, ending with the last year
+    missing: probability that a region has no time series of a dataset,
+    and that a value inside a time series is missing
+    seed: seed of the random generator, the same seed builds the same storage
+    """
+
+    rng = np.random.default_rng(seed)
+    last_year = 2021
+    first_year = last_year - years + 1
+
+    storage = Storage()
+    storage.add_regions([Region(f'r{index:03d}', f'Region {index}') for index in range(regions)])
+
+    world_bank = DataSource('world_bank', 'World Bank', 'Synthetic data', '/')
+    tfr = Dataset('tfr', world_bank, 'TFR', 'Synthetic TFR', '/', 'počet dětí')
+    for region in storage.regions.values():
+        start = first_year + int(rng.integers(0, max(years // 10, 1)))
+        values = 2 + rng.normal(0, 0.05, last_year - start + 1).cumsum()
+        tfr.add_time_series(TimeSeries(world_bank, tfr, region, _series(values, start, 'tfr')))
+    world_bank.add_dataset(tfr)
+    storage.add_data_source(world_bank)
+    storage.tfr_dataset = tfr
+
+    synthetic = DataSource('synthetic', 'Synthetic', 'Synthetic data', '/')
+    for index in range(datasets):
+        dataset = Dataset(f'synthetic_{index}', synthetic, f'Synthetic {index}', 'Synthetic dataset', '/', '')
+        for region in storage.regions.values():
+            if rng.random() < missing:
+                continue
+
+            start = first_year + int(rng.integers(0, max(years // 2, 1)))
+            end = last_year - int(rng.integers(0, max(years // 10, 1)))
+            values = rng.normal(0, 1, max(end - start + 1, 1)).cumsum()
+
+            # Missing values never lead or trail, like after strip_nans
+            gaps = rng.random(values.size) < missing
+            gaps[0] = gaps[-1] = False
+            values[gaps] = np.nan
+
+            dataset.add_time_series(TimeSeries(synthetic, dataset, region,
+                _series(values, start, dataset.dataset_id)))
+        synthetic.add_dataset(dataset)
+    storage.add_data_source(synthetic)
+
+    return storage
+
+def _series(values: np.ndarray, start: int, name: str) -> pd.Series:
+    """Series of the values indexed by years as strings, like the collected data"""
+
+    return pd.Series(values, index=[str(year) for year in range(start, start + values.size)], name=name)
@@ -1,22 +1,112 @@
 """Utility functions module"""
 
+import os
+
+import numpy as np
 import pandas as pd
 
 def strip_nans(data):
     """Remove leading and trailing rows with missing values"""
 
-    index = data.index
+    present = ~pd.isna(data.to_numpy())
+    if not present.any():
+        return data.iloc[0:0]
+
+    start = np.argmax(present)
+    end = present.size - np.argmax(present[::-1])
+
+    return data.iloc[start:end] # Last index is exclusive
+
+def trim_bounds(present: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Find the first and after the last present value of each row of a matrix
+    present: mask of the present values with one row per series
+    Returns arrays of the starts and ends of the rows, both 0 for rows without values.
+    """
+
+    columns = present.shape[1]
+    any_present = present.any(axis=1)
+    if columns == 0:
+        return np.zeros(present.shape[0], dtype=int), np.zeros(present.shape[0], dtype=int)
+
+    start = np.where(any_present, np.argmax(present, axis=1), 0)
+    end = np.where(any_present, columns - np.argmax(present[:, ::-1], axis=1), 0)
+
+    return start, end
+
+def interpolate_rows(values: np.ndarray) -> np.ndarray:
+    """Linearly interpolate missing values between the present values of each row
+    of a matrix, like Series.interpolate; leading and trailing missing values are kept
+    """
+
+    present = ~np.isnan(values)
+    positions = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+
+    # Positions of the closest present values before and after each value
+    previous = np.maximum.accumulate(np.where(present, positions, -1), axis=1)
+    following = np.minimum.accumulate(np.where(present, positions, values.shape[1])[:, ::-1], axis=1)[:, ::-1]
+
+    missing = ~present & (previous >= 0) & (following < values.shape[1])
+    if not missing.any():
+        return values
+
+    previous_values = np.take_along_axis(values, np.maximum(previous, 0), axis=1)
+    following_values = np.take_along_axis(values, np.minimum(following, values.shape[1] - 1), axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = (following_values - previous_values) / (following - previous)
+        interpolated = slopes * (positions - previous) + previous_values
+
+    return np.where(missing, interpolated, values)
+
+def trim_interpolate_rows(values: np.ndarray, index: list, name: str = None) -> list[pd.Series]:
+    """Strip leading and trailing missing values of each row of a matrix
+    and interpolate the intermediary ones
+    values: matrix with one row per series and one column per item of the index
+    index: index of the series, e.g. years
+    name: name of the series
+    Returns a series per row, empty if the row has no values. The series are views
+    of a single interpolated matrix.
+    """
+
+    values = interpolate_rows(np.asarray(values, dtype=np.float64))
+    starts, ends = trim_bounds(~np.isnan(values))
+    index = pd.Index(index)
+
+    return [pd.Series(values[row, start:end], index=index[start:end], name=name, copy=False)
+        for row, (start, end) in enumerate(zip(starts, ends))]
+
+def year_matrix(data: list[pd.Series], first: int, last: int) -> np.ndarray:
+    """Place values of series indexed by years into a matrix with one row
+    per series and one column per year from first to last inclusive;
+    missing years are NaN and years outside of the range are left out
+    """
+
+    matrix = np.full((len(data), last - first + 1), np.nan)
+    if len(data) == 0:
+        return matrix
+
+    rows = np.repeat(np.arange(len(data)), [series.size for series in data])
+    # Convert the years of all series at once, the index may hold strings or integers
+    columns = np.concatenate([np.asarray(series.index, dtype=object) for series in data]) \
+        .astype(np.int64) - first
+    values = np.concatenate([series.to_numpy(dtype=np.float64) for series in data])
+
+    inside = (columns >= 0) & (columns < matrix.shape[1])
+    matrix[rows[inside], columns[inside]] = values[inside]
+
+    return matrix
+
+def cache_path(name: str) -> str:
+    """Path of the directory for locally cached data of the given kind
+    The cache root is set by the CACHE_DIR environment variable.
+    """
+
+    return os.path.join(os.environ.get('CACHE_DIR', 'cache'), name)
 
-    start = 0
-    while start <= len(index) - 1:
-        if not pd.isnull(data[index[start]]):
-            break
-        start = start + 1
+def cache_dir(name: str) -> str:
+    """Directory for locally cached data of the given kind, created if missing"""
 
-    end = len(index) - 1
-    while end >= 0:
-        if not pd.isnull(data[index[end]]):
-            break
-        end = end - 1
+    path = cache_path(name)
+    os.makedirs(path, exist_ok=True)
 
-    return data.iloc[start:(end + 1)] # Last index is exclusive
+    return path
@@ -1,13 +1,220 @@
 """TFR Dashboard data collection and processing module"""
 
 import os
+import sys
 
+from lib import export, utils
+from lib.checkpoint import Checkpoint, COLLECTED, PROCESSED
 from lib.db import Connection
+from lib.fetch import fetcher
+from lib.incremental import Changes
+from lib.instrumentation import Instrumentation
+from lib.scheduler import Scheduler
 from lib.storage import Storage, Region
 from collectors import worldbank, eurostat, datagovcz, googletrends
 from processors import intercorr, paircorr, forecasting
 
+def data_source_size(storage: Storage, data_source_id: str) -> tuple[int, int]:
+    """Number of datasets and time series of the data source in the storage"""
+
+    datasets = storage.data_sources[data_source_id].datasets.values()
+
+    return len(datasets), sum(len(dataset.time_series) for dataset in datasets)
+
+def run(storage: Storage, instrumentation: Instrumentation) -> dict[str, BaseException]:
+    """Collect, process and save the data, measuring each stage
+    Collectors run concurrently and the data of each data source is processed as soon
+    as it and the TFR data are collected.
+    Each data source is saved into a checkpoint once collected and processed, with RESUME
+    the data sources saved by the previous failed run are restored instead.
+    Excluded data sources and those whose collecting or processing failed are carried over
+    from the published snapshot, as are the forecasts if forecasting failed.
+    Returns the exceptions of the failed tasks by task name.
+    """
+
+    data_sources = {
+        'WORLDBANK': worldbank,
+        'EUROSTAT': eurostat,
+        'DATAGOVCZ': datagovcz,
+        'GOOGLETRENDS': googletrends,
+    }
+
+    collectors = {}
+    carried_over = []
+    for data_source_name, data_source_collector in data_sources.items():
+        if not f'EXCLUDE_{data_source_name}' in os.environ:
+            collectors[data_source_name] = data_source_collector
+        else:
+            print('- Skipping ' + data_source_name)
+            carried_over.append(data_source_collector.DATA_SOURCE_ID)
+
+    # Everything is correlated with TFR
+    if 'WORLDBANK' not in collectors:
+        raise ValueError('WORLDBANK data source with TFR cannot be excluded')
+
+    # Restore the data sources completed by the previous run
+    checkpoint = Checkpoint(utils.cache_path('checkpoints'))
+    stages: dict[str, str] = {}
+    if 'RESUME' in os.environ:
+        with instrumentation.stage('restore'):
+            for data_source_collector in collectors.values():
+                data_source_id = data_source_collector.DATA_SOURCE_ID
+                stage = checkpoint.load(storage, data_source_id)
+                if stage is not None:
+                    stages[data_source_id] = stage
+                    print(f'- Restored {data_source_id} ({stage})')
+    else:
+        checkpoint.clear()
+
+    # Download the files of all data sources at once, collectors parse them as they arrive
+    with instrumentation.stage('prefetch'):
+        for data_source_collector in collectors.values():
+            if data_source_collector.DATA_SOURCE_ID not in stages:
+                data_source_collector.prefetch()
+
+    connection = Connection()
+    changes: Changes = None
+    scheduler = Scheduler(int(os.environ['MAX_TASKS']) if 'MAX_TASKS' in os.environ else None)
+
+    def collect_task(data_source_name: str, data_source_collector):
+        def collect():
+            print('Collecting ' + data_source_name)
+            with instrumentation.stage('collect/' + data_source_name.lower()) as stage:
+                if data_source_collector is googletrends:
+                    # Collected for long, the data fetched so far are saved to resume from
+                    data_source_collector.collect(storage, checkpoint)
+                else:
+                    data_source_collector.collect(storage)
+                datasets, time_series = data_source_size(storage, data_source_collector.DATA_SOURCE_ID)
+                stage.count('datasets', datasets)
+                stage.count('time_series', time_series)
+                checkpoint.save(storage, data_source_collector.DATA_SOURCE_ID, COLLECTED)
+            print('Collected ' + data_source_name)
+        return collect
+
+    for data_source_name, data_source_collector in collectors.items():
+        if data_source_collector.DATA_SOURCE_ID in stages:
+            # Restored already, the task is kept for the tasks depending on it
+            scheduler.add('collect/' + data_source_name, lambda: None)
+        else:
+            scheduler.add('collect/' + data_source_name, collect_task(data_source_name, data_source_collector))
+
+    # Find the records changed since the published snapshot, the rest is reused from it
+    requires_changes = []
+    if 'INCREMENTAL' in os.environ:
+        def find_changes():
+            nonlocal changes
+            with instrumentation.stage('changes') as stage:
+                run_id, previous = connection.published_fingerprints()
+                changes = Changes(storage, previous, run_id)
+                stage.count('reused', len(changes.reused))
+                stage.count('changed', changes.changed)
+            print(f'Reusing {len(changes.reused)} unchanged records, {changes.changed} changed')
+
+        # Fingerprints cover all collected data
+        scheduler.add('changes', find_changes, requires=['collect/WORLDBANK'],
+            after=['collect/' + name for name in collectors])
+        requires_changes = ['changes']
+
+    # Process data of each data source once collected
+    def process_task(name: str, processor, data_source_id: str):
+        def process():
+            print(f'Processing {name} of {data_source_id}')
+            with instrumentation.stage(f'process/{name}/{data_source_id}'):
+                processor(storage, changes=changes, data_sources=[data_source_id],
+                    instrumentation=instrumentation)
+        return process
+
+    # Save the data source once processed, no other task modifies it then
+    def checkpoint_task(data_source_id: str):
+        def save():
+            with instrumentation.stage('checkpoint/' + data_source_id):
+                checkpoint.save(storage, data_source_id, PROCESSED)
+        return save
+
+    for data_source_name, data_source_collector in collectors.items():
+        requires = ['collect/WORLDBANK', 'collect/' + data_source_name] + requires_changes
+        data_source_id = data_source_collector.DATA_SOURCE_ID
+        if stages.get(data_source_id) == PROCESSED:
+            continue
+
+        scheduler.add(f'process/paircorr/{data_source_id}',
+            process_task('paircorr', paircorr.process, data_source_id), requires=sorted(set(requires)))
+        scheduler.add(f'process/intercorr/{data_source_id}',
+            process_task('intercorr', intercorr.process, data_source_id), requires=sorted(set(requires)))
+        scheduler.add(f'checkpoint/{data_source_id}', checkpoint_task(data_source_id),
+            requires=[f'process/paircorr/{data_source_id}', f'process/intercorr/{data_source_id}'])
+
+    # Forecasts are not saved into checkpoints, forecasting again reuses the cached models
+    def forecast():
+        print('Forecasting')
+        with instrumentation.stage('process/forecasting') as stage:
+            workers = os.environ.get('FORECASTING_WORKERS')
+            forecasting.process(storage, workers=int(workers) if workers else None, changes=changes)
+            stage.count('regions', len(storage.data_sources['forecast'].datasets['tfr_forecast'].time_series))
+
+    scheduler.add('process/forecasting', forecast, requires=['collect/WORLDBANK'] + requires_changes)
+
+    with instrumentation.stage('tasks') as stage:
+        failures = scheduler.run()
+
+        # Downloads of all collectors overlap, they are counted together
+        for name, value in fetcher.stats.items():
+            stage.count(name, value)
+        if fetcher.cache is not None:
+            for name, value in fetcher.cache.stats.items():
+                stage.count('cache_' + name, value)
+        stage.count('failed', len(failures))
+
+    # Without TFR there is nothing worth publishing
+    if 'collect/WORLDBANK' in failures:
+        raise failures['collect/WORLDBANK']
+    if 'changes' in failures:
+        raise failures['changes']
+
+    # Keep the published data of the data sources not completed by this run
+    for data_source_name, data_source_collector in collectors.items():
+        data_source_id = data_source_collector.DATA_SOURCE_ID
+        if any(name in failures for name in ('collect/' + data_source_name,
+                'process/paircorr/' + data_source_id, 'process/intercorr/' + data_source_id)):
+            print('- Keeping published ' + data_source_id)
+            carried_over.append(data_source_id)
+    if 'process/forecasting' in failures:
+        print('- Keeping published forecast')
+        carried_over.append('forecast')
+
+    # Save data
+    print('Saving data')
+    with instrumentation.stage('save') as stage:
+        run_id = connection.save_snapshot(storage, keep=int(os.environ.get('SNAPSHOTS_KEPT', 3)),
+            changes=changes, carried_over=carried_over)
+        stage.count('rows_written', connection.rows_written)
+        stage.count('rows_copied', connection.rows_copied)
+    print(f'- Published snapshot {run_id}')
+
+    # Write the published responses for static file servers
+    if 'EXPORT_DIR' in os.environ:
+        print('Exporting data')
+        with instrumentation.stage('export') as stage:
+            for name, value in export.export_snapshot(connection, run_id, os.environ['EXPORT_DIR']).items():
+                stage.count(name, value)
+
+    # Failed data sources are collected again by a resumed run, the rest is restored
+    if not failures:
+        checkpoint.clear()
+
+    return failures
+
 if __name__ == '__main__':
+    # Roll back to a previously saved snapshot without collecting data
+    if 'PUBLISH_SNAPSHOT' in os.environ:
+        print('Publishing snapshot ' + os.environ['PUBLISH_SNAPSHOT'])
+        connection = Connection()
+        connection.publish_snapshot(int(os.environ['PUBLISH_SNAPSHOT']))
+        if 'EXPORT_DIR' in os.environ:
+            export.export_snapshot(connection, int(os.environ['PUBLISH_SNAPSHOT']), os.environ['EXPORT_DIR'])
+        sys.exit(0)
+
     storage = Storage()
 
     storage.add_regions([
@@ -44,36 +251,20 @@ if __name__ == '__main__':
         Region('gbr', 'Velká Británie'),
     ])
 
-    # Collect data
-    print('Collecting data')
+    instrumentation = Instrumentation(trace_memory='TRACE_MEMORY' in os.environ)
+    try:
+        failures = run(storage, instrumentation)
+    finally:
+        # Report the measured stages even if the run failed
+        print('Stages')
+        instrumentation.print_summary()
+        instrumentation.write_json(os.environ.get('REPORT_FILE',
+            os.path.join(utils.cache_path('reports'), 'report.json')))
+        if 'PROMETHEUS_TEXTFILE' in os.environ:
+            instrumentation.write_prometheus(os.environ['PROMETHEUS_TEXTFILE'])
 
-    data_sources = {
-        'WORLDBANK': worldbank.collect,
-        'EUROSTAT': eurostat.collect,
-        'DATAGOVCZ': datagovcz.collect,
-        'GOOGLETRENDS': googletrends.collect,
-    }
-
-    for data_source_name, data_source_collector in data_sources.items():
-        if not f'EXCLUDE_{data_source_name}' in os.environ:
-            print('- ' + data_source_name)
-            data_source_collector(storage)
-        else:
-            print('- Skipping ' + data_source_name)
-
-    # Process data
-    print('Processing data')
-
-    print('- Pair correlation')
-    paircorr.process(storage)
-    print('- Inter-region correlation')
-    intercorr.process(storage)
-    print('- Forecasting')
-    forecasting.process(storage)
-
-    # Save data
-    print('Saving data')
-    connection = Connection()
-    connection.save_storage(storage)
+    if failures:
+        print('Data collection and processing completed with failed tasks: ' + ', '.join(failures))
+        sys.exit(1)
 
     print('Data collection and processing completed')
@@ -3,16 +3,117 @@ Inserts a new data source with a TFR dataset with forecasted time series
 from each region if forecasting is successful.
 """
 
+import hashlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import pmdarima as pm
 
+from lib import utils
+from lib.incremental import Changes, derived_fingerprint
 from lib.storage import Storage, DataSource, Dataset, TimeSeries
 
 forecast_years = 10
 
-def process(storage: Storage):
+# Parameters of the ARIMA order search
+arima_params = {
+    'start_p': 0, 'start_q': 0, 'max_p': 10, 'max_q': 10,
+    'seasonal': False, 'm': 1, # No seasonality
+    'd': None, 'max_d': 2, 'test': 'kpss', # Differencing
+    'trace': False, 'error_action': 'ignore', 'suppress_warnings': True, # Logging
+    'stepwise': False,
+}
+
+def forecast(series: pd.Series, cache_file: str = None) -> pd.Series:
+    """Fit an ARIMA model to the series and predict the following forecast_years values
+    cache_file: file to reuse the previous model of the series from and to store the new one to.
+    The previous forecast is returned if neither the series nor the parameters changed.
+    If the series was only extended by new years, the previous model is updated with them,
+    otherwise the order search starts from the previous order.
+    """
+
+    key = _cache_key(series)
+    cached = _load_cached_model(cache_file) if cache_file else None
+
+    if cached is not None and cached['key'] == key:
+        return cached['prediction']
+
+    if cached is not None and cached['params'] == arima_params \
+            and _is_extension(cached['series'], series):
+        model_fit = cached['model']
+        model_fit.update(series.iloc[cached['series'].size:])
+    elif cached is not None and cached['params'] == arima_params:
+        order = cached['model'].order
+        model_fit = pm.auto_arima(series, **dict(arima_params,
+            start_p=order[0], start_q=order[2], stepwise=True))
+    else:
+        model_fit = pm.auto_arima(series, **arima_params)
+
+    pred_array = model_fit.predict(forecast_years)
+
+    last_year = int(series.index[-1]) + 1
+    pred = pd.Series(
+        np.asarray(pred_array),
+        index=[str(i) for i in range(last_year, last_year + forecast_years)])
+
+    if cache_file:
+        _store_cached_model(cache_file, {
+            'key': key,
+            'params': arima_params,
+            'series': series,
+            'model': model_fit,
+            'prediction': pred,
+        })
+
+    return pred
+
+def _parameters() -> str:
+    """Parameters the forecasts depend on besides the series"""
+
+    return repr((sorted(arima_params.items()), forecast_years))
+
+def _cache_key(series: pd.Series) -> str:
+    """Hash of the series and the parameters its forecast depends on"""
+
+    digest = hashlib.sha256()
+    digest.update(_parameters().encode())
+    digest.update('\0'.join(str(year) for year in series.index).encode())
+    digest.update(series.to_numpy(dtype=np.float64).tobytes())
+
+    return digest.hexdigest()
+
+def _is_extension(previous: pd.Series, series: pd.Series) -> bool:
+    """Whether the series only appends new years to the previous one"""
+
+    return series.size > previous.size and series.iloc[:previous.size].equals(previous)
+
+def _load_cached_model(cache_file: str) -> dict:
+    """Load a cache entry, None if missing or unreadable"""
+
+    try:
+        with open(cache_file, 'rb') as file:
+            return pickle.load(file)
+    except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+
+def _store_cached_model(cache_file: str, entry: dict):
+    """Store a cache entry, replacing the previous one at once"""
+
+    with open(cache_file + '.tmp', 'wb') as file:
+        pickle.dump(entry, file)
+    os.replace(cache_file + '.tmp', cache_file)
+
+def process(storage: Storage, workers: int = None, cache: bool = True, changes: Changes = None):
     """Process time series in the storage.
     Creates new data source with a forecast of TFR values.
+    workers: number of processes fitting the models in parallel, CPU count if None;
+    1 fits the models in the current process
+    cache: reuse the models from the previous run, see forecast
+    changes: forecast only the regions with TFR changed since the previous run, all if None
     """
 
     data_source = DataSource('forecast', 'Předpovědi', 'Předpovědi vývojů ukazatelů', '/')
@@ -25,26 +126,36 @@ def process(storage: Storage):
             'kdyby po celý její život platily hodnoty plodnosti podle věku pro daný rok.',
         '/',
         'počet dětí')
+    dataset.parameters = _parameters()
 
-    for series in storage.tfr_dataset.time_series.values():
-
-        model_fit = pm.auto_arima(series.series, start_p=0, start_q=0, max_p=10, max_q=10,
-            seasonal=False, m=1, # No seasonality
-            d=None, max_d=2, test='kpss', # Differencing
-            trace=False, error_action='ignore', suppress_warnings=True, # Logging
-            stepwise=False)
+    all_time_series = list(storage.tfr_dataset.time_series.values())
+    if changes is not None:
+        # Forecasts of unchanged TFR values with unchanged parameters are copied from the previous run
+        all_time_series = [time_series for time_series in all_time_series
+            if not changes.reuse(dataset.dataset_id, time_series.region.region_id,
+                derived_fingerprint(time_series.series, dataset.parameters))]
 
-        pred_array = model_fit.predict(forecast_years)
+    all_series = [time_series.series for time_series in all_time_series]
+    if cache:
+        cache_files = [os.path.join(utils.cache_dir('forecasting'), f'{time_series.region.region_id}.pkl')
+            for time_series in all_time_series]
+    else:
+        cache_files = [None] * len(all_time_series)
 
-        last_year = int(series.series.index[-1]) + 1
-        pred = pd.Series(
-            pred_array,
-            index=[str(i) for i in range(last_year, last_year + forecast_years)])
+    # Results come back in the order of the input regardless of which finishes first
+    if workers == 1:
+        predictions = [forecast(*args) for args in zip(all_series, cache_files)]
+    else:
+        # Forking a process with other threads running, e.g. collectors, may deadlock
+        with ProcessPoolExecutor(max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver')) as executor:
+            predictions = list(executor.map(forecast, all_series, cache_files))
 
+    for time_series, pred in zip(all_time_series, predictions):
         dataset.add_time_series(TimeSeries(
             data_source,
             dataset,
-            series.region,
+            time_series.region,
             pred
         ))
 
@@ -1,29 +1,110 @@
 """Inter-region correlation processing module"""
 
-from scipy.stats import linregress
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
 
 from lib.storage import Storage
 from lib.correlation import is_correlation
+from lib.incremental import Changes
+from lib.instrumentation import Instrumentation, optional_stage
+from lib.regression import linregress_batch
 
-def process(storage: Storage):
-    """Process time series in the storage"""
+def year_correlations(tfr: np.ndarray, values: np.ndarray, spearman: bool = False) -> tuple:
+    """Correlate the values of each year with the TFR values of the same year across regions
+    tfr: TFR values with one row per year and one column per region
+    values: values of a dataset in the same shape, or a stack of them for several datasets
+    spearman: also compute the Spearman rank correlation
+    Regions without a value are left out. Like linregress, the results are NaN
+    for a year with a value of a region without the TFR value.
+
+    Returns arrays with the leading axes of values:
+    - r_value (correlation coefficient of the values)
+    - p_value of a test with the null hypothesis that the slope is 0
+    - Spearman rank correlation coefficient, only if spearman
+    - p_value of the Spearman rank correlation, only if spearman
+    """
+
+    tfr, values = np.broadcast_arrays(tfr, values)
+    has_value = ~np.isnan(values)
+    missing_tfr = (has_value & np.isnan(tfr)).any(axis=-1)
+
+    results = linregress_batch(tfr, values, has_value)
+    r_values, p_values = results[2], results[3]
+
+    if spearman:
+        # Pearson correlation of the ranks among the regions with both values
+        valid = has_value & ~np.isnan(tfr)
+        tfr_ranks = rankdata(np.where(valid, tfr, np.nan), axis=-1, nan_policy='omit')
+        value_ranks = rankdata(np.where(valid, values, np.nan), axis=-1, nan_policy='omit')
+        rank_results = linregress_batch(tfr_ranks, value_ranks, valid)
+        return tuple(np.where(missing_tfr, np.nan, result)
+            for result in (r_values, p_values, rank_results[2], rank_results[3]))
+
+    return tuple(np.where(missing_tfr, np.nan, result) for result in (r_values, p_values))
+
+def process(storage: Storage, changes: Changes = None, spearman: bool = False,
+        data_sources: list[str] = None, instrumentation: Instrumentation = None):
+    """Process time series in the storage
+    changes: process only the datasets changed since the previous run, all if None
+    spearman: also compute the Spearman rank correlations per year
+    data_sources: ids of the data sources to process, all if None
+    instrumentation: measures the alignment of each dataset with TFR and the correlations
+    of all of them, which are computed for all datasets at once
+    """
 
-    all_tfr = storage.tfr_dataset.all_series(storage.regions)
     min_values_per_year = 5
     min_years = 5
 
-    for data_source in storage.data_sources.values():
-        for dataset in data_source.datasets.values():
-            dataset.recompute_values_per_year(all_tfr, storage.regions, min_values_per_year)
-            if len(dataset.values_per_year) >= min_years:
-                p_values: dict[str, float] = {} # p_values per year
-                r_values: dict[str, float] = {} # r_values per year
-                correlations: dict[str, bool] = {} # correlations per year
-                for year, series in dataset.values_per_year.items():
-                    results = linregress(series.index, series.values)
-                    p_values[year] = results[3]
-                    r_values[year] = results[2]
-                    correlations[year] = is_correlation(results[3])
-                dataset.set_inter_region_correlation_p_values(p_values)
-                dataset.set_inter_region_correlation_r_values(r_values)
-                dataset.set_inter_region_correlations(correlations)
+    if data_sources is None:
+        data_sources = list(storage.data_sources)
+
+    datasets = [dataset for data_source_id in data_sources
+        for dataset in storage.data_sources[data_source_id].datasets.values()
+        if changes is None or changes.is_changed(dataset)]
+    if len(datasets) == 0:
+        return
+
+    # TFR values are aligned with all datasets once
+    tfr, tfr_present = storage.tfr_dataset.region_matrix(storage.regions)
+    years = storage.tfr_dataset.years
+    year_labels = np.array([str(year) for year in years], dtype=object)
+
+    # Values of all datasets on the TFR year axis, one matrix per dataset
+    values = np.full((len(datasets), ) + tfr.shape, np.nan)
+    present = np.zeros((len(datasets), tfr.shape[1]), dtype=bool)
+    for position, dataset in enumerate(datasets):
+        with optional_stage(instrumentation, 'dataset/' + dataset.dataset_id) as stage:
+            dataset_values, dataset_present = dataset.region_matrix(storage.regions)
+            columns = dataset.years - storage.tfr_dataset.first_year
+            inside = (columns >= 0) & (columns < tfr.shape[1])
+            values[position][:, columns[inside]] = dataset_values[:, inside]
+            present[position, columns[inside]] = dataset_present[:, inside].any(axis=0)
+            stage.count('time_series', len(dataset.time_series))
+
+    # Years with TFR values and enough values of the dataset
+    selected = present & tfr_present.any(axis=0) \
+        & ((~np.isnan(values)).sum(axis=1) >= min_values_per_year)
+
+    with optional_stage(instrumentation, 'correlation') as stage:
+        results = year_correlations(tfr.T, values.transpose(0, 2, 1), spearman)
+        stage.count('datasets', len(datasets))
+        stage.count('years', int(selected.sum()))
+
+    for position, dataset in enumerate(datasets):
+        columns = np.flatnonzero(selected[position])
+        if columns.size < min_years:
+            continue
+
+        p_values = results[1][position, columns]
+        r_values = results[0][position, columns]
+        dataset.set_inter_region_correlation_p_values(dict(zip(year_labels[columns], p_values)))
+        dataset.set_inter_region_correlation_r_values(dict(zip(year_labels[columns], r_values)))
+        dataset.set_inter_region_correlations(dict(zip(year_labels[columns],
+            (is_correlation(p_value) for p_value in p_values))))
+
+        if spearman:
+            dataset.spearman_r_values_per_year = pd.Series(
+                results[2][position, columns], index=year_labels[columns])
+            dataset.spearman_p_values_per_year = pd.Series(
+                results[3][position, columns], index=year_labels[columns])
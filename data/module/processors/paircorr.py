@@ -1,50 +1,73 @@
 """Time series pairwise correlation processing module"""
 
+import numpy as np
 import pandas as pd
-from scipy.stats import linregress
 
-from lib.storage import Storage
+from lib import utils
+from lib.incremental import Changes
+from lib.instrumentation import Instrumentation, optional_stage
+from lib.regression import linregress_batch
+from lib.storage import Storage, TimeSeries
 
-def lag_interval(lagging: tuple[int, int], static: tuple[int, int], lag: int) \
-        -> tuple[tuple[int, int], tuple[int, int], int]:
-    """Compute bounds when given intervals are lagged
+def lag_regressions(tfr: pd.Series, other: pd.Series, maxlags: int = 5) -> tuple:
+    """Compute the correlation and regression of tfr and other time series
+    for every lag between -maxlags and maxlags at once.
 
-    Parameters:
-    - lagging: interval to be lagged
-    - static: interval to relate the lag to
-    - lag: relative lag, positive value points to the past
+    Returns arrays indexed by lag position:
+    - lags, positive value points to the past
+    - valid: whether there are enough data points to compute the correlation
+    - slope of the linear regression line
+    - intercept of the linear regression line
+    - r_value (correlation coefficient of the series)
+    - p_value of a test with the null hypothesis that the slope is 0
+    - std_err of the slope
+    """
 
-    Returns:
-    - new_lagging: new bounds of the lagged interval or None if invalid
-    - new_static: new bounds of the lagged interval or None if invalid
-    - length: length of the both intervals of None if interval(s) invalid
+    lags, *results = lag_regressions_batch([tfr], [other], maxlags)
+
+    return (lags, ) + tuple(values[0] for values in results)
+
+def lag_regressions_batch(tfr: list[pd.Series], other: list[pd.Series], maxlags: int = 5) -> tuple:
+    """Compute the lagged correlations and regressions of many pairs of tfr
+    and other time series in a single vectorized pass.
+    All series are placed onto a common integer year grid once and the
+    lagged pairs of all pairs and lags are regressed together.
+
+    Returns the same arrays as lag_regressions, except for lags
+    indexed by pair and lag position.
     """
 
-    # Compute start points
-    lagging_start = lagging[0]
-    static_start = lagging_start + lag
+    min_data_lenght = 8 # Minimal number of data points to compute the correlation
+
+    tfr_intervals = np.array([(int(series.index[0]), int(series.index[-1])) for series in tfr])
+    tfr_lengths = tfr_intervals[:, 1] - tfr_intervals[:, 0]
 
-    if static_start < static[0]:
-        lagging_start += static[0] - static_start
-        static_start = static[0]
+    other_intervals = np.array([(int(series.index[0]), int(series.index[-1])) for series in other])
+    other_lengths = other_intervals[:, 1] - other_intervals[:, 0]
 
-    # Compute end points
-    static_end = static[1]
-    lagging_end = static_end - lag
+    min_lengths = np.maximum(min_data_lenght, np.minimum(tfr_lengths, other_lengths) / 2).astype(int)
 
-    if lagging_end > lagging[1]:
-        static_end -= lagging_end - lagging[1]
-        lagging_end = lagging[1]
+    lags = np.arange(-maxlags, maxlags)
 
-    # Validate results
-    if static_start > static_end or lagging_start > lagging_end:
-        return None, None, None
+    # Length of the overlap of the TFR interval and the other interval shifted by each lag,
+    # the earliest end minus the latest start plus one, not positive if they do not overlap
+    lengths = np.minimum(tfr_intervals[:, 1:], other_intervals[:, 1:] - lags) \
+        - np.maximum(tfr_intervals[:, :1], other_intervals[:, :1] - lags) + 1
+    valid = lengths >= min_lengths[:, np.newaxis]
 
-    new_lagging = (lagging_start, lagging_end)
-    new_static = (static_start, static_end)
-    length = lagging_end - lagging_start + 1
+    first = min(tfr_intervals[:, 0].min(), other_intervals[:, 0].min())
+    last = max(tfr_intervals[:, 1].max(), other_intervals[:, 1].max())
+    tfr_grid = utils.year_matrix(tfr, first, last)
+    other_grid = utils.year_matrix(other, first, last)
 
-    return new_lagging, new_static, length
+    # Year of the other value paired with each TFR year for each lag
+    positions = np.arange(tfr_grid.shape[1])[np.newaxis, :] + lags[:, np.newaxis]
+    inside = (positions >= 0) & (positions < other_grid.shape[1])
+    other_lagged = other_grid[:, np.clip(positions, 0, other_grid.shape[1] - 1)]
+
+    results = linregress_batch(tfr_grid[:, np.newaxis, :], other_lagged, inside)
+
+    return (lags, valid) + results[:5]
 
 def best_lag(tfr: pd.Series, other: pd.Series, maxlags: int = 5) -> tuple:
     """Find the best correlation and regression of tfr and other time series
@@ -58,67 +81,83 @@ def best_lag(tfr: pd.Series, other: pd.Series, maxlags: int = 5) -> tuple:
     - r_value (correlation coefficient of the series)
     - p_value of a test with the null hypothesis that the slope is 0
     - std_err of the slope
-    - intercept_std_err
     """
 
-    min_data_lenght = 8 # Minimal number of data points to compute the correlation
+    return best_lags([tfr], [other], maxlags)[0]
 
-    tfr_interval = (int(tfr.index[0]), int(tfr.index[-1]))
-    tfr_length = tfr_interval[1] - tfr_interval[0]
-
-    other_interval = (int(other.index[0]), int(other.index[-1]))
-    other_length = other_interval[1] - other_interval[0]
-
-    min_length = int(max(min_data_lenght, min(tfr_length, other_length) / 2))
-
-    relations: dict[int, tuple] = {}
-
-    for lag in range(-maxlags, maxlags):
-        tfr_lagged, other_lagged, length = lag_interval(tfr_interval, other_interval, lag)
-
-        if length is not None and length >= min_length:
-            primary = tfr.copy()
-            secondary = other.copy()
+def best_lags(tfr: list[pd.Series], other: list[pd.Series], maxlags: int = 5,
+        batch_size: int = 1024) -> list[tuple]:
+    """Find the best correlation and regression for each pair of tfr
+    and other time series, see best_lag
+    batch_size: maximum number of pairs regressed at once to bound memory use
+    """
 
-            primary.index = primary.index.astype(int)
-            secondary.index = secondary.index.astype(int)
-            primary = primary.loc[(primary.index >= tfr_lagged[0])
-                & (primary.index <= tfr_lagged[1])]
-            secondary = secondary.loc[(secondary.index >= other_lagged[0])
-                & (secondary.index <= other_lagged[1])]
+    best: list[tuple] = []
+
+    for start in range(0, len(tfr), batch_size):
+        lags, valid, *results = lag_regressions_batch(
+            tfr[start:start + batch_size], other[start:start + batch_size], maxlags)
+
+        # The first lag wins ties, lags without a non-zero r-value are never chosen
+        abs_r_values = np.where(valid & ~np.isnan(results[2]), np.abs(results[2]), 0)
+        best_positions = np.argmax(abs_r_values, axis=1)
+
+        for pair, position in enumerate(best_positions):
+            if abs_r_values[pair, position] <= 0:
+                best.append((None, None, None, None, None, None))
+            else:
+                best.append((int(lags[position]), )
+                    + tuple(float(values[pair, position]) for values in results))
+
+    return best
+
+def process(storage: Storage, maxlags: int = 5, batched: bool = True, changes: Changes = None,
+        data_sources: list[str] = None, instrumentation: Instrumentation = None):
+    """Process time series in the storage
+    maxlags: lags between -maxlags and maxlags are searched for the best correlation
+    batched: regress all time series of all datasets at once, otherwise one by one
+    changes: process only the time series changed since the previous run, all if None
+    data_sources: ids of the data sources to process, all if None
+    instrumentation: measures the differencing of each dataset and the regression
+    of all of them, which is shared by the datasets when batched
+    """
 
-            relations[lag] = linregress(primary, secondary)
+    if data_sources is None:
+        data_sources = list(storage.data_sources)
+
+    # First difference, TFR series are needed for the changed series of their region
+    tfr_differenced = {region: time_series.series.diff().iloc[1:]
+        for region, time_series in storage.tfr_dataset.time_series.items()}
+
+    all_time_series: list[TimeSeries] = []
+    for data_source_id in data_sources:
+        for dataset in storage.data_sources[data_source_id].datasets.values():
+            with optional_stage(instrumentation, 'dataset/' + dataset.dataset_id) as stage:
+                for time_series in dataset.time_series.values():
+                    if changes is not None and not changes.is_changed(dataset, time_series):
+                        continue
+
+                    if dataset is storage.tfr_dataset:
+                        time_series.differenced = tfr_differenced[time_series.region]
+                    else:
+                        time_series.differenced = time_series.series.diff().iloc[1:]
+
+                    # Differencing may have deleted the only value we had.
+                    if time_series.differenced.size != 0:
+                        all_time_series.append(time_series)
+                        stage.count('time_series')
+                        stage.count('values', time_series.differenced.size)
+
+    # Correlation and regression
+    tfr = [tfr_differenced[time_series.region] for time_series in all_time_series]
+    other = [time_series.differenced for time_series in all_time_series]
+
+    with optional_stage(instrumentation, 'regression') as stage:
+        if batched:
+            results = best_lags(tfr, other, maxlags)
         else:
-            pass
-
-    if len(relations) == 0:
-        return (None, None, None, None, None, None)
-
-    max_r_value = 0
-    max_r_value_lag = None
-    for lag, props in relations.items():
-        cur_r_value = abs(props[2])
-        if cur_r_value > max_r_value:
-            max_r_value = cur_r_value
-            max_r_value_lag = lag
-
-    return (max_r_value_lag, ) + relations[max_r_value_lag]
-
-def process(storage: Storage):
-    """Process time series in the storage"""
-
-    for data_source in storage.data_sources.values():
-        for dataset in data_source.datasets.values():
-            for time_series in dataset.time_series.values():
-                # First difference
-                time_series.differenced = time_series.series.diff().iloc[1:]
-
-                # Differencing may have deleted the only value we had.
-                if time_series.differenced.size == 0:
-                    continue
-
-                # Correlation and regression
-                results = best_lag(storage.tfr_dataset.time_series[time_series.region].differenced,
-                    time_series.differenced)
+            results = [best_lag(*pair, maxlags) for pair in zip(tfr, other)]
+        stage.count('time_series', len(all_time_series))
 
-                time_series.set_correlation_regression(results)
+    for time_series, time_series_results in zip(all_time_series, results):
+        time_series.set_correlation_regression(time_series_results)
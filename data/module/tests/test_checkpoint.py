@@ -0,0 +1,96 @@
+"""Tests of the run checkpoints"""
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from lib.checkpoint import COLLECTED, PROCESSED, Checkpoint
+from lib.storage import Region, Storage
+from lib.synthetic import synthetic_storage
+
+def empty_storage(storage: Storage) -> Storage:
+    """Storage with the regions of another one but no data sources"""
+
+    empty = Storage()
+    empty.add_regions([Region(region.region_id, region.name) for region in storage.regions.values()])
+
+    return empty
+
+class CheckpointTest(unittest.TestCase):
+    """Saving and restoring data sources"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = Checkpoint(os.path.join(directory.name, 'checkpoint'))
+        self.storage = synthetic_storage(regions=3, datasets=2, years=10)
+
+    def test_roundtrip(self):
+        self.checkpoint.save(self.storage, 'synthetic', PROCESSED)
+        restored = empty_storage(self.storage)
+
+        self.assertEqual(self.checkpoint.load(restored, 'synthetic'), PROCESSED)
+
+        data_source = restored.data_sources['synthetic']
+        self.assertIsNone(restored.tfr_dataset)
+        self.assertEqual(set(data_source.datasets), {'synthetic_0', 'synthetic_1'})
+        for dataset_id, dataset in data_source.datasets.items():
+            original = self.storage.data_sources['synthetic'].datasets[dataset_id]
+            self.assertEqual(len(dataset.time_series), len(original.time_series))
+            for region, time_series in dataset.time_series.items():
+                # Regions are shared with the storage the data source is loaded into
+                self.assertIs(region, restored.regions[region.region_id])
+                self.assertIs(time_series.region, region)
+                pd.testing.assert_series_equal(time_series.series,
+                    original.time_series[self.storage.regions[region.region_id]].series)
+
+    def test_tfr_dataset(self):
+        self.checkpoint.save(self.storage, 'world_bank', COLLECTED)
+        restored = empty_storage(self.storage)
+
+        self.assertEqual(self.checkpoint.load(restored, 'world_bank'), COLLECTED)
+
+        self.assertIs(restored.tfr_dataset, restored.data_sources['world_bank'].datasets['tfr'])
+
+    def test_missing(self):
+        self.assertIsNone(self.checkpoint.load(Storage(), 'synthetic'))
+        self.assertIsNone(self.checkpoint.load_partial('synthetic'))
+
+    def test_unreadable(self):
+        os.makedirs(self.checkpoint.directory)
+        for name in ('synthetic.pkl', 'synthetic.partial.pkl'):
+            with open(os.path.join(self.checkpoint.directory, name), 'wb') as file:
+                file.write(b'truncated')
+        restored = Storage()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(self.checkpoint.load(restored, 'synthetic'))
+            self.assertIsNone(self.checkpoint.load_partial('synthetic'))
+        self.assertEqual(restored.data_sources, {})
+
+    def test_clear(self):
+        self.checkpoint.clear()
+        self.checkpoint.save(self.storage, 'synthetic', COLLECTED)
+        self.checkpoint.save_partial('other', {'a': 1})
+
+        self.checkpoint.clear()
+
+        self.assertEqual(os.listdir(self.checkpoint.directory), [])
+
+    def test_partial(self):
+        data = {('term', 'CZ'): pd.Series([1.0, 2.0], index=['2020', '2021'])}
+        self.checkpoint.save_partial('synthetic', data)
+
+        restored = self.checkpoint.load_partial('synthetic')
+        pd.testing.assert_series_equal(restored[('term', 'CZ')], data[('term', 'CZ')])
+
+        # Saving the collected data source supersedes the partial data
+        self.checkpoint.save(self.storage, 'synthetic', COLLECTED)
+        self.assertIsNone(self.checkpoint.load_partial('synthetic'))
+
+if __name__ == '__main__':
+    unittest.main()
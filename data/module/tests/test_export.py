@@ -0,0 +1,130 @@
+"""Tests of the static export"""
+
+import gzip
+import os
+import tempfile
+import unittest
+
+import brotli
+
+from lib import export
+
+class FakeConnection:
+    """Connection rendering fixed responses instead of querying the database"""
+
+    def __init__(self, responses: list[tuple], counted: list[tuple] = ()):
+        self.responses = responses
+        self.counted = list(counted)
+
+    def published_responses(self, responses, counts=()):
+        return self.responses, self.counted
+
+def tfr_response(body: str) -> tuple:
+    """Response of the time series of TFR in Czechia"""
+
+    return ('time_series', (('dataset', 'tfr'), ('region', 'cze')), None, body)
+
+class RequestTest(unittest.TestCase):
+    """Requests as the app makes them"""
+
+    def test_request(self):
+        self.assertEqual(export.request('region', ()), 'region')
+        self.assertEqual(export.request('time_series', (('dataset', 'tfr'), ('region', 'cze'))),
+            'time_series?dataset=eq.tfr&region=eq.cze')
+        self.assertEqual(export.request('dataset_summary', (('dataset', 'a b/ž'), ), ('n_series', )),
+            'dataset_summary?dataset=eq.a+b%2F%C5%BE&select=n_series')
+        self.assertEqual(export.request('overall_summary', (), ('n_series', 'n_correlations')),
+            'overall_summary?select=n_series%2Cn_correlations')
+
+class ExportSnapshotTest(unittest.TestCase):
+    """Files written, retained and removed by successive exports"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def export(self, run_id: int, body: str, counted=()) -> tuple[dict, dict]:
+        stats = export.export_snapshot(FakeConnection([
+            ('region', (), None, '[]'),
+            tfr_response(body),
+        ], counted), run_id, self.directory)
+
+        return stats, export.read_manifest(self.directory)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def test_manifest(self):
+        stats, manifest = self.export(1, '[1]', [('dataset', (('data_source', 'who'), ), 3)])
+
+        self.assertEqual(set(manifest), {'run', 'files', 'counts', 'retained'})
+        self.assertEqual(manifest['run'], 1)
+        self.assertEqual(set(manifest['files']), {'region', 'time_series?dataset=eq.tfr&region=eq.cze'})
+        self.assertEqual(manifest['counts'], {'dataset?data_source=eq.who': 3})
+        self.assertEqual(manifest['retained'], [])
+        self.assertEqual(stats, {'responses': 2, 'written': 2, 'removed': 0})
+
+        name = manifest['files']['time_series?dataset=eq.tfr&region=eq.cze']
+        self.assertTrue(name.startswith('time_series/dataset=tfr/region=cze.'))
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'[1]')
+        with open(path + '.gz', 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), b'[1]')
+        with open(path + '.br', 'rb') as file:
+            self.assertEqual(brotli.decompress(file.read()), b'[1]')
+
+    def test_unchanged_not_written(self):
+        _, first = self.export(1, '[1]')
+        stats, second = self.export(2, '[1]')
+
+        self.assertEqual(stats, {'responses': 2, 'written': 0, 'removed': 0})
+        self.assertEqual(second['files'], first['files'])
+        self.assertEqual(second['retained'], [])
+
+    def test_retained_then_removed(self):
+        _, first = self.export(1, '[1]')
+        old = first['files']['time_series?dataset=eq.tfr&region=eq.cze']
+        with open(os.path.join(self.directory, 'unrelated.json'), 'w', encoding='utf-8') as file:
+            file.write('{}')
+
+        # The previous file stays for clients that loaded the previous manifest
+        stats, second = self.export(2, '[2]')
+        self.assertEqual(second['retained'], [old])
+        self.assertEqual(stats['removed'], 0)
+        self.assertTrue(self.exists(old))
+
+        # Retained files are removed by the next export, with their compressed copies
+        stats, third = self.export(3, '[3]')
+        new = second['files']['time_series?dataset=eq.tfr&region=eq.cze']
+        self.assertEqual(third['retained'], [new])
+        self.assertEqual(stats['removed'], 3)
+        for extension in ('', '.gz', '.br'):
+            self.assertFalse(self.exists(old + extension))
+            self.assertTrue(self.exists(new + extension))
+        self.assertTrue(self.exists('unrelated.json'))
+        self.assertTrue(self.exists(export.MANIFEST))
+
+    def test_retained_file_referenced_again(self):
+        _, first = self.export(1, '[1]')
+        self.export(2, '[2]')
+
+        stats, third = self.export(3, '[1]')
+
+        # The file of the first export is current again and not removed
+        old = first['files']['time_series?dataset=eq.tfr&region=eq.cze']
+        self.assertEqual(third['files']['time_series?dataset=eq.tfr&region=eq.cze'], old)
+        self.assertEqual(stats['removed'], 0)
+        self.assertTrue(self.exists(old))
+
+    def test_empty_directories_removed(self):
+        self.export(1, '[1]')
+        for run_id in (2, 3):
+            export.export_snapshot(FakeConnection([('region', (), None, '[]')]), run_id, self.directory)
+
+        self.assertFalse(self.exists('time_series'))
+        self.assertTrue(self.exists(export.MANIFEST))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""Tests of the download module"""
+
+import io
+import os
+import tempfile
+import time
+import unittest
+from email.message import Message
+from unittest import mock
+from urllib.error import HTTPError
+
+from lib.fetch import HttpCache, RateLimiter
+
+class FakeResponse(io.BytesIO):
+    """Response of urlopen with the given body and headers"""
+
+    def __init__(self, body: bytes, headers: dict = None):
+        super().__init__(body)
+        self.headers = Message()
+        for name, value in (headers or {}).items():
+            self.headers[name] = value
+
+def not_modified(request, timeout):
+    """urlopen answering 304 Not Modified"""
+
+    raise HTTPError(request.full_url, 304, 'Not Modified', Message(), None)
+
+class HttpCacheTest(unittest.TestCase):
+    """Cache hits, revalidation and eviction of the stored files"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def read(self, cache: HttpCache, url: str, urlopen) -> bytes:
+        with mock.patch('urllib.request.urlopen', side_effect=urlopen) as patched:
+            body = cache.read(url, timeout=1)
+        self.requests = [call.args[0] for call in patched.call_args_list]
+        return body
+
+    def test_download_without_stored_file(self):
+        cache = HttpCache(self.directory.name)
+
+        body = self.read(cache, 'https://example.com/a',
+            lambda request, timeout: FakeResponse(b'a', {'ETag': '"1"'}))
+
+        self.assertEqual(body, b'a')
+        self.assertEqual(len(self.requests), 1)
+        self.assertIsNone(self.requests[0].get_header('If-none-match'))
+        self.assertEqual(cache.stats['downloads'], 1)
+
+    def test_hit_within_max_age(self):
+        cache = HttpCache(self.directory.name, max_age=60)
+        self.read(cache, 'https://example.com/a', lambda request, timeout: FakeResponse(b'a'))
+
+        body = self.read(cache, 'https://example.com/a', not_modified)
+
+        self.assertEqual(body, b'a')
+        self.assertEqual(self.requests, [])
+        self.assertEqual(cache.stats['hits'], 1)
+
+    def test_revalidation_uses_stored_body(self):
+        cache = HttpCache(self.directory.name)
+        self.read(cache, 'https://example.com/a', lambda request, timeout: FakeResponse(b'a',
+            {'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}))
+
+        body = self.read(cache, 'https://example.com/a', not_modified)
+
+        self.assertEqual(body, b'a')
+        self.assertEqual(self.requests[0].get_header('If-none-match'), '"1"')
+        self.assertEqual(self.requests[0].get_header('If-modified-since'), 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertEqual(cache.stats['revalidated'], 1)
+
+    def test_changed_file_downloaded_again(self):
+        cache = HttpCache(self.directory.name)
+        self.read(cache, 'https://example.com/a', lambda request, timeout: FakeResponse(b'a'))
+
+        body = self.read(cache, 'https://example.com/a', lambda request, timeout: FakeResponse(b'b'))
+
+        self.assertEqual(body, b'b')
+        self.assertEqual(cache.stats['downloads'], 2)
+
+    def test_not_modified_without_stored_file(self):
+        cache = HttpCache(self.directory.name)
+
+        with self.assertRaises(HTTPError):
+            self.read(cache, 'https://example.com/a', not_modified)
+
+    def test_offline(self):
+        self.read(HttpCache(self.directory.name), 'https://example.com/a',
+            lambda request, timeout: FakeResponse(b'a'))
+        cache = HttpCache(self.directory.name, offline=True)
+
+        self.assertEqual(self.read(cache, 'https://example.com/a', not_modified), b'a')
+        self.assertEqual(self.requests, [])
+        with self.assertRaises(LookupError):
+            self.read(cache, 'https://example.com/b', not_modified)
+
+    def test_evicts_least_recently_used(self):
+        cache = HttpCache(self.directory.name, max_age=60, max_size=25)
+        for url in ('https://example.com/a', 'https://example.com/b'):
+            self.read(cache, url, lambda request, timeout: FakeResponse(b'x' * 10))
+
+        # The first file is used again, the second one becomes the least recently used
+        past = time.time() - 10
+        for name in os.listdir(self.directory.name):
+            os.utime(os.path.join(self.directory.name, name), (past, past))
+        self.read(cache, 'https://example.com/a', not_modified)
+        self.read(cache, 'https://example.com/c', lambda request, timeout: FakeResponse(b'x' * 10))
+
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if name.endswith('.body')]), 2)
+        self.assertEqual(self.read(cache, 'https://example.com/a', not_modified), b'x' * 10)
+        self.assertEqual(self.read(cache, 'https://example.com/c', not_modified), b'x' * 10)
+        with self.assertRaises(HTTPError):
+            self.read(cache, 'https://example.com/b', not_modified)
+
+class RateLimiterTest(unittest.TestCase):
+    """Adapting the rate of requests and waiting for them"""
+
+    def test_throttled_halves_rate(self):
+        limiter = RateLimiter(rate=1, min_rate=0.3)
+
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 0.5)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 0.3)
+
+    def test_succeeded_recovers_up_to_max_rate(self):
+        limiter = RateLimiter(rate=1, recovery=0.25)
+        limiter.throttled()
+        limiter.throttled()
+
+        limiter.succeeded()
+        self.assertEqual(limiter.rate, 0.5)
+        for _ in range(3):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 1)
+
+    def test_acquire_waits_for_token(self):
+        clock = [100.0]
+        sleeps = []
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        with mock.patch('time.monotonic', lambda: clock[0]), mock.patch('time.sleep', sleep):
+            limiter = RateLimiter(rate=2)
+            limiter.acquire()
+            self.assertEqual(sleeps, [])
+
+            limiter.acquire()
+            self.assertEqual(sleeps, [0.5])
+
+            clock[0] += 0.2
+            limiter.acquire()
+            self.assertAlmostEqual(sleeps[-1], 0.3)
+
+            # A refused request empties the bucket at the reduced rate
+            limiter.throttled()
+            limiter.acquire()
+            self.assertEqual(sleeps[-1], 1)
+
+            clock[0] += 5
+            limiter.acquire()
+            self.assertEqual(len(sleeps), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests of the fingerprints of the processed records"""
+
+import unittest
+
+from lib.incremental import Changes, derived_fingerprint, fingerprints
+from lib.storage import Dataset, TimeSeries
+from lib.synthetic import synthetic_storage
+
+def build():
+    """Small storage, the same each time"""
+
+    return synthetic_storage(regions=4, datasets=2, years=20, seed=0)
+
+class FingerprintsTest(unittest.TestCase):
+    """Which records a change of the storage affects"""
+
+    def test_stable(self):
+        self.assertEqual(fingerprints(build()), fingerprints(build()))
+
+    def test_keys(self):
+        storage = build()
+
+        keys = set(fingerprints(storage))
+
+        expected = {(dataset.dataset_id, '') for data_source in storage.data_sources.values()
+            for dataset in data_source.datasets.values()}
+        expected |= {(dataset.dataset_id, region.region_id) for data_source in storage.data_sources.values()
+            for dataset in data_source.datasets.values() for region in dataset.time_series}
+        self.assertEqual(keys, expected)
+
+    def test_changed_series(self):
+        storage = build()
+        dataset = storage.data_sources['synthetic'].datasets['synthetic_0']
+        region = next(iter(dataset.time_series))
+        time_series = dataset.time_series[region]
+        time_series.series = time_series.series * 2
+
+        changed = {key for key, value in fingerprints(storage).items() if fingerprints(build())[key] != value}
+
+        self.assertEqual(changed, {('synthetic_0', region.region_id), ('synthetic_0', '')})
+
+    def test_changed_metadata(self):
+        storage = build()
+        storage.data_sources['synthetic'].datasets['synthetic_1'].name = 'Renamed'
+
+        changed = {key for key, value in fingerprints(storage).items() if fingerprints(build())[key] != value}
+
+        self.assertEqual(changed, {('synthetic_1', '')})
+
+    def test_changed_tfr(self):
+        storage = build()
+        region = storage.regions['r001']
+        time_series = storage.tfr_dataset.time_series[region]
+        time_series.series = time_series.series + 0.1
+
+        changed = {key for key, value in fingerprints(storage).items() if fingerprints(build())[key] != value}
+
+        # Every dataset depends on all TFR values, time series only on those of their region
+        datasets = {key[0] for key in fingerprints(storage)}
+        expected = {(dataset_id, '') for dataset_id in datasets}
+        expected |= {key for key in fingerprints(storage) if key[1] == 'r001'}
+        self.assertEqual(changed, expected)
+
+    def test_derived_dataset(self):
+        storage = build()
+        data_source = storage.data_sources['synthetic']
+        dataset = Dataset('derived', data_source, 'Derived', 'Computed from TFR', '/', '')
+        dataset.parameters = 'parameters'
+        for region, tfr in storage.tfr_dataset.time_series.items():
+            dataset.add_time_series(TimeSeries(data_source, dataset, region, tfr.series * 3))
+        data_source.add_dataset(dataset)
+
+        results = fingerprints(storage)
+
+        for region, tfr in storage.tfr_dataset.time_series.items():
+            self.assertEqual(results[('derived', region.region_id)],
+                derived_fingerprint(tfr.series, 'parameters'))
+            self.assertNotEqual(results[('derived', region.region_id)],
+                derived_fingerprint(tfr.series, 'other parameters'))
+
+class ChangesTest(unittest.TestCase):
+    """Records reused from the previous run"""
+
+    def test_unchanged_reused(self):
+        previous = fingerprints(build())
+
+        changes = Changes(build(), previous, run_id=1)
+
+        self.assertEqual(changes.reused, set(previous))
+        self.assertEqual(changes.changed, 0)
+        self.assertEqual(changes.run_id, 1)
+
+    def test_changed_not_reused(self):
+        previous = fingerprints(build())
+        storage = build()
+        dataset = storage.data_sources['synthetic'].datasets['synthetic_0']
+        region = next(iter(dataset.time_series))
+        dataset.time_series[region].series = dataset.time_series[region].series * 2
+
+        changes = Changes(storage, previous, run_id=1)
+
+        self.assertEqual(changes.changed, 2)
+        self.assertTrue(changes.is_changed(dataset))
+        self.assertTrue(changes.is_changed(dataset, dataset.time_series[region]))
+        other = next(iter(set(dataset.time_series) - {region}))
+        self.assertFalse(changes.is_changed(dataset, dataset.time_series[other]))
+
+    def test_reuse(self):
+        previous = {('derived', 'r000'): 'a'}
+        changes = Changes(build(), previous, run_id=1)
+
+        self.assertFalse(changes.reuse('derived', 'r001'))
+        self.assertFalse(changes.reuse('derived', 'r000', 'b'))
+        self.assertNotIn(('derived', 'r000'), changes.reused)
+        self.assertTrue(changes.reuse('derived', 'r000', 'a'))
+        self.assertIn(('derived', 'r000'), changes.reused)
+
+    def test_reuse_any_fingerprint(self):
+        changes = Changes(build(), {('derived', ''): 'a'}, run_id=1)
+
+        self.assertTrue(changes.reuse('derived'))
+        self.assertIn(('derived', ''), changes.reused)
+
+if __name__ == '__main__':
+    unittest.main()
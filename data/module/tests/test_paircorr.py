@@ -0,0 +1,101 @@
+"""Tests of the lagged pairwise correlations"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+from scipy.stats import linregress
+
+from lib.synthetic import synthetic_storage
+from processors import paircorr
+
+def reference_best_lag(tfr: pd.Series, other: pd.Series, maxlags: int = 5) -> tuple:
+    """Best lag regressed one lag at a time with scipy.stats.linregress, see paircorr.best_lag"""
+
+    tfr = tfr.set_axis(tfr.index.astype(int))
+    other = other.set_axis(other.index.astype(int))
+    min_length = int(max(8, min(tfr.index[-1] - tfr.index[0], other.index[-1] - other.index[0]) / 2))
+
+    best = (None, None, None, None, None, None)
+    for lag in range(-maxlags, maxlags):
+        # The other value of year + lag is paired with the TFR value of year
+        start = max(tfr.index[0], other.index[0] - lag)
+        end = min(tfr.index[-1], other.index[-1] - lag)
+        if end - start + 1 < min_length:
+            continue
+
+        result = linregress(tfr.loc[start:end], other.loc[start + lag:end + lag])
+        if abs(result[2]) > (abs(best[3]) if best[0] is not None else 0):
+            best = (lag, ) + tuple(result)
+
+    return best
+
+def random_pair(rng: np.random.Generator) -> tuple[pd.Series, pd.Series]:
+    """TFR and other differenced series over random years"""
+
+    tfr_start = 1980 + rng.integers(0, 10)
+    tfr_end = 2021 - rng.integers(0, 5)
+    other_start = 1980 + rng.integers(0, 30)
+    other_end = other_start + rng.integers(1, 40)
+
+    tfr = pd.Series(rng.normal(size=tfr_end - tfr_start + 1),
+        index=[str(year) for year in range(tfr_start, tfr_end + 1)])
+    other = pd.Series(rng.normal(size=other_end - other_start + 1).cumsum(),
+        index=[str(year) for year in range(other_start, other_end + 1)])
+
+    return tfr, other
+
+class BestLagsTest(unittest.TestCase):
+    """Batched lag search against regressing each lag separately"""
+
+    def assert_same_result(self, result: tuple, expected: tuple):
+        self.assertEqual(result[0], expected[0])
+        if expected[0] is not None:
+            np.testing.assert_allclose(result[1:], expected[1:], rtol=1e-9, atol=1e-12)
+
+    def test_matches_reference(self):
+        rng = np.random.default_rng(0)
+        pairs = [random_pair(rng) for _ in range(300)]
+        tfr, other = [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+        results = paircorr.best_lags(tfr, other)
+
+        self.assertEqual(len(results), len(pairs))
+        self.assertTrue(any(result[0] is None for result in results))
+        for pair, result in zip(pairs, results):
+            self.assert_same_result(result, reference_best_lag(*pair))
+
+    def test_batches_do_not_change_results(self):
+        rng = np.random.default_rng(1)
+        pairs = [random_pair(rng) for _ in range(50)]
+        tfr, other = [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+        results = paircorr.best_lags(tfr, other, batch_size=7)
+
+        for pair, result in zip(pairs, results):
+            self.assert_same_result(result, paircorr.best_lag(*pair))
+
+    def test_integer_years(self):
+        rng = np.random.default_rng(2)
+        tfr, other = random_pair(rng)
+        other = other.set_axis(other.index.astype(int))
+
+        self.assert_same_result(paircorr.best_lag(tfr, other), reference_best_lag(tfr, other))
+
+    def test_process_batched_as_one_by_one(self):
+        batched = synthetic_storage(regions=8, datasets=3, years=40, missing=0.1, seed=3)
+        one_by_one = synthetic_storage(regions=8, datasets=3, years=40, missing=0.1, seed=3)
+
+        paircorr.process(batched)
+        paircorr.process(one_by_one, batched=False)
+
+        for data_source_id, data_source in batched.data_sources.items():
+            for dataset_id, dataset in data_source.datasets.items():
+                for region, time_series in dataset.time_series.items():
+                    expected = one_by_one.data_sources[data_source_id].datasets[dataset_id] \
+                        .time_series[one_by_one.regions[region.region_id]]
+                    self.assertEqual(time_series.lag, expected.lag)
+                    np.testing.assert_allclose(time_series.r_value, expected.r_value, rtol=1e-9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests of the vectorized linear regression"""
+
+import unittest
+
+import numpy as np
+from scipy.stats import linregress
+
+from lib.regression import linregress_batch
+
+class LinregressBatchTest(unittest.TestCase):
+    """linregress_batch against scipy.stats.linregress"""
+
+    def assert_matches_scipy(self, x: np.ndarray, y: np.ndarray, results: tuple):
+        expected = linregress(x, y)
+        for value, expected_value in zip(results, expected):
+            self.assertTrue(np.isclose(value, expected_value, rtol=1e-9, atol=1e-12),
+                f'{value} != {expected_value}')
+
+    def test_rows_match_scipy(self):
+        rng = np.random.default_rng(0)
+        x = rng.normal(size=(50, 20))
+        y = 0.3 * x + rng.normal(size=(50, 20))
+
+        results = linregress_batch(x, y)
+
+        for row in range(x.shape[0]):
+            self.assert_matches_scipy(x[row], y[row], [values[row] for values in results[:5]])
+        self.assertTrue((results[5] == 20).all())
+
+    def test_mask_and_nans_leave_out_points(self):
+        rng = np.random.default_rng(1)
+        x = rng.normal(size=(30, 15))
+        y = rng.normal(size=(30, 15))
+        x[rng.random(x.shape) < 0.1] = np.nan
+        y[rng.random(y.shape) < 0.1] = np.nan
+        mask = rng.random(x.shape) < 0.8
+
+        results = linregress_batch(x, y, mask)
+
+        for row in range(x.shape[0]):
+            used = mask[row] & ~np.isnan(x[row]) & ~np.isnan(y[row])
+            self.assertEqual(results[5][row], used.sum())
+            if used.sum() >= 3:
+                self.assert_matches_scipy(x[row, used], y[row, used], [values[row] for values in results[:5]])
+
+    def test_broadcasts_other_axes(self):
+        rng = np.random.default_rng(2)
+        x = rng.normal(size=(4, 1, 12))
+        y = rng.normal(size=(1, 3, 12))
+
+        results = linregress_batch(x, y)
+
+        self.assertEqual(results[0].shape, (4, 3))
+        self.assert_matches_scipy(x[2, 0], y[0, 1], [values[2, 1] for values in results[:5]])
+
+    def test_perfect_correlation(self):
+        x = np.arange(10.0)
+
+        slope, intercept, r_value, p_value, std_err, n = linregress_batch(x, 2 * x + 1)
+
+        self.assertAlmostEqual(slope, 2)
+        self.assertAlmostEqual(intercept, 1)
+        self.assertAlmostEqual(r_value, 1)
+        self.assertAlmostEqual(p_value, 0)
+        self.assertAlmostEqual(std_err, 0)
+        self.assertEqual(n, 10)
+
+    def test_too_few_points_or_constant_x_give_nan(self):
+        x = np.array([[1.0, 2.0, np.nan, np.nan], [3.0, 3.0, 3.0, 3.0]])
+        y = np.array([[1.0, 2.0, 3.0, 4.0], [1.0, 2.0, 3.0, 4.0]])
+
+        results = linregress_batch(x, y)
+
+        for values in results[:5]:
+            self.assertTrue(np.isnan(values).all())
+        self.assertEqual(results[5].tolist(), [2, 4])
+
+if __name__ == '__main__':
+    unittest.main()
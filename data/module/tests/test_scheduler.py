@@ -0,0 +1,101 @@
+"""Tests of the task scheduling"""
+
+import contextlib
+import io
+import threading
+import unittest
+
+from lib.scheduler import DependencyFailed, Scheduler
+
+class SchedulerTest(unittest.TestCase):
+    """Order of the tasks and handling of their failures"""
+
+    def setUp(self):
+        self.done: list[str] = []
+        self.lock = threading.Lock()
+
+    def task(self, name: str, fail: bool = False):
+        """Function recording that the task ran"""
+
+        def function():
+            with self.lock:
+                self.done.append(name)
+            if fail:
+                raise RuntimeError(name)
+
+        return function
+
+    def run_quietly(self, scheduler: Scheduler) -> dict[str, BaseException]:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return scheduler.run()
+
+    def test_dependencies_first(self):
+        for max_workers in (1, None):
+            self.done = []
+            scheduler = Scheduler(max_workers)
+            # Added before their dependencies
+            scheduler.add('save', self.task('save'), requires=['process', 'collect'])
+            scheduler.add('process', self.task('process'), requires=['collect'])
+            scheduler.add('collect', self.task('collect'))
+
+            self.assertEqual(scheduler.run(), {})
+            self.assertEqual(self.done, ['collect', 'process', 'save'])
+
+    def test_independent_tasks_concurrent(self):
+        barrier = threading.Barrier(2, timeout=5)
+        scheduler = Scheduler()
+        scheduler.add('a', barrier.wait)
+        scheduler.add('b', barrier.wait)
+
+        self.assertEqual(scheduler.run(), {})
+
+    def test_failed_requirement_skips(self):
+        scheduler = Scheduler()
+        scheduler.add('collect', self.task('collect', fail=True))
+        scheduler.add('process', self.task('process'), requires=['collect'])
+        scheduler.add('save', self.task('save'), requires=['process'])
+        scheduler.add('other', self.task('other'))
+
+        errors = self.run_quietly(scheduler)
+
+        self.assertEqual(set(errors), {'collect', 'process', 'save'})
+        self.assertIsInstance(errors['collect'], RuntimeError)
+        self.assertIsInstance(errors['process'], DependencyFailed)
+        self.assertIsInstance(errors['save'], DependencyFailed)
+        self.assertEqual(sorted(self.done), ['collect', 'other'])
+
+    def test_after_runs_on_failure(self):
+        scheduler = Scheduler()
+        scheduler.add('cleanup', self.task('cleanup'), after=['collect'])
+        scheduler.add('collect', self.task('collect', fail=True))
+
+        errors = self.run_quietly(scheduler)
+
+        self.assertEqual(set(errors), {'collect'})
+        self.assertEqual(self.done, ['collect', 'cleanup'])
+
+    def test_cycle(self):
+        scheduler = Scheduler()
+        scheduler.add('a', self.task('a'), requires=['b'])
+        scheduler.add('b', self.task('b'), after=['a'])
+
+        with self.assertRaises(ValueError):
+            scheduler.run()
+        self.assertEqual(self.done, [])
+
+    def test_unknown_task(self):
+        scheduler = Scheduler()
+        scheduler.add('a', self.task('a'), requires=['b'])
+
+        with self.assertRaises(ValueError):
+            scheduler.run()
+
+    def test_duplicate_task(self):
+        scheduler = Scheduler()
+        scheduler.add('a', self.task('a'))
+
+        with self.assertRaises(ValueError):
+            scheduler.add('a', self.task('a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Tests of the JSON serialization"""
+
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib import serialization
+
+class EncodeSeriesTest(unittest.TestCase):
+    """Encoded series read back like pandas.Series.to_json"""
+
+    def assert_like_to_json(self, encoded: str, series: pd.Series):
+        result = json.loads(encoded)
+        expected = json.loads(series.to_json())
+
+        self.assertEqual(list(result), list(expected))
+        for year, value in expected.items():
+            if value is None or isinstance(value, bool):
+                self.assertEqual(result[year], value)
+            else:
+                self.assertAlmostEqual(result[year], value, delta=5e-11)
+
+    def test_floats(self):
+        rng = np.random.default_rng(0)
+        values = np.concatenate([rng.normal(size=500), rng.normal(size=100) * 1e-6,
+            rng.normal(size=100) * 1e9, [0.0, -0.0, 0.1 + 0.2, 1e-20, 123456789.0]])
+        series = pd.Series(values, index=[str(year) for year in range(values.size)])
+
+        self.assert_like_to_json(serialization.encode_series(series), series)
+
+    def test_exact_values(self):
+        series = pd.Series([0.3, 2.5, -1.0], index=['1990', '1991', '1992'])
+
+        self.assertEqual(json.loads(serialization.encode_series(series)), {'1990': 0.3, '1991': 2.5, '1992': -1.0})
+
+    def test_missing_values_null(self):
+        series = pd.Series([np.nan, np.inf, -np.inf, 1.5], index=['2000', '2001', '2002', '2003'])
+
+        self.assertEqual(serialization.encode_series(series), '{"2000":null,"2001":null,"2002":null,"2003":1.5}')
+        self.assert_like_to_json(serialization.encode_series(series), series)
+
+    def test_integer_index_and_values(self):
+        for series in (pd.Series([1, 2, 3], index=[1990, 1991, 1992]),
+                pd.Series([True, False], index=[2000, 2001])):
+            encoded = serialization.encode_series(series)
+            self.assert_like_to_json(encoded, series)
+            self.assertEqual(encoded, series.to_json())
+
+    def test_empty(self):
+        self.assertEqual(serialization.encode_series(pd.Series(dtype='float64')), '{}')
+
+    def test_encode_many(self):
+        series = [
+            pd.Series([1.25, np.nan], index=['2000', '2001']),
+            pd.Series(dtype='float64'),
+            pd.Series([3, 4], index=[2010, 2011]),
+        ]
+
+        self.assertEqual(serialization.encode_many(series),
+            [serialization.encode_series(item.astype(np.float64)) for item in series])
+        self.assertEqual(serialization.encode_many([]), [])
+
+class EncodeRowsTest(unittest.TestCase):
+    """Rows of a matrix encoded with their present years"""
+
+    def test_present_years(self):
+        values = np.array([[1.5, np.nan, 2.0], [np.nan, np.nan, np.nan], [0.1, 0.2, 0.3]])
+        present = np.array([[True, True, False], [False, False, False], [True, True, True]])
+
+        encoded = serialization.encode_rows(['2000', '2001', '2002'], values, present)
+
+        # Absent years are left out, present NaN values are null
+        self.assertEqual([json.loads(row) for row in encoded], [
+            {'2000': 1.5, '2001': None},
+            {},
+            {'2000': 0.1, '2001': 0.2, '2002': 0.3},
+        ])
+
+    def test_like_encode_series(self):
+        rng = np.random.default_rng(1)
+        values = rng.normal(size=(20, 8))
+        present = rng.random(values.shape) < 0.7
+        years = [str(year) for year in range(2000, 2008)]
+
+        encoded = serialization.encode_rows(years, values, present)
+
+        for row, row_present, result in zip(values, present, encoded):
+            series = pd.Series(row, index=years)[row_present]
+            self.assertEqual(result, serialization.encode_series(series))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""Tests of the utility functions"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lib import utils
+
+class StripNansTest(unittest.TestCase):
+    """Leading and trailing missing values"""
+
+    def test_series(self):
+        series = pd.Series([np.nan, 1, np.nan, 2, np.nan, np.nan], index=list('abcdef'))
+
+        pd.testing.assert_series_equal(utils.strip_nans(series), series.loc['b':'d'])
+
+    def test_data_frame(self):
+        data = pd.DataFrame({'value': [np.nan, 1, 2]}, index=['1990', '1991', '1992'])
+
+        pd.testing.assert_frame_equal(utils.strip_nans(data), data.iloc[1:])
+
+    def test_without_values(self):
+        self.assertEqual(utils.strip_nans(pd.Series([np.nan, np.nan])).size, 0)
+        self.assertEqual(utils.strip_nans(pd.Series([], dtype='float64')).size, 0)
+
+class TrimInterpolateRowsTest(unittest.TestCase):
+    """Rows stripped and interpolated like single series"""
+
+    def test_like_series_interpolate(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=(200, 12))
+        values[rng.random(values.shape) < 0.4] = np.nan
+        values[0] = np.nan
+        index = [str(year) for year in range(2000, 2012)]
+
+        results = utils.trim_interpolate_rows(values, index, name='value')
+
+        self.assertEqual(len(results), len(values))
+        for row, result in zip(values, results):
+            expected = utils.strip_nans(pd.Series(row, index=index, name='value')).interpolate()
+            pd.testing.assert_series_equal(result, expected, check_index_type=False)
+
+    def test_empty_matrix(self):
+        self.assertEqual(utils.trim_interpolate_rows(np.empty((0, 3)), ['a', 'b', 'c']), [])
+        self.assertEqual([series.size for series in utils.trim_interpolate_rows(np.empty((2, 0)), [])], [0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -50,10 +50,53 @@ SET default_tablespace = '';
 SET default_table_access_method = heap;
 
 --
--- Name: data_source; Type: TABLE; Schema: public; Owner: $POSTGRES_USER
+-- Name: snapshot; Type: SCHEMA; Schema: -; Owner: $POSTGRES_USER
 --
 
-CREATE TABLE public.data_source (
+CREATE SCHEMA snapshot;
+
+
+ALTER SCHEMA snapshot OWNER TO $POSTGRES_USER;
+
+--
+-- Name: SCHEMA snapshot; Type: COMMENT; Schema: -; Owner: $POSTGRES_USER
+--
+
+COMMENT ON SCHEMA snapshot IS 'Snapshot bookkeeping and templates of the tables stored in each run_<id> schema';
+
+
+--
+-- Name: run; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.run (
+    id integer NOT NULL GENERATED ALWAYS AS IDENTITY,
+    created timestamp with time zone DEFAULT now() NOT NULL,
+    published timestamp with time zone
+);
+
+
+ALTER TABLE snapshot.run OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE run; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.run IS 'Data module runs, each stored in its own run_<id> schema';
+
+
+--
+-- Name: COLUMN run.published; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON COLUMN snapshot.run.published IS 'When the run was last published, the latest one is served by the public views';
+
+
+--
+-- Name: data_source; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.data_source (
     id character varying(128) NOT NULL,
     name text NOT NULL,
     description text,
@@ -61,34 +104,34 @@ CREATE TABLE public.data_source (
 );
 
 
-ALTER TABLE public.data_source OWNER TO $POSTGRES_USER;
+ALTER TABLE snapshot.data_source OWNER TO $POSTGRES_USER;
 
 --
--- Name: COLUMN data_source.name; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN data_source.name; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.data_source.name IS 'Data source display name';
+COMMENT ON COLUMN snapshot.data_source.name IS 'Data source display name';
 
 
 --
--- Name: COLUMN data_source.description; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN data_source.description; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.data_source.description IS 'Data source single-paragraph description';
+COMMENT ON COLUMN snapshot.data_source.description IS 'Data source single-paragraph description';
 
 
 --
--- Name: COLUMN data_source.url; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN data_source.url; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.data_source.url IS 'The original URL of the data source';
+COMMENT ON COLUMN snapshot.data_source.url IS 'The original URL of the data source';
 
 
 --
--- Name: dataset; Type: TABLE; Schema: public; Owner: $POSTGRES_USER
+-- Name: dataset; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE TABLE public.dataset (
+CREATE TABLE snapshot.dataset (
     id character varying(128) NOT NULL,
     data_source character varying(128) NOT NULL,
     name text NOT NULL,
@@ -101,62 +144,62 @@ CREATE TABLE public.dataset (
 );
 
 
-ALTER TABLE public.dataset OWNER TO $POSTGRES_USER;
+ALTER TABLE snapshot.dataset OWNER TO $POSTGRES_USER;
 
 --
--- Name: COLUMN dataset.data_source; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.data_source; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.data_source IS 'Parent data source';
+COMMENT ON COLUMN snapshot.dataset.data_source IS 'Parent data source';
 
 
 --
--- Name: COLUMN dataset.description; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.description; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.description IS 'Up to one paragraph about the data set';
+COMMENT ON COLUMN snapshot.dataset.description IS 'Up to one paragraph about the data set';
 
 
 --
--- Name: COLUMN dataset.url; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.url; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.url IS 'The original URL of the data source';
+COMMENT ON COLUMN snapshot.dataset.url IS 'The original URL of the data source';
 
 
 --
--- Name: COLUMN dataset.unit; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.unit; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.unit IS 'Unit of measurement of the data points';
+COMMENT ON COLUMN snapshot.dataset.unit IS 'Unit of measurement of the data points';
 
 
 --
--- Name: COLUMN dataset.p_values_per_year; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.p_values_per_year; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.p_values_per_year IS 'p-values for inter-region correlations per year';
+COMMENT ON COLUMN snapshot.dataset.p_values_per_year IS 'p-values for inter-region correlations per year';
 
 
 --
--- Name: COLUMN dataset.r_values_per_year; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.r_values_per_year; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.r_values_per_year IS 'r-values for inter-region correlations per year';
+COMMENT ON COLUMN snapshot.dataset.r_values_per_year IS 'r-values for inter-region correlations per year';
 
 
 --
--- Name: COLUMN dataset.correlation_values_per_year; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN dataset.correlation_values_per_year; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.dataset.correlation_values_per_year IS 'Truth values for inter-region correlations per year';
+COMMENT ON COLUMN snapshot.dataset.correlation_values_per_year IS 'Truth values for inter-region correlations per year';
 
 
 --
--- Name: time_series; Type: TABLE; Schema: public; Owner: $POSTGRES_USER
+-- Name: time_series; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE TABLE public.time_series (
+CREATE TABLE snapshot.time_series (
     dataset character varying(128) NOT NULL,
     region character varying(128) NOT NULL,
     series json NOT NULL,
@@ -171,186 +214,706 @@ CREATE TABLE public.time_series (
 );
 
 
-ALTER TABLE public.time_series OWNER TO $POSTGRES_USER;
+ALTER TABLE snapshot.time_series OWNER TO $POSTGRES_USER;
 
 --
--- Name: COLUMN time_series.series; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN time_series.series; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.time_series.series IS 'Values of the dataset in a given region per year';
+COMMENT ON COLUMN snapshot.time_series.series IS 'Values of the dataset in a given region per year';
 
 
 --
--- Name: COLUMN time_series.processed_series; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN time_series.processed_series; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.time_series.processed_series IS 'Differenced values of the dataset in a given region per year';
+COMMENT ON COLUMN snapshot.time_series.processed_series IS 'Differenced values of the dataset in a given region per year';
 
 
 --
--- Name: COLUMN time_series.correlation; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN time_series.correlation; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON COLUMN public.time_series.correlation IS 'Whether this time series has a non-zero slope of linear regression with the TFR dataset';
+COMMENT ON COLUMN snapshot.time_series.correlation IS 'Whether this time series has a non-zero slope of linear regression with the TFR dataset';
 
 
 --
--- Name: low_p_value_time_series_by_dataset; Type: VIEW; Schema: public; Owner: $POSTGRES_USER
+-- Name: observation; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE VIEW public.low_p_value_time_series_by_dataset AS
- SELECT time_series.dataset,
-    avg(time_series.p_value) AS p_avg,
-    max(time_series.r_value) AS r_max,
-    min(time_series.r_value) AS r_min,
-    sum(time_series.r_value) AS r_sum,
-    sum(
-        CASE
-            WHEN (time_series.r_value > (0)::double precision) THEN 1
-            ELSE 0
-        END) AS n_positive,
-    sum(1) AS n_series
-   FROM public.time_series
-  WHERE (((time_series.dataset)::text <> 'tfr'::text) AND (abs(time_series.p_value) < (0.05)::double precision))
-  GROUP BY time_series.dataset
-  ORDER BY (sum(1)) DESC;
+CREATE TABLE snapshot.observation (
+    dataset character varying(128) NOT NULL,
+    region character varying(128) NOT NULL,
+    year integer NOT NULL,
+    value double precision NOT NULL,
+    processed_value double precision
+);
 
 
-ALTER TABLE public.low_p_value_time_series_by_dataset OWNER TO $POSTGRES_USER;
+ALTER TABLE snapshot.observation OWNER TO $POSTGRES_USER;
 
 --
--- Name: VIEW low_p_value_time_series_by_dataset; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: TABLE observation; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.observation IS 'Values of the time series, one row per year, for queries of year ranges and multiple regions';
+
+
+--
+-- Name: COLUMN observation.processed_value; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON COLUMN snapshot.observation.processed_value IS 'Differenced value of the year, empty for the first year';
+
+
+--
+-- Name: inter_region_correlation; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.inter_region_correlation (
+    dataset character varying(128) NOT NULL,
+    year integer NOT NULL,
+    p_value double precision,
+    r_value double precision,
+    correlation boolean NOT NULL
+);
+
+
+ALTER TABLE snapshot.inter_region_correlation OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE inter_region_correlation; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.inter_region_correlation IS 'Inter-region correlations of the datasets, one row per year';
+
+
+--
+-- Name: dataset_summary; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.dataset_summary (
+    dataset character varying(128) NOT NULL,
+    n_series integer NOT NULL,
+    n_correlations integer NOT NULL,
+    regions character varying(128)[] NOT NULL,
+    correlating_regions character varying(128)[] NOT NULL,
+    non_correlating_regions character varying(128)[] NOT NULL,
+    n_low_p_value integer NOT NULL,
+    n_positive integer NOT NULL,
+    p_avg double precision,
+    r_max real,
+    r_min real,
+    r_sum double precision
+);
+
+
+ALTER TABLE snapshot.dataset_summary OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE dataset_summary; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.dataset_summary IS 'Time series aggregates by dataset, computed once the run is saved';
+
+
+--
+-- Name: COLUMN dataset_summary.non_correlating_regions; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON COLUMN snapshot.dataset_summary.non_correlating_regions IS 'Regions with a processed time series without correlation';
+
+
+--
+-- Name: COLUMN dataset_summary.n_low_p_value; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON COLUMN snapshot.dataset_summary.n_low_p_value IS 'Number of time series with p-value < 0.05, the following columns aggregate only these';
+
+
+--
+-- Name: region_summary; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.region_summary (
+    region character varying(128) NOT NULL,
+    n_series integer NOT NULL,
+    n_correlations integer NOT NULL,
+    correlating_datasets character varying(128)[] NOT NULL
+);
+
+
+ALTER TABLE snapshot.region_summary OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE region_summary; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.region_summary IS 'Time series aggregates by region, computed once the run is saved';
+
+
+--
+-- Name: overall_summary; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.overall_summary (
+    n_series integer NOT NULL,
+    n_correlations integer NOT NULL
+);
+
+
+ALTER TABLE snapshot.overall_summary OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE overall_summary; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON VIEW public.low_p_value_time_series_by_dataset IS 'Number of time series with p-value < 0.05 by dataset';
+COMMENT ON TABLE snapshot.overall_summary IS 'Time series aggregates of the whole run in a single row, computed once the run is saved';
 
 
 --
--- Name: region; Type: TABLE; Schema: public; Owner: $POSTGRES_USER
+-- Name: region; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE TABLE public.region (
+CREATE TABLE snapshot.region (
     id character varying(128) NOT NULL,
     name text NOT NULL
 );
 
 
-ALTER TABLE public.region OWNER TO $POSTGRES_USER;
+ALTER TABLE snapshot.region OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE region; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.region IS 'Geographical region';
+
+
+--
+-- Name: fingerprint; Type: TABLE; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE TABLE snapshot.fingerprint (
+    dataset character varying(128) NOT NULL,
+    region character varying(128) NOT NULL,
+    value text NOT NULL
+);
+
+
+ALTER TABLE snapshot.fingerprint OWNER TO $POSTGRES_USER;
+
+--
+-- Name: TABLE fingerprint; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON TABLE snapshot.fingerprint IS 'Hashes of the inputs of the saved records, compared by incremental runs to find changed records';
+
 
 --
--- Name: TABLE region; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+-- Name: COLUMN fingerprint.region; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COMMENT ON TABLE public.region IS 'Geographical region';
+COMMENT ON COLUMN snapshot.fingerprint.region IS 'Region of a time series record, empty for a dataset record';
 
 
 --
--- Data for Name: data_source; Type: TABLE DATA; Schema: public; Owner: $POSTGRES_USER
+-- Data for Name: data_source; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COPY public.data_source (id, name, description, url) FROM stdin;
+COPY snapshot.data_source (id, name, description, url) FROM stdin;
 \.
 
 
 --
--- Data for Name: dataset; Type: TABLE DATA; Schema: public; Owner: $POSTGRES_USER
+-- Data for Name: dataset; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COPY public.dataset (id, data_source, name, description, url, unit, p_values_per_year, r_values_per_year, correlation_values_per_year) FROM stdin;
+COPY snapshot.dataset (id, data_source, name, description, url, unit, p_values_per_year, r_values_per_year, correlation_values_per_year) FROM stdin;
 \.
 
 
 --
--- Data for Name: region; Type: TABLE DATA; Schema: public; Owner: $POSTGRES_USER
+-- Data for Name: dataset_summary; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COPY public.region (id, name) FROM stdin;
+COPY snapshot.dataset_summary (dataset, n_series, n_correlations, regions, correlating_regions, non_correlating_regions, n_low_p_value, n_positive, p_avg, r_max, r_min, r_sum) FROM stdin;
 \.
 
 
 --
--- Data for Name: time_series; Type: TABLE DATA; Schema: public; Owner: $POSTGRES_USER
+-- Data for Name: fingerprint; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-COPY public.time_series (dataset, region, series, processed_series, lag, slope, intercept, r_value, p_value, std_err, correlation) FROM stdin;
+COPY snapshot.fingerprint (dataset, region, value) FROM stdin;
 \.
 
 
 --
--- Name: data_source data_source_pkey; Type: CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Data for Name: inter_region_correlation; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.data_source
+COPY snapshot.inter_region_correlation (dataset, year, p_value, r_value, correlation) FROM stdin;
+\.
+
+
+--
+-- Data for Name: observation; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COPY snapshot.observation (dataset, region, year, value, processed_value) FROM stdin;
+\.
+
+
+--
+-- Data for Name: overall_summary; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COPY snapshot.overall_summary (n_series, n_correlations) FROM stdin;
+\.
+
+
+--
+-- Data for Name: region; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COPY snapshot.region (id, name) FROM stdin;
+\.
+
+
+--
+-- Data for Name: region_summary; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COPY snapshot.region_summary (region, n_series, n_correlations, correlating_datasets) FROM stdin;
+\.
+
+
+--
+-- Data for Name: time_series; Type: TABLE DATA; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COPY snapshot.time_series (dataset, region, series, processed_series, lag, slope, intercept, r_value, p_value, std_err, correlation) FROM stdin;
+\.
+
+
+--
+-- Name: data_source data_source_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.data_source
     ADD CONSTRAINT data_source_pkey PRIMARY KEY (id);
 
 
 --
--- Name: dataset dataset_pkey; Type: CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: dataset dataset_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.dataset
+ALTER TABLE ONLY snapshot.dataset
     ADD CONSTRAINT dataset_pkey PRIMARY KEY (id);
 
 
 --
--- Name: region region_pkey; Type: CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: dataset_summary dataset_summary_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.region
+ALTER TABLE ONLY snapshot.dataset_summary
+    ADD CONSTRAINT dataset_summary_pkey PRIMARY KEY (dataset);
+
+
+--
+-- Name: fingerprint fingerprint_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.fingerprint
+    ADD CONSTRAINT fingerprint_pkey PRIMARY KEY (dataset, region);
+
+
+--
+-- Name: inter_region_correlation inter_region_correlation_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.inter_region_correlation
+    ADD CONSTRAINT inter_region_correlation_pkey PRIMARY KEY (dataset, year);
+
+
+--
+-- Name: observation observation_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.observation
+    ADD CONSTRAINT observation_pkey PRIMARY KEY (dataset, region, year) INCLUDE (value, processed_value);
+
+
+--
+-- Name: region region_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.region
     ADD CONSTRAINT region_pkey PRIMARY KEY (id);
 
 
 --
--- Name: time_series time_series_pkey; Type: CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: region_summary region_summary_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+ALTER TABLE ONLY snapshot.region_summary
+    ADD CONSTRAINT region_summary_pkey PRIMARY KEY (region);
+
+
+--
+-- Name: time_series time_series_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.time_series
+ALTER TABLE ONLY snapshot.time_series
     ADD CONSTRAINT time_series_pkey PRIMARY KEY (dataset, region);
 
 
 --
--- Name: fki_data_source_fkey; Type: INDEX; Schema: public; Owner: $POSTGRES_USER
+-- Name: fki_data_source_fkey; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX fki_data_source_fkey ON snapshot.dataset USING btree (data_source);
+
+
+--
+-- Name: fki_dataset_fkey; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX fki_dataset_fkey ON snapshot.time_series USING btree (dataset);
+
+
+--
+-- Name: fki_region_fkey; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX fki_region_fkey ON snapshot.time_series USING btree (region);
+
+
+--
+-- Name: observation_year_idx; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX observation_year_idx ON snapshot.observation USING btree (dataset, year) INCLUDE (region, value, processed_value);
+
+
+--
+-- Name: INDEX observation_year_idx; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON INDEX snapshot.observation_year_idx IS 'Covers queries of a year range of a dataset in all regions, the primary key covers queries of given regions';
+
+
+--
+-- Name: time_series_region_r_value_idx; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX time_series_region_r_value_idx ON snapshot.time_series USING btree (region, abs(r_value) DESC) WHERE (r_value IS NOT NULL);
+
+
+--
+-- Name: INDEX time_series_region_r_value_idx; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON INDEX snapshot.time_series_region_r_value_idx IS 'Strongest correlations of a region first, see top_correlations_in_region';
+
+
+--
+-- Name: time_series_dataset_r_value_idx; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX time_series_dataset_r_value_idx ON snapshot.time_series USING btree (dataset, abs(r_value) DESC) WHERE (r_value IS NOT NULL);
+
+
+--
+-- Name: INDEX time_series_dataset_r_value_idx; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON INDEX snapshot.time_series_dataset_r_value_idx IS 'Strongest correlations of a dataset first, see top_correlations_in_dataset';
+
+
+--
+-- Name: time_series_dataset_p_value_idx; Type: INDEX; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE INDEX time_series_dataset_p_value_idx ON snapshot.time_series USING btree (dataset, p_value) WHERE (p_value IS NOT NULL);
+
+
+--
+-- Name: INDEX time_series_dataset_p_value_idx; Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON INDEX snapshot.time_series_dataset_p_value_idx IS 'Lowest p-values of a dataset first, see low_p_value_time_series';
+
+
+--
+-- Name: dataset data_source_fkey; Type: FK CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE INDEX fki_data_source_fkey ON public.dataset USING btree (data_source);
+ALTER TABLE ONLY snapshot.dataset
+    ADD CONSTRAINT data_source_fkey FOREIGN KEY (data_source) REFERENCES snapshot.data_source(id) NOT VALID;
 
 
 --
--- Name: fki_dataset_fkey; Type: INDEX; Schema: public; Owner: $POSTGRES_USER
+-- Name: time_series dataset_fkey; Type: FK CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE INDEX fki_dataset_fkey ON public.time_series USING btree (dataset);
+ALTER TABLE ONLY snapshot.time_series
+    ADD CONSTRAINT dataset_fkey FOREIGN KEY (dataset) REFERENCES snapshot.dataset(id) NOT VALID;
 
 
 --
--- Name: fki_region_fkey; Type: INDEX; Schema: public; Owner: $POSTGRES_USER
+-- Name: time_series region_fkey; Type: FK CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-CREATE INDEX fki_region_fkey ON public.time_series USING btree (region);
+ALTER TABLE ONLY snapshot.time_series
+    ADD CONSTRAINT region_fkey FOREIGN KEY (region) REFERENCES snapshot.region(id) NOT VALID;
 
 
 --
--- Name: dataset data_source_fkey; Type: FK CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: run run_pkey; Type: CONSTRAINT; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.dataset
-    ADD CONSTRAINT data_source_fkey FOREIGN KEY (data_source) REFERENCES public.data_source(id) NOT VALID;
+ALTER TABLE ONLY snapshot.run
+    ADD CONSTRAINT run_pkey PRIMARY KEY (id);
 
 
 --
--- Name: time_series dataset_fkey; Type: FK CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: create_run(); Type: FUNCTION; Schema: snapshot; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.time_series
-    ADD CONSTRAINT dataset_fkey FOREIGN KEY (dataset) REFERENCES public.dataset(id) NOT VALID;
+CREATE FUNCTION snapshot.create_run() RETURNS integer
+    LANGUAGE plpgsql
+    AS \$function\$
+DECLARE
+    run_id integer;
+    run_schema name;
+    table_name name;
+BEGIN
+    INSERT INTO snapshot.run DEFAULT VALUES RETURNING id INTO run_id;
+    run_schema := 'run_' || run_id;
+
+    EXECUTE format('CREATE SCHEMA %I', run_schema);
+    FOREACH table_name IN ARRAY ARRAY['region', 'data_source', 'dataset', 'time_series', 'fingerprint',
+            'observation', 'inter_region_correlation', 'dataset_summary', 'region_summary',
+            'overall_summary'] LOOP
+        EXECUTE format('CREATE TABLE %I.%I (LIKE snapshot.%I INCLUDING ALL)',
+            run_schema, table_name, table_name);
+    END LOOP;
+
+    -- Foreign keys are not copied from the templates
+    EXECUTE format('ALTER TABLE %1\$I.dataset ADD CONSTRAINT data_source_fkey
+        FOREIGN KEY (data_source) REFERENCES %1\$I.data_source(id)', run_schema);
+    EXECUTE format('ALTER TABLE %1\$I.time_series ADD CONSTRAINT dataset_fkey
+        FOREIGN KEY (dataset) REFERENCES %1\$I.dataset(id)', run_schema);
+    EXECUTE format('ALTER TABLE %1\$I.time_series ADD CONSTRAINT region_fkey
+        FOREIGN KEY (region) REFERENCES %1\$I.region(id)', run_schema);
+    EXECUTE format('ALTER TABLE %1\$I.observation ADD CONSTRAINT time_series_fkey
+        FOREIGN KEY (dataset, region) REFERENCES %1\$I.time_series(dataset, region)', run_schema);
+    EXECUTE format('ALTER TABLE %1\$I.inter_region_correlation ADD CONSTRAINT dataset_fkey
+        FOREIGN KEY (dataset) REFERENCES %1\$I.dataset(id)', run_schema);
+
+    -- The overall summary has a single row, even before any data is saved
+    EXECUTE format('INSERT INTO %I.overall_summary VALUES (0, 0)', run_schema);
+
+    RETURN run_id;
+END
+\$function\$;
+
+
+ALTER FUNCTION snapshot.create_run() OWNER TO $POSTGRES_USER;
+
+--
+-- Name: FUNCTION create_run(); Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON FUNCTION snapshot.create_run() IS 'Create an empty run_<id> schema with the data, summary and fingerprint tables, return the run id';
+
+
+--
+-- Name: publish(integer, integer); Type: FUNCTION; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+CREATE FUNCTION snapshot.publish(run_id integer, keep integer DEFAULT NULL) RETURNS void
+    LANGUAGE plpgsql
+    AS \$function\$
+DECLARE
+    run_schema name := 'run_' || run_id;
+    table_name name;
+    old_run_id integer;
+BEGIN
+    PERFORM 1 FROM snapshot.run WHERE id = run_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Run % does not exist', run_id;
+    END IF;
+
+    -- Point the public views to the run, visible to readers at commit
+    FOREACH table_name IN ARRAY ARRAY['region', 'data_source', 'dataset', 'time_series',
+            'observation', 'inter_region_correlation', 'dataset_summary', 'region_summary',
+            'overall_summary'] LOOP
+        EXECUTE format('CREATE OR REPLACE VIEW public.%I AS SELECT * FROM %I.%I',
+            table_name, run_schema, table_name);
+    END LOOP;
+
+    UPDATE snapshot.run SET published = now() WHERE id = run_id;
+
+    -- Drop all but the latest runs, never the published one
+    IF keep IS NOT NULL THEN
+        FOR old_run_id IN SELECT id FROM snapshot.run WHERE id <> run_id
+                ORDER BY id DESC OFFSET greatest(keep - 1, 0) LOOP
+            EXECUTE format('DROP SCHEMA %I CASCADE', 'run_' || old_run_id);
+            DELETE FROM snapshot.run WHERE id = old_run_id;
+        END LOOP;
+    END IF;
+END
+\$function\$;
+
+
+ALTER FUNCTION snapshot.publish(integer, integer) OWNER TO $POSTGRES_USER;
+
+--
+-- Name: FUNCTION publish(integer, integer); Type: COMMENT; Schema: snapshot; Owner: $POSTGRES_USER
+--
+
+COMMENT ON FUNCTION snapshot.publish(integer, integer) IS 'Serve the run through the public views, keep only the given number of latest runs';
+
+
+--
+-- Publish an empty run to create the public region, data_source, dataset, time_series,
+-- observation, inter_region_correlation and summary views
+--
+
+SELECT snapshot.publish(snapshot.create_run());
+
+
+--
+-- Name: low_p_value_time_series_by_dataset; Type: VIEW; Schema: public; Owner: $POSTGRES_USER
+--
+
+CREATE VIEW public.low_p_value_time_series_by_dataset AS
+ SELECT dataset_summary.dataset,
+    dataset_summary.p_avg,
+    dataset_summary.r_max,
+    dataset_summary.r_min,
+    dataset_summary.r_sum,
+    dataset_summary.n_positive,
+    dataset_summary.n_low_p_value AS n_series
+   FROM public.dataset_summary
+  WHERE (((dataset_summary.dataset)::text <> 'tfr'::text) AND (dataset_summary.n_low_p_value > 0))
+  ORDER BY dataset_summary.n_low_p_value DESC;
+
+
+ALTER TABLE public.low_p_value_time_series_by_dataset OWNER TO $POSTGRES_USER;
+
+--
+-- Name: VIEW low_p_value_time_series_by_dataset; Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+--
+
+COMMENT ON VIEW public.low_p_value_time_series_by_dataset IS 'Number of time series with p-value < 0.05 by dataset, read from the dataset summaries';
+
+
+--
+-- Name: top_correlations_in_region(text, integer); Type: FUNCTION; Schema: public; Owner: $POSTGRES_USER
+--
+
+CREATE FUNCTION public.top_correlations_in_region(region_id text, k integer DEFAULT 10)
+    RETURNS TABLE(dataset character varying, region character varying, lag real, slope real, intercept real,
+        r_value real, p_value real, std_err real, correlation boolean)
+    LANGUAGE sql STABLE
+    AS \$function\$
+    SELECT dataset, region, lag, slope, intercept, r_value, p_value, std_err, correlation
+    FROM public.time_series
+    WHERE region = region_id AND r_value IS NOT NULL AND dataset <> 'tfr'
+    ORDER BY abs(r_value) DESC
+    LIMIT k
+\$function\$;
+
+
+ALTER FUNCTION public.top_correlations_in_region(text, integer) OWNER TO $POSTGRES_USER;
+
+--
+-- Name: FUNCTION top_correlations_in_region(text, integer); Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+--
+
+COMMENT ON FUNCTION public.top_correlations_in_region(text, integer) IS 'Time series of the region with the k largest absolute r-values of correlation with TFR, without the series';
+
+
+--
+-- Name: top_correlations_in_dataset(text, integer); Type: FUNCTION; Schema: public; Owner: $POSTGRES_USER
+--
+
+CREATE FUNCTION public.top_correlations_in_dataset(dataset_id text, k integer DEFAULT 10)
+    RETURNS TABLE(dataset character varying, region character varying, lag real, slope real, intercept real,
+        r_value real, p_value real, std_err real, correlation boolean)
+    LANGUAGE sql STABLE
+    AS \$function\$
+    SELECT dataset, region, lag, slope, intercept, r_value, p_value, std_err, correlation
+    FROM public.time_series
+    WHERE dataset = dataset_id AND r_value IS NOT NULL
+    ORDER BY abs(r_value) DESC
+    LIMIT k
+\$function\$;
+
+
+ALTER FUNCTION public.top_correlations_in_dataset(text, integer) OWNER TO $POSTGRES_USER;
+
+--
+-- Name: FUNCTION top_correlations_in_dataset(text, integer); Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+--
+
+COMMENT ON FUNCTION public.top_correlations_in_dataset(text, integer) IS 'Time series of the dataset with the k largest absolute r-values of correlation with TFR, without the series';
+
+
+--
+-- Name: low_p_value_time_series(text, double precision, integer); Type: FUNCTION; Schema: public; Owner: $POSTGRES_USER
+--
+
+CREATE FUNCTION public.low_p_value_time_series(dataset_id text, max_p_value double precision DEFAULT 0.05,
+        k integer DEFAULT NULL)
+    RETURNS TABLE(dataset character varying, region character varying, lag real, slope real, intercept real,
+        r_value real, p_value real, std_err real, correlation boolean)
+    LANGUAGE sql STABLE
+    AS \$function\$
+    SELECT dataset, region, lag, slope, intercept, r_value, p_value, std_err, correlation
+    FROM public.time_series
+    WHERE dataset = dataset_id AND p_value < max_p_value
+    ORDER BY p_value
+    LIMIT k
+\$function\$;
+
+
+ALTER FUNCTION public.low_p_value_time_series(text, double precision, integer) OWNER TO $POSTGRES_USER;
+
+--
+-- Name: FUNCTION low_p_value_time_series(text, double precision, integer); Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
+--
+
+COMMENT ON FUNCTION public.low_p_value_time_series(text, double precision, integer) IS 'Time series of the dataset with p-value below the limit, the lowest first, at most k of them if given, without the series';
+
+
+--
+-- Name: correlations_by_lag(text); Type: FUNCTION; Schema: public; Owner: $POSTGRES_USER
+--
+
+CREATE FUNCTION public.correlations_by_lag(dataset_id text DEFAULT NULL)
+    RETURNS TABLE(lag real, n_series bigint, n_correlations bigint, r_abs_avg double precision)
+    LANGUAGE sql STABLE
+    AS \$function\$
+    SELECT lag, count(*), count(*) FILTER (WHERE correlation), avg(abs(r_value))
+    FROM public.time_series
+    WHERE lag IS NOT NULL AND dataset <> 'tfr' AND (dataset_id IS NULL OR dataset = dataset_id)
+    GROUP BY lag
+    ORDER BY lag
+\$function\$;
+
 
+ALTER FUNCTION public.correlations_by_lag(text) OWNER TO $POSTGRES_USER;
 
 --
--- Name: time_series region_fkey; Type: FK CONSTRAINT; Schema: public; Owner: $POSTGRES_USER
+-- Name: FUNCTION correlations_by_lag(text); Type: COMMENT; Schema: public; Owner: $POSTGRES_USER
 --
 
-ALTER TABLE ONLY public.time_series
-    ADD CONSTRAINT region_fkey FOREIGN KEY (region) REFERENCES public.region(id) NOT VALID;
+COMMENT ON FUNCTION public.correlations_by_lag(text) IS 'Number of time series, correlations and the average absolute r-value by the lag of the correlation with TFR, of all datasets or of the given one';
 
 
 --
@@ -369,6 +932,16 @@ GRANT SELECT ON TABLE public.data_source TO $POSTGREST_ANON_ROLE;
 GRANT SELECT ON TABLE public.dataset TO $POSTGREST_ANON_ROLE;
 GRANT SELECT ON TABLE public.region TO $POSTGREST_ANON_ROLE;
 GRANT SELECT ON TABLE public.time_series TO $POSTGREST_ANON_ROLE;
+GRANT SELECT ON TABLE public.observation TO $POSTGREST_ANON_ROLE;
+GRANT SELECT ON TABLE public.inter_region_correlation TO $POSTGREST_ANON_ROLE;
+GRANT SELECT ON TABLE public.dataset_summary TO $POSTGREST_ANON_ROLE;
+GRANT SELECT ON TABLE public.region_summary TO $POSTGREST_ANON_ROLE;
+GRANT SELECT ON TABLE public.overall_summary TO $POSTGREST_ANON_ROLE;
+
+GRANT EXECUTE ON FUNCTION public.top_correlations_in_region(text, integer) TO $POSTGREST_ANON_ROLE;
+GRANT EXECUTE ON FUNCTION public.top_correlations_in_dataset(text, integer) TO $POSTGREST_ANON_ROLE;
+GRANT EXECUTE ON FUNCTION public.low_p_value_time_series(text, double precision, integer) TO $POSTGREST_ANON_ROLE;
+GRANT EXECUTE ON FUNCTION public.correlations_by_lag(text) TO $POSTGREST_ANON_ROLE;
 
 --
 -- PostgREST authentication part 2 complete